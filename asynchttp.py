@@ -0,0 +1,490 @@
+"""
+asynchttp.py	-- A small, non-threaded (asyncore) HTTP/1.1 server
+
+    All connections (including idle keep-alive and long-lived streaming ones)
+are handled by a single asyncore event loop, so thousands of clients don't
+each require an OS thread.  Only the (possibly expensive) application calls
+are made in a bounded executor pool of worker threads:
+
+    application( environ ) --> ( status, headers, body )
+
+        environ		-- A CGI-style dict: REQUEST_METHOD, PATH_INFO,
+                           QUERY_STRING, REMOTE_ADDR, HTTP_ACCEPT, ... and
+                           "asynchttp.input" (the request body, if any)
+        status		-- An HTTP status code (eg. 200)
+        headers		-- A list of ( header, value ) pairs
+        body		-- A str or buffer (sent without copying), or a 'stream'
+                           (written incrementally, from any thread, 'til closed
+                           by either end)
+
+    An application may raise HTTPError, to produce a specific HTTP status (and
+headers); any other exception produces a 500 Internal Server Error.
+
+"""
+from __future__ import with_statement
+
+import asynchat
+import asyncore
+import collections
+import errno
+import fcntl
+import httplib
+import logging
+import os
+import Queue
+import socket
+import sys
+import threading
+import time
+import urllib
+
+# The access log (at INFO), and failures (at ERROR, with their tracebacks)
+log			= logging.getLogger( "asynchttp" )
+log.addHandler( logging.NullHandler() )
+
+
+class HTTPError( Exception ):
+    """Raised by an application to produce the given HTTP status code, message
+    (the response body) and headers.
+    """
+    def __init__( self, status, message="", headers=None ):
+        Exception.__init__( self, "%d %s" % ( status, message ))
+        self.status		= status
+        self.message		= message
+        self.headers		= list( headers or [] )
+
+
+class executor( object ):
+    """A fixed pool of worker threads, calling each function submitted (in the
+    order submitted), and then its 'done' callback with the result.
+    """
+    def __init__( self, workers=4, name="executor" ):
+        self.queue		= Queue.Queue()
+        self.threads		= []
+        for i in range( workers ):
+            thread		= threading.Thread( target=self.work, name="%s-%d" % ( name, i ))
+            thread.daemon	= True
+            thread.start()
+            self.threads.append( thread )
+
+    def submit( self, function, done ):
+        """Call function() in a worker thread, and then done( result, failure );
+        if function raised an exception, result is None and failure is its
+        sys.exc_info().
+        """
+        self.queue.put( ( function, done ))
+
+    def work( self ):
+        while True:
+            function, done	= self.queue.get()
+            try:
+                result, failure	= function(), None
+            except Exception:
+                result, failure	= None, sys.exc_info()
+            try:
+                done( result, failure )
+            except Exception:
+                log.exception( "Executor callback failed" )
+
+
+class trigger( asyncore.file_dispatcher ):
+    """Allows any thread to have a function called in the asyncore loop's
+    thread, waking the loop (via a pipe) if necessary.
+    """
+    def __init__( self, map=None ):
+        r, w			= os.pipe()
+        asyncore.file_dispatcher.__init__( self, r, map=map )
+        os.close( r )		# file_dispatcher uses a dup
+        fcntl.fcntl( w, fcntl.F_SETFL, fcntl.fcntl( w, fcntl.F_GETFL ) | os.O_NONBLOCK )
+        self.wfd		= w
+        self.pending		= collections.deque()
+
+    def readable( self ):
+        return True
+
+    def writable( self ):
+        return False
+
+    def handle_connect( self ):
+        pass
+
+    def pull( self, function ):
+        self.pending.append( function )
+        try:
+            os.write( self.wfd, "x" )
+        except OSError:
+            pass		# Pipe full; a wake-up is already pending
+
+    def handle_read( self ):
+        try:
+            self.recv( 8192 )
+        except socket.error:
+            pass
+        while self.pending:
+            function		= self.pending.popleft()
+            try:
+                function()
+            except Exception:
+                log.exception( "Triggered function failed" )
+
+    def handle_close( self ):
+        pass
+
+
+class stream( object ):
+    """A response body written incrementally from any thread, 'til close() (or
+    'til the client disconnects).  If 'heartbeat' is supplied, it is written
+    whenever nothing else has been for 'interval' seconds (eg. to detect
+    departed clients).  Each of the 'closing' callables is called (in the event
+    loop thread) when the stream ends, for whatever reason.
+    """
+    def __init__( self, heartbeat=None, interval=15.0 ):
+        self.heartbeat		= heartbeat
+        self.interval		= interval
+        self.closing		= []
+        self.lock		= threading.Lock()
+        self.pending		= []	# data written before attached
+        self.connection		= None
+        self.closed		= False
+
+    def write( self, data ):
+        if isinstance( data, unicode ):
+            data		= data.encode( "utf-8" )
+        with self.lock:
+            if self.closed:
+                return
+            if self.connection is None:
+                self.pending.append( data )
+                return
+            conn		= self.connection
+        conn.server.trigger.pull( lambda: conn.stream_write( data ))
+
+    def close( self ):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed		= True
+            conn		= self.connection
+        if conn is not None:
+            conn.server.trigger.pull( conn.close_when_done )
+
+    def attach( self, conn ):
+        """Attach to a connection (in the event loop thread); flush anything
+        written so far.
+        """
+        with self.lock:
+            self.connection	= conn
+            pending, self.pending = self.pending, []
+            closed		= self.closed
+        for data in pending:
+            conn.stream_write( data )
+        if closed:
+            conn.close_when_done()
+
+    def detach( self ):
+        """The connection is gone (called in the event loop thread)."""
+        with self.lock:
+            self.closed		= True
+            self.connection	= None
+        for function in self.closing:
+            try:
+                function()
+            except Exception:
+                log.exception( "Stream closing function failed" )
+
+
+class connection( asynchat.async_chat ):
+    """One client connection.  Requests are parsed as they arrive, and handled
+    one at a time (in order; pipelining is supported).
+    """
+    ac_out_buffer_size		= 64 * 1024
+    max_header			= 64 * 1024
+    max_pending			= 16
+    __hash__			= object.__hash__ # Not the (deprecated) socket's
+
+    def __init__( self, server, sock, addr ):
+        asynchat.async_chat.__init__( self, sock=sock, map=server.map )
+        self.server		= server
+        self.addr		= addr
+        self.incoming		= []
+        self.length		= 0
+        self.head		= None
+        self.requests		= collections.deque()
+        self.busy		= False
+        self.stream		= None
+        self.active		= time.time()
+        self.set_terminator( "\r\n\r\n" )
+        server.connections.add( self )
+
+    def readable( self ):
+        return ( self.stream is not None
+                 or len( self.requests ) < self.max_pending ) and asynchat.async_chat.readable( self )
+
+    def collect_incoming_data( self, data ):
+        self.active		= time.time()
+        if self.stream is not None:
+            return		# Ignore anything sent after a streaming request
+        self.incoming.append( data )
+        self.length	       += len( data )
+        if self.head is None and self.length > self.max_header:
+            self.incoming	= []
+            self.requests.append( ( None, None ))	# Request too large
+            self.set_terminator( None )
+            self.next()
+
+    def found_terminator( self ):
+        data			= "".join( self.incoming )
+        self.incoming		= []
+        self.length		= 0
+        if self.head is None:
+            # Request line and headers; is there a body to follow?
+            self.head		= data.lstrip( "\r\n" )
+            length		= 0
+            for line in self.head.split( "\r\n" )[1:]:
+                if line.lower().startswith( "content-length:" ):
+                    try:
+                        length	= int( line.split( ":", 1 )[1].strip() )
+                    except ValueError:
+                        length	= 0
+            if length > 0:
+                self.set_terminator( length )
+                return
+            data		= ""
+        self.requests.append( ( self.head, data ))
+        self.head		= None
+        self.set_terminator( "\r\n\r\n" )
+        self.next()
+
+    def next( self ):
+        """If we're idle, start handling the next request."""
+        if self.busy or not self.requests or self.stream is not None:
+            return
+        head, body		= self.requests.popleft()
+        self.busy		= True
+        if head is None:
+            self.respond( {}, ( 400, [], "Request header too large" ), None )
+            return
+        environ			= self.environ( head, body )
+        if environ is None:
+            self.respond( {}, ( 400, [], "Bad request" ), None )
+            return
+        pull			= self.server.trigger.pull
+        self.server.executor.submit(
+            lambda: self.server.application( environ ),
+            lambda result, failure: pull( lambda: self.respond( environ, result, failure )))
+
+    def environ( self, head, body ):
+        """Produce the CGI-style environ for the request, or None if invalid"""
+        lines			= head.split( "\r\n" )
+        try:
+            method, uri, protocol = lines[0].split()
+        except ValueError:
+            return None
+        path, _, query		= uri.partition( "?" )
+        environ			= {
+            "REQUEST_METHOD":	method.upper(),
+            "REQUEST_URI":	uri,
+            "PATH_INFO":	urllib.unquote( path ),
+            "QUERY_STRING":	query,
+            "SERVER_PROTOCOL":	protocol.upper(),
+            "SERVER_SOFTWARE":	"asynchttp",
+            "REMOTE_ADDR":	str( self.addr[0] ) if self.addr else "",
+            "REMOTE_PORT":	str( self.addr[1] ) if self.addr and len( self.addr ) > 1 else "",
+            "asynchttp.input":	body,
+        }
+        for line in lines[1:]:
+            name, sep, value	= line.partition( ":" )
+            if not sep:
+                continue
+            name		= name.strip().upper().replace( "-", "_" )
+            value		= value.strip()
+            if name in ( "CONTENT_LENGTH", "CONTENT_TYPE" ):
+                environ[name]	= value
+                continue
+            name		= "HTTP_" + name
+            if name in environ:
+                value		= environ[name] + "," + value
+            environ[name]	= value
+        return environ
+
+    def keepalive( self, environ ):
+        connection		= environ.get( "HTTP_CONNECTION", "" ).lower()
+        if environ.get( "SERVER_PROTOCOL" ) == "HTTP/1.1":
+            return "close" not in connection
+        return "keep-alive" in connection
+
+    def respond( self, environ, result, failure ):
+        """Send the application's result (in the event loop thread)."""
+        if failure:
+            e			= failure[1]
+            if isinstance( e, HTTPError ):
+                result		= ( e.status, e.headers, e.message or "" )
+            else:
+                log.error( "%s %s failed", environ.get( "REQUEST_METHOD", "-" ),
+                           environ.get( "REQUEST_URI", "-" ), exc_info=failure )
+                result		= ( 500, [], "Internal Server Error" )
+        status, headers, body	= result
+        if isinstance( body, unicode ):
+            body		= body.encode( "utf-8" )
+        if not self.connected:
+            if isinstance( body, stream ):
+                body.detach()
+            return
+        keepalive		= bool( environ ) and self.keepalive( environ )
+        if self.server.draining and not self.requests:
+            keepalive		= False	# Answered all it asked, before draining
+
+        # A 1xx, 204 or 304 response has no body, nor Content-Length.  One to a
+        # HEAD request has the Content-Length of the body it omits.
+        bodiless		= status < 200 or status in ( 204, 304 )
+        omitted			= bodiless or environ.get( "REQUEST_METHOD" ) == "HEAD"
+        streaming		= isinstance( body, stream )
+        if streaming and omitted:
+            body.detach()
+            body, streaming	= "", False
+        if streaming:
+            keepalive		= False
+        headers			= list( headers )
+        if bodiless:
+            headers		= [ ( h, v ) for h, v in headers if h.lower() != "content-length" ]
+        names			= set( h.lower() for h, v in headers )
+        if not ( streaming or bodiless ) and "content-length" not in names:
+            headers.append( ( "Content-Length", str( len( body ))))
+        if not bodiless and "content-type" not in names:
+            headers.append( ( "Content-Type", "text/plain" ))
+        headers.append( ( "Connection", "keep-alive" if keepalive else "close" ))
+        headers.append( ( "Date", time.strftime( "%a, %d %b %Y %H:%M:%S GMT", time.gmtime() )))
+        reason			= httplib.responses.get( status, "Unknown" )
+        head			= ( "HTTP/1.1 %d %s\r\n" % ( status, reason )
+                                    + "".join( "%s: %s\r\n" % ( h, v ) for h, v in headers )
+                                    + "\r\n" )
+        if isinstance( head, unicode ):
+            head		= head.encode( "utf-8" )
+        self.push( head )
+        log.info( "%s:%s - - [%s] \"%s %s %s\" - %d %s",
+                  environ.get( "REMOTE_ADDR", "-" ), environ.get( "REMOTE_PORT", "-" ),
+                  time.strftime( "%d/%b/%Y %H:%M:%S" ), environ.get( "SERVER_PROTOCOL", "-" ),
+                  environ.get( "REQUEST_METHOD", "-" ), environ.get( "REQUEST_URI", "-" ),
+                  status, reason )
+        self.active		= time.time()
+        if streaming:
+            self.stream		= body
+            body.attach( self )
+            return
+        if not omitted and body:
+            self.push( body )
+        if not keepalive:
+            self.requests.clear()
+            self.close_when_done()
+            return
+        self.busy		= False
+        self.next()
+
+    def push( self, data ):
+        """Queue data to send.  A buffer (eg. of an mmap) is queued as buffer
+        slices of it, rather than (as asynchat does) copies.
+        """
+        if isinstance( data, buffer ):
+            size		= self.ac_out_buffer_size
+            for i in xrange( 0, len( data ), size ):
+                self.producer_fifo.append( buffer( data, i, size ))
+            self.initiate_send()
+            return
+        asynchat.async_chat.push( self, data )
+
+    def stream_write( self, data ):
+        if self.connected and self.stream is not None:
+            self.active		= time.time()
+            self.push( data )
+
+    def housekeep( self, now ):
+        """Periodically, close idle keep-alive connections, and send any
+        stream's heartbeat.  While the server is draining, all idle connections
+        and streams are closed.
+        """
+        if self.stream is not None:
+            if self.server.draining:
+                self.stream.close()
+            elif self.stream.heartbeat and now - self.active >= self.stream.interval:
+                self.stream_write( self.stream.heartbeat )
+        elif not self.busy and not self.requests and (
+                self.server.draining or now - self.active > self.server.idle ):
+            self.close()
+
+    def handle_error( self ):
+        log.exception( "Connection failed" )
+        self.close()
+
+    def close( self ):
+        asynchat.async_chat.close( self )
+        self.server.connections.discard( self )
+        if self.stream is not None:
+            self.stream.detach()
+
+
+class server( asyncore.dispatcher ):
+    """Serve the application on the address (or already-bound, listening
+    socket 'sock'), using the given number of executor 'workers'.  Idle
+    keep-alive connections are closed after 'idle' seconds.
+
+    Once told to drain, the server stops accepting connections (leaving the
+    listening socket open, with any new connections queued on it, eg. for a
+    successor to accept), and serve_forever returns as soon as every request
+    already received has been answered.
+    """
+    def __init__( self, address, application, workers=4, sock=None, idle=120.0 ):
+        self.map		= {}
+        asyncore.dispatcher.__init__( self, map=self.map )
+        if sock is None:
+            self.create_socket( socket.AF_INET, socket.SOCK_STREAM )
+            self.set_reuse_addr()
+            self.bind( address )
+            self.listen( 1024 )
+        else:
+            sock.setblocking( 0 )
+            self.set_socket( sock, map=self.map )
+            self.accepting	= True
+        self.application	= application
+        self.idle		= idle
+        self.connections	= set()
+        self.draining		= None	# The time by which to have drained
+        self.trigger		= trigger( map=self.map )
+        self.executor		= executor( workers )
+
+    def readable( self ):
+        return not self.draining
+
+    def drain( self, timeout=30.0 ):
+        """Stop accepting, and finish serving the connections' requests (for
+        up to 'timeout' seconds).  May be called from a signal handler.
+        """
+        if not self.draining:
+            self.draining	= time.time() + timeout
+
+    def drained( self ):
+        return bool( self.draining ) and ( not self.connections or time.time() > self.draining )
+
+    def handle_accept( self ):
+        try:
+            pair		= self.accept()
+        except socket.error, e:
+            if e.args[0] in ( errno.EMFILE, errno.ENFILE, errno.ECONNABORTED ):
+                return
+            raise
+        if pair is not None:		# Another process may have accepted it
+            connection( self, *pair )
+
+    def handle_error( self ):
+        log.exception( "Server failed" )
+
+    def housekeep( self ):
+        now			= time.time()
+        for conn in list( self.connections ):
+            conn.housekeep( now )
+
+    def serve_forever( self ):
+        while self.map and not self.drained():
+            asyncore.loop( timeout=1.0, use_poll=True, map=self.map, count=1 )
+            self.housekeep()
+        for conn in list( self.connections ):
+            conn.close()	# Any still busy after draining's timeout
@@ -0,0 +1,163 @@
+import logging
+import socket
+import threading
+import time
+
+import asynchttp
+
+def serve( application, workers=2 ):
+    httpd			= asynchttp.server( ( "127.0.0.1", 0 ), application, workers=workers )
+    thread			= threading.Thread( target=httpd.serve_forever )
+    thread.daemon		= True
+    thread.start()
+    return httpd, httpd.socket.getsockname()
+
+
+def receive( sock, count, timeout=5.0 ):
+    """Receive 'til 'count' complete responses have arrived (or timeout)"""
+    data			= ""
+    sock.settimeout( timeout )
+    while data.count( "HTTP/1.1 " ) < count or not data.endswith( "!" ):
+        chunk			= sock.recv( 65536 )
+        if not chunk:
+            break
+        data		       += chunk
+    return data
+
+
+def test_server():
+    streams			= []
+    def application( environ ):
+        if environ["PATH_INFO"] == "/stream":
+            s			= asynchttp.stream()
+            streams.append( s )
+            s.write( "first!" )
+            return 200, [ ( "Content-Type", "text/event-stream" ) ], s
+        if environ["PATH_INFO"] == "/missing":
+            raise asynchttp.HTTPError( 404, "Missing!" )
+        if environ["PATH_INFO"] == "/unchanged":
+            raise asynchttp.HTTPError( 304, "Not Modified", headers=[ ( "ETag", '"abc"' ) ] )
+        return 200, [], "%s %s!" % ( environ["REQUEST_METHOD"], environ["QUERY_STRING"] )
+
+    httpd, address		= serve( application )
+
+    # Pipelined keep-alive requests are answered in order
+    sock			= socket.create_connection( address )
+    sock.sendall( "GET /a?x=1 HTTP/1.1\r\nHost: test\r\n\r\n"
+                  "GET /missing HTTP/1.1\r\nHost: test\r\n\r\n" )
+    data			= receive( sock, 2 )
+    assert data.startswith( "HTTP/1.1 200 OK\r\n" )
+    assert "Connection: keep-alive" in data
+    assert data.index( "GET x=1!" ) < data.index( "HTTP/1.1 404 Not Found" )
+    assert data.endswith( "Missing!" )
+
+    # A 304 has no body nor Content-Length; a HEAD, the Content-Length but no body
+    sock.sendall( "GET /unchanged HTTP/1.1\r\n\r\n"
+                  "HEAD /h HTTP/1.1\r\n\r\n"
+                  "GET /c HTTP/1.1\r\n\r\n" )
+    unchanged, head, last	= receive( sock, 3 ).split( "HTTP/1.1 " )[1:]
+    assert unchanged.startswith( "304 Not Modified\r\n" ) and unchanged.endswith( "\r\n\r\n" )
+    assert 'ETag: "abc"' in unchanged
+    assert "Content-Length" not in unchanged and "Content-Type" not in unchanged
+    assert head.startswith( "200 OK\r\n" ) and head.endswith( "\r\n\r\n" )
+    assert "Content-Length: 6\r\n" in head
+    assert last.endswith( "GET !" )
+    sock.sendall( "POST /b HTTP/1.1\r\nContent-Length: 4\r\nConnection: close\r\n\r\nbody" )
+    data			= receive( sock, 1 )
+    assert data.endswith( "POST !" )
+    assert "Connection: close" in data
+    assert sock.recv( 10 ) == ""
+
+    # A stream is written from another thread, and detached when the client leaves
+    sock			= socket.create_connection( address )
+    sock.sendall( "GET /stream HTTP/1.1\r\n\r\n" )
+    data			= receive( sock, 1 )
+    assert data.endswith( "\r\n\r\nfirst!" )
+    closed			= []
+    streams[0].closing.append( lambda: closed.append( True ))
+    streams[0].write( u"second!" )
+    assert receive( sock, 0 ) == "second!"
+    sock.close()
+    for i in range( 50 ):
+        if closed:
+            break
+        time.sleep( .1 )
+    assert closed and streams[0].closed
+
+
+def test_drain():
+    release			= threading.Event()
+    def application( environ ):
+        if environ["PATH_INFO"] == "/slow":
+            release.wait( 5 )
+        return 200, [], "%s!" % ( environ["PATH_INFO"] )
+
+    httpd			= asynchttp.server( ( "127.0.0.1", 0 ), application, workers=2 )
+    address			= httpd.socket.getsockname()
+    thread			= threading.Thread( target=httpd.serve_forever )
+    thread.daemon		= True
+    thread.start()
+    idle			= socket.create_connection( address )
+    idle.sendall( "GET /idle HTTP/1.1\r\n\r\n" )
+    assert receive( idle, 1 ).endswith( "/idle!" )
+    busy			= socket.create_connection( address )
+    busy.sendall( "GET /slow HTTP/1.1\r\n\r\n" )
+    time.sleep( .2 )
+
+    # Draining closes the idle connection, finishes the busy one, and leaves
+    # new connections queued on the listening socket
+    httpd.drain( timeout=10 )
+    time.sleep( 1.5 )
+    assert idle.recv( 10 ) == ""
+    queued			= socket.create_connection( address )
+    queued.sendall( "GET /queued HTTP/1.1\r\n\r\n" )
+    assert thread.is_alive()
+    release.set()
+    data			= receive( busy, 1 )
+    assert data.endswith( "/slow!" ) and "Connection: close" in data
+    thread.join( 5 )
+    assert not thread.is_alive()
+
+    # A successor, on the same listening socket, serves the queued connection
+    successor			= asynchttp.server( None, application, workers=1, sock=httpd.socket )
+    thread			= threading.Thread( target=successor.serve_forever )
+    thread.daemon		= True
+    thread.start()
+    try:
+        assert receive( queued, 1 ).endswith( "/queued!" )
+    finally:
+        successor.drain( timeout=0 )
+
+
+def test_logging():
+    def application( environ ):
+        if environ["PATH_INFO"] == "/fail":
+            raise ValueError( "Failed!" )
+        return 200, [], "ok!"
+    records			= []
+    class handler( logging.Handler ):
+        def emit( self, record ):
+            records.append( record )
+    logger			= logging.getLogger( "asynchttp" )
+    level			= logger.level
+    logger.addHandler( handler() )
+    logger.setLevel( logging.INFO )
+    try:
+        httpd, address		= serve( application )
+
+        # Each request is logged at INFO; a failure also at ERROR, with its traceback
+        sock			= socket.create_connection( address )
+        sock.sendall( "GET /fail HTTP/1.1\r\nHost: test\r\n\r\n"
+                      "GET /ok HTTP/1.1\r\nHost: test\r\n\r\n" )
+        data			= receive( sock, 2 )
+        assert "HTTP/1.1 500 Internal Server Error" in data
+        sock.close()
+    finally:
+        logger.handlers		= [ h for h in logger.handlers if not isinstance( h, handler ) ]
+        logger.setLevel( level )
+    access			= [ r.getMessage() for r in records if r.levelno == logging.INFO ]
+    assert len( access ) == 2
+    assert access[0].endswith( '"HTTP/1.1 GET /fail" - 500 Internal Server Error' )
+    assert access[1].endswith( '"HTTP/1.1 GET /ok" - 200 OK' )
+    errors			= [ r for r in records if r.levelno == logging.ERROR ]
+    assert len( errors ) == 1 and errors[0].exc_info[0] is ValueError
@@ -1,4 +1,77 @@
 import collections
+import operator
+import threading
+
+
+def _signs( terms, kwds ):
+    """The signs (default: all +1) of the terms, from accumulate's keywords"""
+    signs			= kwds.pop( 'signs', None )
+    if kwds:
+        raise TypeError( "unexpected keywords: %s" % ", ".join( kwds ))
+    if signs is None:
+        return (1,) * len( terms )
+    assert len( signs ) == len( terms ), \
+        "%d signs for %d terms" % ( len( signs ), len( terms ))
+    return signs
+
+
+def _rows( schema, terms, signs ):
+    """The terms' values (negated, if their sign is), if they're all <mathvector>s
+    of the given schema; otherwise, None."""
+    rows			= []
+    for t, s in zip( terms, signs ):
+        if getattr( t, 'schema', None ) is not schema:
+            return None
+        rows.append( t.fit() if s >= 0 else map( operator.neg, t.fit() ))
+    return rows
+
+
+def accumulate( target, *terms, **kwds ):
+    """Perform target += terms[0], target += terms[1], ... (or -=, for each term
+    whose signs entry is negative), creating no intermediate <mathdict>s;
+    returns target.  Each term may be any rhs supported by <mathdict> operators
+    ((key, value), <mathdict>, <mathvector> or plain <dict>), with the same
+    results.  If target and all the terms are <mathvector>s of the same schema,
+    each column is summed in a single pass over all the terms.
+
+        accumulate( total, todo, done, removed )
+        accumulate( delta, added, removed, signs=(1, -1) )
+    """
+    signs			= _signs( terms, kwds )
+    schema			= getattr( target, 'schema', None )
+    rows			= None if schema is None else _rows( schema, terms, signs )
+    if rows is not None:
+        rows.append( target.fit() )
+        target.values		= map( sum, zip( *rows ))
+        return target
+
+    # Otherwise, exactly as the chain of <mathdict> operators would, but each
+    # into the target, in place.
+    for t, s in zip( terms, signs ):
+        if s < 0:
+            target	       -= t
+        else:
+            target	       += t
+    return target
+
+
+def from_sum( *terms, **kwds ):
+    """Return a new sum (see accumulate) of the terms, of the same type (and
+    schema) as the first.
+
+        project = from_sum( todo, done )
+        change  = from_sum( now, before, signs=(1, -1) )
+    """
+    first			= terms[0]
+    schema			= getattr( first, 'schema', None )
+    if schema is not None:
+        signs			= _signs( terms, kwds )
+        rows			= _rows( schema, terms, signs )
+        if rows is not None:
+            return first.__class__( first.default_factory, schema, map( sum, zip( *rows )))
+        kwds			= { 'signs': signs }
+    return accumulate( first.zero(), *terms, **kwds )
+
 
 class mathdict( collections.defaultdict ):
     """A dictionary type that contains values, and which responds to
@@ -9,6 +82,18 @@ class mathdict( collections.defaultdict ):
     def __init__( self, default_factory=int ):
         collections.defaultdict.__init__( self, default_factory )
 
+    def zero( self ):
+        """A new, empty <mathdict> of the same type; adding to it copies."""
+        return self.__class__( self.default_factory )
+
+    def scalar( self, value ):
+        """Convert a (key, value) item's value; eg. <timedict> parses timespecs."""
+        return value
+
+    def accumulate( self, *terms, **kwds ):
+        """self += (or -=) each of terms, in one pass; see accumulate."""
+        return accumulate( self, *terms, **kwds )
+
     #
     # self <op>= rhs
     # self <op>  rhs	-- Not Implemented
@@ -41,7 +126,7 @@ class mathdict( collections.defaultdict ):
         if isinstance( rhs, tuple ):
             self[rhs[0]]       += rhs[1]
             return self
-        elif isinstance( rhs, mathdict ):
+        elif isinstance( rhs, ( mathdict, mathvector )):
             for k in self.keys():
                 if k not in rhs:
                     self[k]    += rhs.default_factory()
@@ -55,7 +140,7 @@ class mathdict( collections.defaultdict ):
         raise NotImplementedError()
     def __add__( self, rhs ):
         """<mathdict> + [<mathdict>, (k,v)]"""
-        if isinstance( rhs, mathdict ) or isinstance( rhs, tuple ):
+        if isinstance( rhs, ( mathdict, mathvector, tuple )):
             res			= self.__class__(self.default_factory)
             res                += self
             res                += rhs
@@ -70,7 +155,7 @@ class mathdict( collections.defaultdict ):
         if isinstance( rhs, tuple ):
             self[rhs[0]]       -= rhs[1]
             return self
-        elif isinstance( rhs, mathdict ):
+        elif isinstance( rhs, ( mathdict, mathvector )):
             for k in self.keys():
                 if k not in rhs:
                     self[k]    -= rhs.default_factory()
@@ -84,7 +169,7 @@ class mathdict( collections.defaultdict ):
         raise NotImplementedError()
     def __sub__( self, rhs ):
         """<mathdict> - [<mathdict>, (k,v)]"""
-        if isinstance( rhs, mathdict ) or isinstance( rhs, tuple ):
+        if isinstance( rhs, ( mathdict, mathvector, tuple )):
             res			= self.__class__(self.default_factory)
             res                += self
             res                -= rhs
@@ -99,7 +184,7 @@ class mathdict( collections.defaultdict ):
         if isinstance( rhs, tuple ):
             self[rhs[0]]       *= rhs[1]
             return self
-        elif isinstance( rhs, mathdict ):
+        elif isinstance( rhs, ( mathdict, mathvector )):
             for k in self.keys():
                 if k not in rhs:
                     self[k]    *= rhs.default_factory()
@@ -113,7 +198,7 @@ class mathdict( collections.defaultdict ):
         raise NotImplementedError()
     def __mul__( self, rhs ):
         """<mathdict> * [<mathdict>, (k,v)]"""
-        if isinstance( rhs, mathdict ) or isinstance( rhs, tuple ):
+        if isinstance( rhs, ( mathdict, mathvector, tuple )):
             res			= self.__class__(self.default_factory)
             res                += self
             res                *= rhs
@@ -128,7 +213,7 @@ class mathdict( collections.defaultdict ):
         if isinstance( rhs, tuple ):
             self[rhs[0]]       /= rhs[1]
             return self
-        elif isinstance( rhs, mathdict ):
+        elif isinstance( rhs, ( mathdict, mathvector )):
             for k in self.keys():
                 if k not in rhs:
                     self[k]    /= rhs.default_factory()
@@ -142,7 +227,7 @@ class mathdict( collections.defaultdict ):
         raise NotImplementedError()
     def __div__( self, rhs ):
         """<mathdict> / [<mathdict>, (k,v)]"""
-        if isinstance( rhs, mathdict ) or isinstance( rhs, tuple ):
+        if isinstance( rhs, ( mathdict, mathvector, tuple )):
             res			= self.__class__(self.default_factory)
             res                += self
             res                /= rhs
@@ -153,8 +238,216 @@ class mathdict( collections.defaultdict ):
         raise NotImplementedError()
 
 
-class timedict( mathdict ):
-    """Deals in times, in the form:
+class keyschema( object ):
+    """An ordered set of keys, each with a fixed index, shared by many
+    <mathvector>s.  A key new to the schema is appended (with the next index);
+    existing indices never change, so every vector using the schema remains
+    valid (its values for new keys are simply the default).
+
+    Schemas for the same keys may be shared (see shared), so that arithmetic
+    between eg. the rows of many org-mode tables with the same columns operates
+    on whole vectors at once.
+    """
+    registry			= {}	# { ( key, ... ): <keyschema> }
+    lock			= threading.Lock()
+
+    def __init__( self, keys=() ):
+        self.keys		= []
+        self.index		= {}
+        for k in keys:
+            self.add( k )
+
+    def add( self, key ):
+        """Return the key's index, adding it if necessary"""
+        i			= self.index.get( key )
+        if i is None:
+            with self.lock:
+                i		= self.index.get( key )
+                if i is None:
+                    i		= len( self.keys )
+                    self.keys.append( key )
+                    self.index[key] = i
+        return i
+
+    def __reduce__( self ):
+        """Pickled schemas are unpickled as the shared one for their keys"""
+        return _keyschema, ( tuple( self.keys ), )
+
+    @classmethod
+    def shared( cls, keys ):
+        """Return the shared schema for the given keys (in order)"""
+        keys			= tuple( keys )
+        schema			= cls.registry.get( keys )
+        if schema is None:
+            schema		= cls( keys )	# Outside the lock; add() takes it
+            with cls.lock:
+                schema		= cls.registry.setdefault( keys, schema )
+        return schema
+
+
+def _keyschema( keys ):
+    return keyschema.shared( keys )
+
+
+class mathvector( object ):
+    """A <mathdict>-compatible type, whose keys are always exactly those of its
+    schema (see keyschema), and whose values are held in a list, in the order
+    of the schema's keys.  Arithmetic between vectors of the same schema is
+    performed on the whole list at once; with any other <mathdict>, <dict> or
+    (key, value) tuple, key by key, exactly as for <mathdict>.
+
+    Unlike a <mathdict>, a new vector already contains every key (with the
+    default_factory's value), and adding a key to one adds it to the schema
+    (and hence every vector sharing it).
+    """
+    def __init__( self, default_factory=int, schema=None, values=None ):
+        self.default_factory	= default_factory
+        self.schema		= keyschema() if schema is None else schema
+        self.values		= [] if values is None else list( values )
+
+    def zero( self ):
+        """A new vector of the same type and schema, of all default values"""
+        return self.__class__( self.default_factory, self.schema,
+                               [ self.default_factory() ] * len( self.schema.keys ))
+
+    def copy( self ):
+        return self.__class__( self.default_factory, self.schema, self.fit() )
+
+    def fit( self ):
+        """Extend the values to the schema's (eg. since grown); return them."""
+        if len( self.values ) < len( self.schema.keys ):
+            self.values.extend( self.default_factory()
+                                for i in range( len( self.schema.keys ) - len( self.values )))
+        return self.values
+
+    # The dict interface; a missing key is added (as for a defaultdict)
+    def __getitem__( self, key ):
+        i			= self.schema.add( key )
+        return self.fit()[i]
+
+    def __setitem__( self, key, value ):
+        i			= self.schema.add( key )
+        self.fit()[i]		= value
+
+    def __contains__( self, key ):
+        return key in self.schema.index
+
+    def __len__( self ):
+        return len( self.schema.keys )
+
+    def __iter__( self ):
+        return iter( list( self.schema.keys ))
+
+    def __eq__( self, rhs ):
+        if isinstance( rhs, ( mathvector, dict )):
+            return dict( self.iteritems() ) == dict( rhs.iteritems() )
+        return NotImplemented
+
+    def __ne__( self, rhs ):
+        equal			= self.__eq__( rhs )
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__( self ):
+        return "%s(%r)" % ( self.__class__.__name__, dict( self.iteritems() ))
+
+    def get( self, key, default=None ):
+        return self[key] if key in self else default
+
+    def keys( self ):
+        return list( self.schema.keys )
+
+    def iterkeys( self ):
+        return iter( self.keys() )
+
+    def itervalues( self ):
+        return iter( list( self.fit() ))
+
+    def values( self ):
+        return list( self.itervalues() )
+
+    def iteritems( self ):
+        return iter( zip( self.keys(), self.fit() ))
+
+    def items( self ):
+        return list( self.iteritems() )
+
+    #
+    # self <op>= rhs
+    # self <op>  rhs
+    #
+    # As for <mathdict>; rhs may be a (key, value) tuple, a <mathvector>, a
+    # <mathdict> or a plain <dict>.  Any (key, value) item's value is first
+    # converted (see scalar), allowing eg. <timevector> to parse timespecs.
+    def scalar( self, value ):
+        return value
+
+    def accumulate( self, *terms, **kwds ):
+        """self += (or -=) each of terms, in one pass; see accumulate."""
+        return accumulate( self, *terms, **kwds )
+
+    def operate( self, rhs, op ):
+        """Perform self = self <op> rhs, returning self"""
+        if isinstance( rhs, tuple ):
+            self[rhs[0]]	= op( self[rhs[0]], self.scalar( rhs[1] ))
+            return self
+        elif isinstance( rhs, mathvector ) and rhs.schema is self.schema:
+            self.values		= map( op, self.fit(), rhs.fit() )
+            return self
+        elif isinstance( rhs, ( mathvector, mathdict )):
+            for k in self.keys():
+                if k not in rhs:
+                    self[k]	= op( self[k], rhs.default_factory() )
+            for k, v in rhs.iteritems():
+                self[k]		= op( self[k], v )
+            return self
+        elif isinstance( rhs, dict ):
+            for i in rhs.iteritems():
+                self.operate( i, op )
+            return self
+        raise NotImplementedError()
+
+    def calculate( self, rhs, op ):
+        """Return a new vector, of self <op> rhs"""
+        if isinstance( rhs, mathvector ) and rhs.schema is self.schema:
+            return self.__class__( self.default_factory, self.schema,
+                                   map( op, self.fit(), rhs.fit() ))
+        if isinstance( rhs, ( mathvector, mathdict, tuple )):
+            return self.copy().operate( rhs, op )
+        raise NotImplementedError()
+
+    def __iadd__( self, rhs ):
+        """<mathvector> += [<mathvector>, <mathdict>, <dict>, (k,v)]"""
+        return self.operate( rhs, operator.add )
+    def __add__( self, rhs ):
+        return self.calculate( rhs, operator.add )
+    def __radd__( self, lhs ):
+        raise NotImplementedError()
+
+    def __isub__( self, rhs ):
+        return self.operate( rhs, operator.sub )
+    def __sub__( self, rhs ):
+        return self.calculate( rhs, operator.sub )
+    def __rsub__( self, lhs ):
+        raise NotImplementedError()
+
+    def __imul__( self, rhs ):
+        return self.operate( rhs, operator.mul )
+    def __mul__( self, rhs ):
+        return self.calculate( rhs, operator.mul )
+    def __rmul__( self, lhs ):
+        raise NotImplementedError()
+
+    def __idiv__( self, rhs ):
+        return self.operate( rhs, operator.div )
+    def __div__( self, rhs ):
+        return self.calculate( rhs, operator.div )
+    def __rdiv__( self, lhs ):
+        raise NotImplementedError()
+
+
+class hms( object ):
+    """A mixin for <mathdict>-like types (timedict, timevector), which deal
+    in times, in the form:
 
         ("key", "H[:MM[:SS[.s]]]]")
 
@@ -166,9 +459,69 @@ class timedict( mathdict ):
       H:MM
       H:MM:SS[.s]
 
+    The same few timespecs ("2:00", "16:00", "0:00") and values recur in every
+    row of every table, so both conversions are memoized, in tables shared by
+    all instances; each is simply emptied when it reaches memo_limit entries
+    (0 disables memoization).  Whole columns or records may be converted at
+    once (see from_hms_all, into_hms_all and add_hms).
     """
+    memo_limit			= 4096
+    memo_from			= {}	# { ( default_factory, "H:MM" ): seconds }
+    memo_into			= {}	# { seconds: "H:MM" }
 
     def _from_hms( self, timespec ):
+        key			= ( self.default_factory, timespec )
+        try:
+            return self.memo_from[key]
+        except KeyError:
+            pass
+        seconds			= self._parse_hms( timespec )
+        if self.memo_limit:
+            if len( self.memo_from ) >= self.memo_limit:
+                self.memo_from.clear()
+            self.memo_from[key]	= seconds
+        return seconds
+
+    def _into_hms( self, seconds ):
+        try:
+            return self.memo_into[seconds]
+        except KeyError:
+            pass
+        timespec		= self._format_hms( seconds )
+        if self.memo_limit:
+            if len( self.memo_into ) >= self.memo_limit:
+                self.memo_into.clear()
+            self.memo_into[seconds] = timespec
+        return timespec
+
+    def from_hms_all( self, timespecs ):
+        """Return a list of the seconds of each of a column of timespecs (any
+        numeric values are passed through, as for scalar)."""
+        memo			= self.memo_from.get
+        factory			= self.default_factory
+        seconds			= []
+        for t in timespecs:
+            v			= memo( ( factory, t ))
+            seconds.append( self.scalar( t ) if v is None else v )
+        return seconds
+
+    def into_hms_all( self, values ):
+        """Return a list of the timespecs of each of a column of seconds"""
+        memo			= self.memo_into.get
+        timespecs		= []
+        for v in values:
+            t			= memo( v )
+            timespecs.append( self._into_hms( v ) if t is None else t )
+        return timespecs
+
+    def add_hms( self, items ):
+        """self += each of a record's ("key", "H:MM") items, converted at once"""
+        keys			= [ k for k, t in items ]
+        for k, v in zip( keys, self.from_hms_all( t for k, t in items )):
+            self[k]	       += v
+        return self
+
+    def _parse_hms( self, timespec ):
         multiplier		= 60 * 60
         seconds			= 0
         negative		= False
@@ -189,7 +542,7 @@ class timedict( mathdict ):
             multiplier         /= 60
         return seconds if not negative else -seconds
 
-    def _into_hms( self, seconds ):
+    def _format_hms( self, seconds ):
         multiplier		= 60 * 60
         timespec                = []
         negative		= ""
@@ -208,6 +561,21 @@ class timedict( mathdict ):
                 timespec[-1]   += ("%f" % ( seconds )).strip( "0" )
         return negative + ":".join( timespec )
 
+    def scalar( self, value ):
+        if isinstance( value, basestring ):
+            return self._from_hms( value )
+        return value
+
+    def __reversed__( self ):
+        """Returns an iterator over sorted (key, value) data, reverted
+        back into "HH:MM[:SS[.s]" form.
+        """
+        keys			= sorted( self.keys() )
+        return iter( zip( keys, self.into_hms_all( self[k] for k in keys )))
+
+
+class timedict( hms, mathdict ):
+    """A <mathdict> of times (see hms), in seconds."""
     def __iadd__( self, rhs ):
         """Handles:
 
@@ -242,8 +610,14 @@ class timedict( mathdict ):
             return self
         return mathdict.__idiv__( self, rhs ) # Otherwise, base mathdict handles
 
-    def __reversed__( self ):
-        """Returns an iterator over sorted (key, value) data, reverted
-        back into "HH:MM[:SS[.s]" form.
-        """
-        return ( (k, self._into_hms( self[k] )) for k in sorted( self.keys()) )
+
+class timevector( hms, mathvector ):
+    """A <mathvector> of times (see hms), in seconds; as for <timedict>, any
+    (key, "HH:MM") item's value is parsed."""
+    def add_hms( self, items ):
+        """A record of the schema's keys, in order, is added as a whole row"""
+        if [ k for k, t in items ] == self.schema.keys:
+            self.values		= map( operator.add, self.fit(),
+                                       self.from_hms_all( t for k, t in items ))
+            return self
+        return hms.add_hms( self, items )
@@ -92,3 +92,230 @@ def test_timedict():
     assert d["b"] == "0:00:00.12345"
     assert d["c"] == "0:00"
     assert d["d"] == "1:00"
+
+
+def test_keyschema():
+    s1			= mathdict.keyschema.shared( ["Effort", "CLOCKSUM"] )
+    s2			= mathdict.keyschema.shared( ("Effort", "CLOCKSUM") )
+    assert s1 is s2
+    assert s1.keys == ["Effort", "CLOCKSUM"]
+    assert s1.index == {"Effort": 0, "CLOCKSUM": 1}
+    assert mathdict.keyschema.shared( ["CLOCKSUM", "Effort"] ) is not s1
+
+    # Growth appends; existing indices never change
+    s			= mathdict.keyschema( ["a", "b"] )
+    assert s.add( "b" ) == 1
+    assert s.add( "c" ) == 2
+    assert s.keys == ["a", "b", "c"]
+
+    # Pickled vectors share the schema again, when unpickled
+    import cPickle
+    v			= mathdict.mathvector( int, s1, [1, 2] )
+    u			= cPickle.loads( cPickle.dumps( v, 2 ))
+    assert u.schema is s1 and dict( u ) == dict( v )
+
+
+def test_keyschema_threads():
+    import threading
+    keys		= tuple( "k%d" % i for i in range( 50 ))
+    found		= []
+    def worker():
+        found.append( mathdict.keyschema.shared( keys ))
+    threads		= [ threading.Thread( target=worker ) for i in range( 8 ) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join( 5 )
+        assert not t.is_alive()
+    assert len( found ) == 8
+    assert all( s is found[0] for s in found )
+    assert found[0].keys == list( keys )
+
+
+def test_mathvector():
+    schema		= mathdict.keyschema( ["a", "b"] )
+    v1			= mathdict.mathvector( int, schema )
+    assert len( v1 ) == 2
+    assert v1["a"] == 0 and v1["b"] == 0
+    v1["a"]		= 1
+    v2			= mathdict.mathvector( int, schema, [10, 20] )
+
+    v3			= v1 + v2
+    assert v3.schema is schema
+    assert v3 == {"a": 11, "b": 20}
+    assert v1 == {"a": 1, "b": 0}	# unchanged
+    assert v2 - v1 == {"a": 9, "b": 20}
+    assert v2 * v2 == {"a": 100, "b": 400}
+
+    v1                 += ("b", 5)
+    v1                 += {"a": 1}
+    assert v1 == {"a": 2, "b": 5}
+
+    # zero() is the same type and schema, all defaults; adding to it copies
+    z			= v1.zero()
+    assert type( z ) is mathdict.mathvector and z.schema is schema
+    assert z == {"a": 0, "b": 0}
+    z                  += v1
+    assert z == v1 and z is not v1
+    assert mathdict.mathdict( int ).zero() == {}
+
+    # Growing the schema through one vector is seen by all its vectors
+    v1["c"]		= 7
+    assert schema.keys == ["a", "b", "c"]
+    assert "c" in v2 and v2["c"] == 0
+    assert v1 + v2 == {"a": 12, "b": 25, "c": 7}
+
+
+def test_mathvector_mathdict():
+    schema		= mathdict.keyschema( ["a", "b"] )
+    vec			= mathdict.mathvector( int, schema, [1, 2] )
+    md			= mathdict.mathdict( int )
+    md["b"]		= 10
+    md["c"]		= 100
+
+    # mathvector <op> mathdict: any new keys grow the vector's schema
+    res			= vec + md
+    assert isinstance( res, mathdict.mathvector )
+    assert res == {"a": 1, "b": 12, "c": 100}
+    assert "c" in schema.index
+
+    # mathdict <op> mathvector: keys only in the vector are included
+    md2			= mathdict.mathdict( int )
+    md2["a"]		= 5
+    vec2		= mathdict.mathvector( int, mathdict.keyschema( ["a", "b"] ), [1, 2] )
+    res			= md2 - vec2
+    assert type( res ) is mathdict.mathdict
+    assert res == {"a": 4, "b": -2}
+    md2                += vec2
+    assert md2 == {"a": 6, "b": 2}
+
+
+def test_timevector():
+    schema		= mathdict.keyschema( ["Effort", "CLOCKSUM"] )
+    tv			= mathdict.timevector( int, schema )
+    tv                 += ("Effort", "1:30")
+    tv                 += {"CLOCKSUM": "0:45"}
+    assert tv == {"Effort": 90*60, "CLOCKSUM": 45*60}
+
+    td			= mathdict.timedict( int )
+    td                 += ("Effort", "0:30")
+    assert tv - td == {"Effort": 60*60, "CLOCKSUM": 45*60}
+    assert td + tv == {"Effort": 120*60, "CLOCKSUM": 45*60}
+
+    assert dict( reversed( tv )) == {"Effort": "1:30", "CLOCKSUM": "0:45"}
+    assert list( reversed( tv )) == [("CLOCKSUM", "0:45"), ("Effort", "1:30")]
+
+
+def test_accumulate():
+    a			= mathdict.mathdict( int )
+    a["x"]		= 1
+    b			= mathdict.mathdict( int )
+    b["x"]		= 10
+    b["y"]		= 20
+    c			= mathdict.mathdict( int )
+    c["z"]		= 300
+
+    # Same results as the equivalent chain of operators; no key is missed
+    assert mathdict.from_sum( a, b, c ) == a + b + c
+    assert mathdict.from_sum( a, b, c, signs=(1, -1, 1) ) == a - b + c
+    assert mathdict.from_sum( a, b, c ) == {"x": 11, "y": 20, "z": 300}
+    assert a == {"x": 1}				# terms unchanged
+    res			= mathdict.from_sum( a, ("y", 2), {"x": 3} )
+    assert type( res ) is mathdict.mathdict and res == {"x": 4, "y": 2}
+
+    # A default_factory that isn't zero applies to keys missing from a term
+    twos		= mathdict.mathdict( lambda: 2 )
+    twos["x"]		= 5
+    assert mathdict.from_sum( a, twos, b ) == a + twos + b
+    assert mathdict.from_sum( b, twos, signs=(1, -1) ) == b - twos
+
+    # In place, returning the target
+    assert a.accumulate( b, c, signs=(-1, 1) ) is a
+    assert a == {"x": -9, "y": -20, "z": 300}
+
+    try:
+        mathdict.from_sum( a, b, signs=(1,) )
+        assert False, "Should have failed with too few signs"
+    except AssertionError as exc:
+        assert "1 signs for 2 terms" in str( exc )
+
+
+def test_accumulate_vectors():
+    schema		= mathdict.keyschema( ["Effort", "CLOCKSUM"] )
+    v1			= mathdict.timevector( int, schema, [60, 120] )
+    v2			= mathdict.timevector( int, schema, [10, 20] )
+    res			= mathdict.from_sum( v1.zero(), v1, v2, signs=(1, 1, -1) )
+    assert type( res ) is mathdict.timevector and res.schema is schema
+    assert res.values == [50, 100]
+
+    # Mixed with timedicts and timespecs; the first term's type is returned
+    td			= mathdict.timedict( int )
+    td                 += ("Effort", "1:00")
+    res			= mathdict.from_sum( td, v1, ("CLOCKSUM", "0:01") )
+    assert type( res ) is mathdict.timedict
+    assert res == {"Effort": 3660, "CLOCKSUM": 180}
+    assert v1.accumulate( td, {"CLOCKSUM": "1:00"} ) is v1
+    assert v1.values == [3660, 3720]
+
+
+def test_hms_memo():
+    td			= mathdict.timedict( int )
+    limit		= mathdict.hms.memo_limit
+    try:
+        mathdict.hms.memo_from.clear()
+        mathdict.hms.memo_into.clear()
+        assert td._from_hms( "2:00" ) == 7200
+        assert mathdict.hms.memo_from[int, "2:00"] == 7200
+        assert td._into_hms( 7200 ) == "2:00"
+        assert mathdict.hms.memo_into[7200] == "2:00"
+
+        # The same timespec is memoized separately for each default_factory
+        tf		= mathdict.timedict( float )
+        assert tf._from_hms( "0:00:01.5" ) == 1.5
+        assert ( float, "0:00:01.5" ) in mathdict.hms.memo_from
+
+        # Invalid timespecs aren't memoized
+        try:
+            td._from_hms( "1:60" )
+            assert False, "Should have rejected minutes >= 60"
+        except AssertionError as exc:
+            assert "Should have" not in str( exc )
+        assert ( int, "1:60" ) not in mathdict.hms.memo_from
+
+        # Bounded: emptied when the limit is reached
+        mathdict.hms.memo_limit = 3
+        mathdict.hms.memo_from.clear()
+        for spec in "1:00", "2:00", "3:00":
+            td._from_hms( spec )
+        assert len( mathdict.hms.memo_from ) == 3
+        assert td._from_hms( "4:00" ) == 4*3600
+        assert mathdict.hms.memo_from == { ( int, "4:00" ): 4*3600 }
+
+        # ... or disabled
+        mathdict.hms.memo_limit = 0
+        mathdict.hms.memo_from.clear()
+        assert td._from_hms( "5:00" ) == 5*3600
+        assert not mathdict.hms.memo_from
+    finally:
+        mathdict.hms.memo_limit = limit
+
+
+def test_hms_batch():
+    td			= mathdict.timedict( int )
+    assert td.from_hms_all( ["1:00", "", "0:30", 90, "-0:01"] ) == [3600, 0, 1800, 90, -60]
+    assert td.into_hms_all( [3600, 0, 1800, 90, -60] ) == ["1:00", "0:00", "0:30", "0:01:30", "-0:01"]
+
+    td.add_hms( [("Effort", "1:00"), ("CLOCKSUM", "0:30")] )
+    td.add_hms( [("Effort", "1:00")] )
+    assert td == {"Effort": 7200, "CLOCKSUM": 1800}
+    assert list( reversed( td )) == [("CLOCKSUM", "0:30"), ("Effort", "2:00")]
+
+    # A whole row of a timevector's schema, or any other record
+    schema		= mathdict.keyschema( ["Effort", "CLOCKSUM"] )
+    tv			= mathdict.timevector( int, schema )
+    tv.add_hms( [("Effort", "1:00"), ("CLOCKSUM", "0:30")] )
+    assert tv.values == [3600, 1800]
+    tv.add_hms( [("CLOCKSUM", "0:30"), ("Effort", "1:00")] )
+    assert tv.values == [7200, 3600]
+    tv.add_hms( [("Other", "0:01")] )
+    assert tv == {"Effort": 7200, "CLOCKSUM": 3600, "Other": 60}
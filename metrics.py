@@ -0,0 +1,180 @@
+"""
+metrics.py	-- Counters, gauges and histograms, exposed in Prometheus text format
+
+    A registry holds named metric families, each of which may have samples for
+any number of label values:
+
+        requests		= registry.counter( "app_requests_total", "Requests served" )
+        requests.inc( endpoint="data" )
+        latency			= registry.histogram( "app_request_seconds", "Request latency" )
+        with latency.time( endpoint="data" ):
+            ...
+        registry.gauge( "app_cache_bytes", "Cache size", function=lambda: {
+            ( ( "layer", "blobs" ), ): 1234 } )
+
+    The registry's exposition() returns the text format scraped by Prometheus
+(see http://prometheus.io/docs/instrumenting/exposition_formats/).  All
+operations are thread-safe.
+"""
+from __future__ import with_statement
+
+import sys
+import threading
+import time
+
+
+# Default histogram buckets (upper bounds), in seconds
+buckets				= ( .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0 )
+
+
+def number( value ):
+    """Format a sample value"""
+    if isinstance( value, ( int, long )):
+        return "%d" % ( value )
+    if value == float( "inf" ):
+        return "+Inf"
+    return repr( float( value ))
+
+
+def escape( value ):
+    return str( value ).replace( "\\", r"\\" ).replace( "\n", r"\n" ).replace( '"', r'\"' )
+
+
+def labelled( name, labels ):
+    """Return the sample name, with any ( ( label, value ), ... ) supplied"""
+    if not labels:
+        return name
+    return "%s{%s}" % ( name, ",".join( '%s="%s"' % ( k, escape( v )) for k, v in labels ))
+
+
+class family( object ):
+    """A metric family: a counter, gauge or histogram, with samples for each
+    distinct set of label values.  A gauge may instead supply a function,
+    returning { ( ( label, value ), ... ): value } (or just a value) when
+    scraped.
+    """
+    def __init__( self, name, help, kind, buckets=None, function=None ):
+        self.name		= name
+        self.help		= help
+        self.kind		= kind
+        self.buckets		= buckets
+        self.function		= function
+        self.lock		= threading.Lock()
+        self.samples		= {}	# { ( ( label, value ), ... ): value or [ counts..., sum, count ] }
+
+    def inc( self, amount=1, **labels ):
+        key			= tuple( sorted( labels.items() ))
+        with self.lock:
+            self.samples[key]	= self.samples.get( key, 0 ) + amount
+
+    def set( self, value, **labels ):
+        key			= tuple( sorted( labels.items() ))
+        with self.lock:
+            self.samples[key]	= value
+
+    def observe( self, value, **labels ):
+        key			= tuple( sorted( labels.items() ))
+        with self.lock:
+            sample		= self.samples.get( key )
+            if sample is None:
+                sample		= self.samples[key] = [ 0 ] * len( self.buckets ) + [ 0.0, 0 ]
+            for i, bound in enumerate( self.buckets ):
+                if value <= bound:
+                    sample[i]  += 1
+            sample[-2]	       += value
+            sample[-1]	       += 1
+
+    def time( self, **labels ):
+        """A context manager, observing the seconds elapsed within it"""
+        return timer( self, labels )
+
+    def value( self, **labels ):
+        """The current value of a counter or gauge (or count of a histogram)"""
+        key			= tuple( sorted( labels.items() ))
+        with self.lock:
+            sample		= self.samples.get( key, 0 )
+        return sample[-1] if isinstance( sample, list ) else sample
+
+    def lines( self ):
+        yield "# HELP %s %s" % ( self.name, self.help.replace( "\\", r"\\" ).replace( "\n", r"\n" ))
+        yield "# TYPE %s %s" % ( self.name, self.kind )
+        if self.function is not None:
+            samples		= self.function()
+            if not isinstance( samples, dict ):
+                samples		= { (): samples }
+        else:
+            with self.lock:
+                samples		= dict( ( k, list( v ) if isinstance( v, list ) else v )
+                                        for k, v in self.samples.items() )
+        for key in sorted( samples ):
+            sample		= samples[key]
+            if self.kind != "histogram":
+                yield "%s %s" % ( labelled( self.name, key ), number( sample ))
+                continue
+            for bound, count in zip( self.buckets, sample ):
+                yield "%s %d" % ( labelled( self.name + "_bucket", key + ( ( "le", number( bound )), )),
+                                  count )
+            yield "%s %d" % ( labelled( self.name + "_bucket", key + ( ( "le", "+Inf" ), )),
+                              sample[-1] )
+            yield "%s %s" % ( labelled( self.name + "_sum", key ), number( sample[-2] ))
+            yield "%s %d" % ( labelled( self.name + "_count", key ), sample[-1] )
+
+
+class timer( object ):
+    def __init__( self, metric, labels ):
+        self.metric		= metric
+        self.labels		= labels
+
+    def __enter__( self ):
+        self.start		= time.time()
+        return self
+
+    def __exit__( self, typ, val, tbk ):
+        self.metric.observe( time.time() - self.start, **self.labels )
+        return False
+
+
+class registry( object ):
+    def __init__( self ):
+        self.lock		= threading.Lock()
+        self.families		= []
+
+    def register( self, metric ):
+        with self.lock:
+            self.families.append( metric )
+        return metric
+
+    def counter( self, name, help ):
+        return self.register( family( name, help, "counter" ))
+
+    def gauge( self, name, help, function=None ):
+        return self.register( family( name, help, "gauge", function=function ))
+
+    def histogram( self, name, help, buckets=buckets ):
+        return self.register( family( name, help, "histogram", buckets=buckets ))
+
+    def exposition( self ):
+        with self.lock:
+            families		= list( self.families )
+        return "".join( line + "\n" for metric in families for line in metric.lines() )
+
+
+def deep_size( obj, seen=None ):
+    """Estimate the memory (in bytes) used by obj, and everything (not already
+    seen) that it contains: dicts, lists, tuples, sets and object __dict__s.
+    """
+    if seen is None:
+        seen			= set()
+    if id( obj ) in seen:
+        return 0
+    seen.add( id( obj ))
+    size			= sys.getsizeof( obj )
+    if isinstance( obj, dict ):
+        for k, v in obj.items():
+            size	       += deep_size( k, seen ) + deep_size( v, seen )
+    elif isinstance( obj, ( list, tuple, set, frozenset )):
+        for v in obj:
+            size	       += deep_size( v, seen )
+    elif hasattr( obj, "__dict__" ):
+        size		       += deep_size( obj.__dict__, seen )
+    return size
@@ -0,0 +1,34 @@
+import metrics
+
+def test_exposition():
+    registry			= metrics.registry()
+    requests			= registry.counter( "app_requests_total", "Requests served" )
+    latency			= registry.histogram( "app_request_seconds", "Request latency",
+                                                      buckets=( .1, 1.0 ))
+    registry.gauge( "app_cache_bytes", "Cache size", function=lambda: {
+        ( ( "layer", 'a"b' ), ): 1234 } )
+    requests.inc( endpoint="data" )
+    requests.inc( 2, endpoint="data" )
+    latency.observe( .05, endpoint="data" )
+    latency.observe( .5, endpoint="data" )
+    assert requests.value( endpoint="data" ) == 3
+    assert latency.value( endpoint="data" ) == 2
+
+    text			= registry.exposition()
+    assert text.endswith( "\n" )
+    lines			= text.splitlines()
+    assert "# TYPE app_requests_total counter" in lines
+    assert 'app_requests_total{endpoint="data"} 3' in lines
+    assert "# TYPE app_request_seconds histogram" in lines
+    assert 'app_request_seconds_bucket{endpoint="data",le="0.1"} 1' in lines
+    assert 'app_request_seconds_bucket{endpoint="data",le="1.0"} 2' in lines
+    assert 'app_request_seconds_bucket{endpoint="data",le="+Inf"} 2' in lines
+    assert 'app_request_seconds_sum{endpoint="data"} 0.55' in lines
+    assert 'app_request_seconds_count{endpoint="data"} 2' in lines
+    assert 'app_cache_bytes{layer="a\\"b"} 1234' in lines
+
+
+def test_deep_size():
+    shared			= "x" * 1000
+    assert metrics.deep_size( [ shared, shared ] ) < 2 * len( shared )
+    assert metrics.deep_size( { "a": [ shared ] } ) > len( shared )
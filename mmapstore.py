@@ -0,0 +1,108 @@
+"""
+mmapstore.py	-- A file-backed store of named byte strings, shared via mmap
+
+    One process publishes a complete set of named items (eg. encoded HTTP
+responses); any number of processes then read them straight out of their
+(shared, read-only) memory-mapped view of the file, without copying.  Each
+publish writes a new file and atomically renames it into place; readers notice
+the replacement, and map the new one.  Mapped views of the replaced file remain
+valid 'til the last buffer referring to them is released.
+
+    File layout:
+
+        "BDS1"				-- magic
+        <length>			-- big-endian 32-bit length of header
+        <header>			-- JSON: {"index": {name: [offset, length]},
+                                                  "meta": {...}}
+        <data>				-- concatenated items; offsets relative to here
+
+"""
+from __future__ import with_statement
+
+import errno
+import mmap
+import os
+import struct
+import threading
+try:
+    import json
+except:
+    import simplejson as json
+
+
+class store( object ):
+    magic			= "BDS1"
+
+    def __init__( self, path ):
+        self.path		= path
+        self.lock		= threading.Lock()
+        self.ident		= None
+        self.mapped		= None
+        self.base		= 0
+        self.index		= {}
+        self.info		= {}
+
+    def publish( self, items, meta=None ):
+        """Replace the store's contents with the supplied { name: str } items,
+        and any 'meta' data (a JSON-serializable dict).
+        """
+        index			= {}
+        offset			= 0
+        names			= sorted( items.keys() )
+        for name in names:
+            index[name]		= [ offset, len( items[name] ) ]
+            offset	       += len( items[name] )
+        header			= json.dumps( { "index": index, "meta": meta or {} },
+                                              separators=(',', ':') )
+        temp			= "%s.%d.tmp" % ( self.path, os.getpid() )
+        with open( temp, 'wb' ) as f:
+            f.write( self.magic )
+            f.write( struct.pack( ">I", len( header )))
+            f.write( header )
+            for name in names:
+                f.write( items[name] )
+        os.rename( temp, self.path )
+
+    def refresh( self ):
+        """Map the store's file, if it has been (re)published since last mapped."""
+        try:
+            st			= os.stat( self.path )
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            st			= None
+        ident			= ( st.st_ino, st.st_mtime, st.st_size ) if st else None
+        with self.lock:
+            if ident == self.ident:
+                return
+            mapped, base, index, info = None, 0, {}, {}
+            if ident and st.st_size:
+                with open( self.path, 'rb' ) as f:
+                    mapped	= mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+                assert mapped[:4] == self.magic, "Not a store: %s" % ( self.path )
+                length,		= struct.unpack( ">I", mapped[4:8] )
+                header		= json.loads( mapped[8:8+length] )
+                base		= 8 + length
+                index		= header["index"]
+                info		= header["meta"]
+            # Don't close any previous mapping; buffers may still refer to it
+            self.ident		= ident
+            self.mapped		= mapped
+            self.base		= base
+            self.index		= index
+            self.info		= info
+
+    def get( self, name ):
+        """Return the named item as a (read-only, zero-copy) buffer, or None."""
+        self.refresh()
+        with self.lock:
+            entry		= self.index.get( name )
+            if entry is None:
+                return None
+            return buffer( self.mapped, self.base + entry[0], entry[1] )
+
+    def meta( self ):
+        """Return the meta data of the current contents"""
+        self.refresh()
+        with self.lock:
+            return self.info
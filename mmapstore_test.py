@@ -0,0 +1,24 @@
+import os
+
+import mmapstore
+
+def test_store( tmpdir ):
+    path			= str( tmpdir.join( "store" ))
+    writer			= mmapstore.store( path )
+    reader			= mmapstore.store( path )
+    assert reader.get( "a" ) is None and reader.meta() == {}
+
+    writer.publish( { "a": "alpha", "b": "", "c": "charlie" * 1000 }, meta={ "n": 1 } )
+    a				= reader.get( "a" )
+    assert isinstance( a, buffer ) and str( a ) == "alpha"
+    assert str( reader.get( "b" )) == ""
+    assert str( reader.get( "c" )) == "charlie" * 1000
+    assert reader.meta() == { "n": 1 }
+
+    # A re-publish is noticed; buffers of the old contents remain valid
+    writer.publish( { "a": "apple" }, meta={ "n": 2 } )
+    assert str( reader.get( "a" )) == "apple"
+    assert reader.get( "c" ) is None
+    assert str( a ) == "alpha"
+    assert reader.meta() == { "n": 2 }
+    assert os.listdir( str( tmpdir )) == [ "store" ]
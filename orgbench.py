@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+"""
+orgbench.py	-- Benchmark orgserver's stages, on synthetic org-mode Git repositories
+
+    orgbench.py [--commits N] [--projects N] [--width N] [--depth N] [--days N]
+                [--noise N] [--repeat N] [--dicts] [--no-memo] [--output FILE]
+                [--baseline FILE] [<repo>]
+
+    Generates a Git repository of project.org files (see generate); or, if the
+<repo> given already exists, uses it as is.  Then times each stage of
+computing the projects' data, both cold (all of orgserver's caches empty, as
+after "master" advances) and warm (as cached by a running server):
+
+        walk			-- project_data: walk the Git history for each project's blobs
+        parse			-- project_data_parse: parse each blob, and compute the records
+        totals			-- task.totals: roll up each parsed blob's task heirarchy
+        transform/<style>	-- project_stats_transform, for each style (effort, elapsed)
+        encode/<style>		-- json_dumps of the transformed results
+        request/<style>		-- data_request, end to end
+
+    Each stage's time is summed over all the projects; the median and minimum
+of --repeat runs are reported.  Tasks' times are held in <timevector>s, unless
+--dicts (the <timedict>s used before; run both, and compare).  Timespecs are
+parsed and formatted through a memo table, unless --no-memo.  The results (JSON) are written to --output
+(default: stdout).  If a --baseline (a previous run's results) is supplied,
+each timing is compared with it; if any regressed by more than --threshold
+(and by more than --floor seconds), the exit status is 1.
+
+        orgbench.py --output baseline.json
+        ...change something...
+        orgbench.py --baseline baseline.json
+"""
+from __future__ import with_statement
+
+import argparse
+import datetime
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+try:
+    import json
+except:
+    import simplejson as json
+
+import orgserver
+
+styles				= ( "effort", "elapsed" )	# Those project_stats_transform supports
+
+
+def hours( minutes ):
+    return "%d:%02d" % ( minutes // 60, minutes % 60 )
+
+
+def org_file( rng, date, sprint, efforts, progress, width, depth, noise ):
+    """Return the text of a project.org file, as of 'date' (a datetime.date)
+    and 'sprint': a task tree of 'depth' levels of 'width' subtasks, whose
+    leaves have the given 'efforts' (minutes) estimated.  The first 'progress'
+    fraction of them are DONE (with some work clocked); the rest are TODO.
+    Around the table are 'noise' lines of other org-mode content.
+    """
+    done			= int( progress * len( efforts ))
+    work			= [ ( effort * 5 // 4 if i < done
+                                      else effort // 2 if i == done else 0 )
+                                    for i, effort in enumerate( efforts ) ]
+
+    def rows( level, first, count, label ):
+        """Yield the rows of the subtree of the 'count' leaves from 'first'"""
+        state			= "DONE" if first + count <= done else "TODO"
+        description		= "Task " + label
+        if level == 1:
+            description		= "Project burndown <%s> Sprint %d" % (
+                date.strftime( "%Y-%m-%d %a" ), sprint )
+        yield "| %-60s | %6s | %8s |" % (
+            "*" * level + " " + state + " " + description,
+            hours( sum( efforts[first:first+count] )),
+            hours( sum( work[first:first+count] )) if sum( work[first:first+count] ) else "" )
+        if level <= depth:
+            count	      //= width
+            for i in range( width ):
+                for row in rows( level + 1, first + i * count, count,
+                                 ( label + "." if label else "" ) + str( i + 1 )):
+                    yield row
+
+    words			= ( "lorem", "ipsum", "dolor", "sit", "amet", "consectetur",
+                                    "adipiscing", "elit", "sed", "do", "eiusmod", "tempor" )
+    def prose( count ):
+        for i in range( count ):
+            kind		= rng.randrange( 4 )
+            text		= " ".join( rng.choice( words ) for w in range( rng.randrange( 3, 12 )))
+            if kind == 0:
+                yield "** Notes on %s" % ( text )
+            elif kind == 1:
+                yield "   - %s" % ( text )
+            else:
+                yield "   %s." % ( text.capitalize() )
+
+    lines			= [ "* Project", "  :PROPERTIES:", "  :ID: local", "  :END:" ]
+    lines.extend( prose( noise // 2 ))
+    lines.append( "#+BEGIN: columnview :hlines 1 :id local" )
+    lines.append( "| %-60s | %6s | %8s |" % ( "Task", "Effort", "CLOCKSUM" ))
+    lines.append( "|-%s-+-%s-+-%s-|" % ( "-" * 60, "-" * 6, "-" * 8 ))
+    lines.extend( rows( 1, 0, len( efforts ), "" ))
+    lines.append( "#+END:" )
+    lines.extend( prose( noise - noise // 2 ))
+    return "\n".join( lines ) + "\n"
+
+
+def generate( path, commits=100, projects=1, width=4, depth=2, days=None,
+              noise=0, seed=0 ):
+    """Create a Git repository at 'path', with 'commits' commits of 'projects'
+    project<N>.org files (each commit updates one of them, in turn), spread
+    over 'days' days (default: one per commit) of history.  Each project's task
+    tree has 'depth' levels of 'width' subtasks, and 'noise' lines of other
+    content around the table.  Tasks are completed steadily, over the history;
+    some remaining ones are re-estimated as they go.  The same arguments
+    (including 'seed') always generate the same content.
+
+    Uses git fast-import, so even very large histories are generated quickly.
+    """
+    rng				= random.Random( seed )
+    days			= days or commits
+    leaves			= width ** depth
+    efforts			= [ [ rng.randrange( 1, 9 ) * 60 for i in range( leaves ) ]
+                                    for p in range( projects ) ]
+    start			= datetime.date( 2012, 1, 2 )
+    subprocess.check_call( [ "git", "init", "-q", path ] )
+    subprocess.check_call( [ "git", "symbolic-ref", "HEAD", "refs/heads/master" ], cwd=path )
+    importer			= subprocess.Popen( [ "git", "fast-import", "--quiet" ],
+                                                    cwd=path, stdin=subprocess.PIPE )
+    def data( text ):
+        importer.stdin.write( "data %d\n%s\n" % ( len( text ), text ))
+
+    for c in range( commits ):
+        p			= c % projects
+        day			= c * days // commits
+        date			= start + datetime.timedelta( day )
+        progress		= float( c + 1 ) / commits
+        for i in range( leaves ):
+            if i > progress * leaves and rng.random() < .05:
+                efforts[p][i]	= max( 60, efforts[p][i] + rng.choice(( -60, 60 )))
+        content			= org_file( rng, date, day // 14 + 1, efforts[p], progress,
+                                            width, depth, noise )
+        stamp			= int( time.mktime( date.timetuple() )) + 12*60*60 + c
+        importer.stdin.write( "commit refs/heads/master\nmark :%d\n" % ( c + 1 ))
+        importer.stdin.write( "committer Bench <bench@example.com> %d +0000\n" % ( stamp ))
+        data( "Update project%d.org on %s" % ( p, date ))
+        if c:
+            importer.stdin.write( "from :%d\n" % ( c ))
+        importer.stdin.write( "M 100644 inline project%d.org\n" % ( p ))
+        data( content )
+    importer.stdin.close()
+    assert importer.wait() == 0, "git fast-import failed"
+    subprocess.check_call( [ "git", "reset", "-q", "--hard" ], cwd=path )
+    return [ "project%d" % ( p ) for p in range( projects ) ]
+
+
+def reset():
+    """Empty all of orgserver's caches, so the next computation is cold"""
+    orgserver.project_data.hexsha	= None
+    orgserver.project_data.result	= None
+    orgserver.project_data_parse.cache	= {}
+    orgserver.hms.memo_from.clear()
+    orgserver.hms.memo_into.clear()
+    with orgserver.data_request.lock:
+        orgserver.data_request.hexsha	= None
+        orgserver.data_request.previous	= None
+
+
+def timed( function, *args, **kwds ):
+    """Return the seconds taken to call function, and its result"""
+    started			= time.time()
+    result			= function( *args, **kwds )
+    return time.time() - started, result
+
+
+def benchmark( repository, projects, repeat=5 ):
+    """Time each stage, cold and warm, 'repeat' times.  Returns { <stage>: {
+    "cold": [ seconds, ... ], "warm": [ seconds, ... ] }, ... }, and the total
+    number of blobs parsed.
+    """
+    samples			= {}
+    def record( stage, kind, seconds ):
+        samples.setdefault( stage, {} ).setdefault( kind, [] ).append( seconds )
+
+    blobs			= 0
+    for r in range( repeat ):
+        reset()
+        for kind in "cold", "warm":
+            seconds, ( hexsha, data ) = timed( orgserver.project_data, repository, projects )
+            record( "walk", kind, seconds )
+        blobs			= sum( len( data[proj] ) for proj in projects )
+
+        totals			= {}
+        for proj in projects:
+            for kind in "cold", "warm":
+                seconds, stats	= timed( orgserver.project_data_parse, data, proj )
+                totals[( "parse", kind )] = totals.get( ( "parse", kind ), 0.0 ) + seconds
+            tasks		= dict( ( blob.hexsha, orgserver.project_data_parse.cache[blob.hexsha, None] )
+                                        for blob in data[proj] )
+            for kind in "cold", "warm":
+                for ahead in tasks.values():
+                    if ahead:
+                        seconds, total = timed( ahead["task"].totals )
+                        totals[( "totals", kind )] = totals.get( ( "totals", kind ), 0.0 ) + seconds
+            for style in styles:
+                for kind in "cold", "warm":
+                    seconds, trans = timed( orgserver.project_stats_transform, stats, style )
+                    stage	= ( "transform/" + style, kind )
+                    totals[stage] = totals.get( stage, 0.0 ) + seconds
+                    seconds, response = timed( orgserver.json_dumps, trans )
+                    stage	= ( "encode/" + style, kind )
+                    totals[stage] = totals.get( stage, 0.0 ) + seconds
+        for ( stage, kind ), seconds in totals.items():
+            record( stage, kind, seconds )
+
+        for style in styles:
+            reset()
+            for kind in "cold", "warm":
+                seconds		= 0.0
+                for proj in projects:
+                    seconds    += timed( orgserver.data_request, repository, projects,
+                                         proj + "/" + style, queries={}, environ={},
+                                         accept="application/json", stale=0 )[0]
+                record( "request/" + style, kind, seconds )
+    return samples, blobs
+
+
+def summarize( samples ):
+    """Return { <stage>: { <kind>: { "median": s, "min": s, "samples": [ s, ... ] }}}"""
+    summary			= {}
+    for stage, kinds in samples.items():
+        for kind, seconds in kinds.items():
+            ordered		= sorted( seconds )
+            summary.setdefault( stage, {} )[kind] = {
+                "median":	ordered[len( ordered ) // 2],
+                "min":		ordered[0],
+                "samples":	seconds,
+            }
+    return summary
+
+
+def compare( results, baseline, threshold=.25, floor=.001 ):
+    """Compare each (median) timing in results with that in the baseline.
+    Returns the lines of a report, and a list of the timings which regressed
+    by more than 'threshold' (a fraction), and more than 'floor' seconds.
+    """
+    lines			= [ "%-20s %-5s %10s %10s %8s" % (
+        "stage", "kind", "baseline", "now", "change" ) ]
+    regressed			= []
+    for stage in sorted( results["timings"] ):
+        for kind in "cold", "warm":
+            now			= results["timings"][stage].get( kind )
+            then		= baseline.get( "timings", {} ).get( stage, {} ).get( kind )
+            if now is None or then is None:
+                continue
+            now, then		= now["median"], then["median"]
+            change		= ( now - then ) / then if then else 0.0
+            flag		= ""
+            if change > threshold and now - then > floor:
+                flag		= "  REGRESSED"
+                regressed.append( ( stage, kind ))
+            lines.append( "%-20s %-5s %9.2fms %9.2fms %+7.0f%%%s" % (
+                stage, kind, then * 1000, now * 1000, change * 100, flag ))
+    return lines, regressed
+
+
+def main( argv=None ):
+    parser			= argparse.ArgumentParser(
+        description = "Benchmark orgserver's stages on a synthetic org-mode Git repository" )
+    parser.add_argument( '--commits', type=int, default=200,
+                         help="Commits of history to generate (default: 200)" )
+    parser.add_argument( '--projects', type=int, default=2,
+                         help="Projects (project<N>.org files) to generate (default: 2)" )
+    parser.add_argument( '--width', type=int, default=4,
+                         help="Subtasks of each task (default: 4)" )
+    parser.add_argument( '--depth', type=int, default=2,
+                         help="Levels of subtasks below each project (default: 2)" )
+    parser.add_argument( '--days', type=int, default=None,
+                         help="Days of history, over which commits are spread (default: one per commit)" )
+    parser.add_argument( '--noise', type=int, default=20,
+                         help="Lines of other content around each table (default: 20)" )
+    parser.add_argument( '--seed', type=int, default=0,
+                         help="Random seed for the generated content (default: 0)" )
+    parser.add_argument( '--repeat', type=int, default=5,
+                         help="Runs of each benchmark (default: 5)" )
+    parser.add_argument( '--dicts', action='store_true',
+                         help="Hold tasks' times in timedicts, not timevectors" )
+    parser.add_argument( '--no-memo', action='store_true',
+                         help="Don't memoize timespec parsing and formatting" )
+    parser.add_argument( '--output',
+                         help="Write results (JSON) to file (default: stdout)" )
+    parser.add_argument( '--baseline',
+                         help="Compare with a previous run's results" )
+    parser.add_argument( '--threshold', type=float, default=.25,
+                         help="Fractional slow-down deemed a regression (default: .25)" )
+    parser.add_argument( '--floor', type=float, default=.001,
+                         help="... if also slower by more than this many seconds (default: .001)" )
+    parser.add_argument( 'repository', nargs='?',
+                         help="Git repository to use; generated, if it doesn't exist (default: temporary)" )
+    args			= parser.parse_args( argv )
+
+    temporary			= None
+    repository			= args.repository
+    generated			= repository is None or not os.path.exists( repository )
+    if repository is None:
+        temporary		= repository = tempfile.mkdtemp( prefix="orgbench-" )
+        os.rmdir( repository )
+    try:
+        if generated:
+            projects		= generate( repository, commits=args.commits, projects=args.projects,
+                                            width=args.width, depth=args.depth, days=args.days,
+                                            noise=args.noise, seed=args.seed )
+        else:
+            projects		= sorted( name[:-4] for name in os.listdir( repository )
+                                          if name.endswith( ".org" ))
+        orgserver.parse_tasks.vectors = not args.dicts
+        if args.no_memo:
+            orgserver.hms.memo_limit = 0
+        samples, blobs		= benchmark( repository, projects, repeat=args.repeat )
+    finally:
+        if temporary:
+            shutil.rmtree( temporary, ignore_errors=True )
+
+    results			= {
+        "meta":		{
+            "commits":		args.commits,
+            "projects":		len( projects ),
+            "width":		args.width,
+            "depth":		args.depth,
+            "days":		args.days or args.commits,
+            "noise":		args.noise,
+            "seed":		args.seed,
+            "repeat":		args.repeat,
+            "vectors":		not args.dicts,
+            "memo":		not args.no_memo,
+            "blobs":		blobs,
+            "repository":	args.repository,
+            "generated":	generated,	# Else, the above parameters are moot
+            "python":		platform.python_version(),
+            "platform":		platform.platform(),
+            "time":		time.strftime( "%Y-%m-%d %H:%M:%S" ),
+        },
+        "timings":	summarize( samples ),
+    }
+    text			= json.dumps( results, indent=4, sort_keys=True )
+    if args.output:
+        with open( args.output, 'w' ) as f:
+            f.write( text + "\n" )
+    else:
+        print text
+
+    if args.baseline:
+        with open( args.baseline, 'r' ) as f:
+            baseline		= json.load( f )
+        lines, regressed	= compare( results, baseline, threshold=args.threshold,
+                                           floor=args.floor )
+        sys.stderr.write( "\n".join( lines ) + "\n" )
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,53 @@
+import os
+
+import orgbench
+import orgserver
+
+
+def test_generate( tmpdir ):
+    repository			= str( tmpdir.join( "repo" ))
+    projects			= orgbench.generate( repository, commits=8, projects=2, width=2,
+                                                     depth=2, days=4, noise=6 )
+    assert projects == [ "project0", "project1" ]
+    assert sorted( f for f in os.listdir( repository ) if f.endswith( ".org" )) == [
+        "project0.org", "project1.org" ]
+    orgbench.reset()
+    hexsha, data		= orgserver.project_data( repository, projects )
+    assert all( len( data[proj] ) >= 4 for proj in projects )
+    stats			= orgserver.project_data_parse( data, "project0" )
+    # Two commits a day; each project is updated once a day
+    assert [ rec["date"] for rec in stats["list"] ] == [
+        "2012-01-02", "2012-01-03", "2012-01-04", "2012-01-05" ]
+    assert stats["list"][-1]["estimated"]["done#"] > 0
+    text			= open( os.path.join( repository, "project0.org" )).read()
+    assert text.count( "| ** " ) == 2 and text.count( "| *** " ) == 4
+
+    # The records are the same, whether tasks' times are timevectors or timedicts
+    try:
+        orgserver.parse_tasks.vectors = False
+        orgbench.reset()
+        assert orgserver.project_data_parse( data, "project0" ) == stats
+    finally:
+        orgserver.parse_tasks.vectors = True
+        orgbench.reset()
+
+    # Every stage is timed, cold and warm
+    samples, blobs		= orgbench.benchmark( repository, projects, repeat=2 )
+    assert blobs == sum( len( data[proj] ) for proj in projects )
+    assert sorted( samples ) == [ "encode/effort", "encode/elapsed", "parse",
+                                  "request/effort", "request/elapsed", "totals",
+                                  "transform/effort", "transform/elapsed", "walk" ]
+    summary			= orgbench.summarize( samples )
+    assert all( len( summary[stage][kind]["samples"] ) == 2
+                for stage in summary for kind in ( "cold", "warm" ))
+
+
+def test_compare():
+    def results( seconds ):
+        return { "timings": { "parse": { "cold": { "median": seconds },
+                                         "warm": { "median": seconds / 100 }}}}
+    lines, regressed		= orgbench.compare( results( .2 ), results( .1 ))
+    assert regressed == [ ( "parse", "cold" ) ]	# The warm is slower, but by < 1ms
+    assert "REGRESSED" in lines[1] and "+100%" in lines[1]
+    lines, regressed		= orgbench.compare( results( .1 ), results( .1 ))
+    assert not regressed
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""
+orgload.py	-- Load-test an orgserver.py, with a synthetic or recorded mix of requests
+
+    orgload.py [--clients N] [--duration S] [--mix projects=1,effort=4,...]
+               [--commit-every S] [--replay LOG] [--url http://host:port] [<repo>]
+
+    Unless a --url is given, starts a local orgserver.py (--server; default:
+asyncore) on a free port, serving the <repo> (if it doesn't exist, a synthetic
+one is generated there; see orgbench.generate).  Then, --clients concurrent
+keep-alive HTTP clients issue requests as fast as they are answered, for
+--duration seconds (or until --requests are done):
+
+    o A random --mix of /api/projects, and /api/data/<project>/<style> for
+      each weighted style, or
+
+    o The GET requests in a --replay'ed server access log (as written by web.py
+      via wsgilog, or by asynchttp), in order.
+
+    Every --commit-every seconds, a new commit of one of the project's .org
+files is made, so that the server must recompute the (next) requests for it.
+Reports the throughput, and the p50/p95/p99 latencies of each kind of request,
+and the responses' statuses.  The results (JSON) may also be written to
+--output.
+"""
+from __future__ import with_statement
+
+import argparse
+import datetime
+import httplib
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+try:
+    import json
+except:
+    import simplejson as json
+
+import orgbench
+
+
+# An access log entry, eg. (web.py, asynchttp):
+#     127.0.0.1:54321 - - [19/Oct/2026 10:31:34] "HTTP/1.1 GET /api/projects.json" - 200 OK
+# or (Common Log Format):
+#     127.0.0.1 - - [19/Oct/2026:10:31:34 +0000] "GET /api/projects.json HTTP/1.1" 200 1234
+access				= re.compile( r'\[[^]]*\] "(?:HTTP/[0-9.]+ )?([A-Z]+) ([^ "]+)(?: HTTP/[0-9.]+)?" -? ?([0-9]{3})' )
+
+
+def parse_log( lines ):
+    """Yield the path of each GET request in the access log's lines (other than
+    /api/events streams, which would never complete)."""
+    for line in lines:
+        match			= access.search( line )
+        if match is None:
+            continue
+        method, path, status	= match.groups()
+        if method == "GET" and not path.startswith( "/api/events" ):
+            yield path
+
+
+def mixed( mix, projects, rng ):
+    """Yield an endless sequence of request paths, in the proportions given by
+    mix: { "projects": weight, "<style>": weight, ... }"""
+    choices			= []
+    for name, weight in sorted( mix.items() ):
+        choices.extend( [ name ] * weight )
+    while True:
+        name			= rng.choice( choices )
+        if name == "projects":
+            yield "/api/projects.json"
+        else:
+            yield "/api/data/%s/%s.json" % ( rng.choice( projects ), name )
+
+
+def request_kind( path ):
+    """Classify a request path, eg. "/api/data/proj/effort.json" ==> "data/effort" """
+    path			= path.split( "?" )[0]
+    match			= re.match( r"/api/data/[^/]+/(\w+)", path )
+    if match:
+        return "data/" + match.group( 1 )
+    match			= re.match( r"/api/(\w+)", path )
+    if match:
+        return match.group( 1 )
+    return "other"
+
+
+def percentile( ordered, p ):
+    """The p'th percentile of the (sorted) values"""
+    if not ordered:
+        return None
+    return ordered[min( len( ordered ) - 1, int( round( p / 100.0 * ( len( ordered ) - 1 ))))]
+
+
+def inject( repository, project ):
+    """Commit a new version of the project's .org file, dated the day after the
+    one it contains, so the server's cached data for it becomes stale."""
+    path			= os.path.join( repository, project + ".org" )
+    with open( path, 'r' ) as f:
+        text			= f.read()
+    match			= re.search( r"<([0-9]{4}-[0-9]{2}-[0-9]{2})[^>]*>", text )
+    date			= datetime.date( *time.strptime( match.group( 1 ), "%Y-%m-%d" )[:3] )
+    date		       += datetime.timedelta( 1 )
+    text			= text[:match.start()] + date.strftime( "<%Y-%m-%d %a>" ) + text[match.end():]
+    with open( path, 'w' ) as f:
+        f.write( text )
+    environ			= dict( os.environ,
+                                        GIT_AUTHOR_DATE=str( date ) + " 12:00",
+                                        GIT_COMMITTER_DATE=str( date ) + " 12:00" )
+    for cmd in ( [ "git", "add", project + ".org" ],
+                 [ "git", "-c", "user.name=orgload", "-c", "user.email=orgload@example.com",
+                   "commit", "-q", "-m", "Update %s on %s" % ( project, date ) ] ):
+        subprocess.check_call( cmd, cwd=repository, env=environ )
+
+
+def spawn( repository, projects, server="asyncore", options=(), timeout=30.0 ):
+    """Start orgserver.py on a free local port.  Returns the process, and its
+    ( host, port ) once it's accepting connections."""
+    sock			= socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+    sock.bind( ( "127.0.0.1", 0 ))
+    address			= sock.getsockname()
+    sock.close()
+    command			= [ sys.executable,
+                                    os.path.join( os.path.dirname( os.path.abspath( __file__ )),
+                                                  "orgserver.py" ),
+                                    "--server", server, "--address", "%s:%d" % address,
+                                    "--log-level", "WARNING" ] + list( options )
+    with open( os.devnull, 'w' ) as devnull:
+        process			= subprocess.Popen( command + [ repository ] + list( projects ),
+                                                    stdout=devnull, stderr=devnull )
+    deadline			= time.time() + timeout
+    while True:
+        try:
+            socket.create_connection( address, timeout=1.0 ).close()
+            return process, address
+        except socket.error:
+            if process.poll() is not None or time.time() > deadline:
+                if process.poll() is None:
+                    process.terminate()
+                raise Exception( "orgserver.py failed to start: %s" % ( " ".join( command )))
+            time.sleep( .1 )
+
+
+class load( object ):
+    """Drive 'clients' concurrent keep-alive HTTP clients against the server's
+    address, each repeatedly issuing the next of the (shared) 'requests' paths,
+    'til they're exhausted, or the 'duration' (seconds) or count of 'requests'
+    is reached.  Each response's ( kind, status, seconds, bytes ) is recorded in
+    .samples; a failed request's status is None.
+    """
+    def __init__( self, address, requests, clients=8, duration=None, limit=None,
+                  headers=None ):
+        self.address		= address
+        self.requests		= iter( requests )
+        self.clients		= clients
+        self.duration		= duration
+        self.limit		= limit
+        self.headers		= headers or {}
+        self.lock		= threading.Lock()
+        self.samples		= []
+        self.issued		= 0
+        self.deadline		= None
+
+    def run( self ):
+        """Run the clients to completion; return the seconds elapsed"""
+        started			= time.time()
+        if self.duration:
+            self.deadline	= started + self.duration
+        threads			= [ threading.Thread( target=self.client )
+                                    for i in range( self.clients ) ]
+        for t in threads:
+            t.daemon		= True
+            t.start()
+        for t in threads:
+            t.join()
+        return time.time() - started
+
+    def next( self ):
+        """The next request path, or None if we're done"""
+        with self.lock:
+            if self.deadline and time.time() >= self.deadline:
+                return None
+            if self.limit and self.issued >= self.limit:
+                return None
+            try:
+                path		= next( self.requests )
+            except StopIteration:
+                return None
+            self.issued	       += 1
+            return path
+
+    def client( self ):
+        connection		= None
+        while True:
+            path		= self.next()
+            if path is None:
+                break
+            started		= time.time()
+            status, length	= None, 0
+            try:
+                if connection is None:
+                    connection	= httplib.HTTPConnection( *self.address, timeout=60 )
+                connection.request( "GET", path, headers=self.headers )
+                response	= connection.getresponse()
+                length		= len( response.read() )
+                status		= response.status
+                if response.getheader( "connection", "" ).lower() == "close":
+                    connection.close()
+                    connection	= None
+            except Exception, e:
+                if connection is not None:
+                    connection.close()
+                connection	= None
+            with self.lock:
+                self.samples.append( ( request_kind( path ), status, time.time() - started, length ))
+        if connection is not None:
+            connection.close()
+
+
+def report( samples, elapsed, commits=0 ):
+    """Summarize the samples: the throughput, and latencies of each kind of
+    request (and of all of them), and the count of each status."""
+    kinds			= {}
+    statuses			= {}
+    for kind, status, seconds, length in samples:
+        kinds.setdefault( kind, [] ).append( seconds )
+        kinds.setdefault( "all", [] ).append( seconds )
+        statuses[str( status )]	= statuses.get( str( status ), 0 ) + 1
+    summary			= {
+        "requests":	len( samples ),
+        "seconds":	elapsed,
+        "throughput":	len( samples ) / elapsed if elapsed else 0.0,
+        "bytes":	sum( sample[3] for sample in samples ),
+        "commits":	commits,
+        "statuses":	statuses,
+        "latency":	{},
+    }
+    for kind, seconds in kinds.items():
+        ordered			= sorted( seconds )
+        summary["latency"][kind] = {
+            "count":	len( ordered ),
+            "p50":	percentile( ordered, 50 ),
+            "p95":	percentile( ordered, 95 ),
+            "p99":	percentile( ordered, 99 ),
+            "max":	ordered[-1],
+        }
+    return summary
+
+
+def report_lines( summary ):
+    lines			= [ "%d requests in %.1fs: %.1f req/s, %d bytes; %d commits injected" % (
+        summary["requests"], summary["seconds"], summary["throughput"],
+        summary["bytes"], summary["commits"] ) ]
+    lines.append( "%-16s %7s %9s %9s %9s %9s" % ( "kind", "count", "p50", "p95", "p99", "max" ))
+    for kind in sorted( summary["latency"], key=lambda k: ( k != "all", k )):
+        latency			= summary["latency"][kind]
+        lines.append( "%-16s %7d %s" % ( kind, latency["count"], " ".join(
+            "%7.1fms" % ( latency[p] * 1000 ) for p in ( "p50", "p95", "p99", "max" ))))
+    lines.append( "Statuses: " + ", ".join( "%s: %d" % ( status, count )
+                                            for status, count in sorted( summary["statuses"].items() )))
+    return lines
+
+
+def main( argv=None ):
+    parser			= argparse.ArgumentParser(
+        description = "Load-test an orgserver.py, with a synthetic or recorded mix of requests" )
+    parser.add_argument( '--clients', type=int, default=8,
+                         help="Concurrent keep-alive clients (default: 8)" )
+    parser.add_argument( '--duration', type=float, default=10.0,
+                         help="Seconds to run (default: 10; 0 for no limit)" )
+    parser.add_argument( '--requests', type=int, default=0,
+                         help="Requests to issue (default: no limit)" )
+    parser.add_argument( '--mix', default="projects=1,effort=4,elapsed=4",
+                         help="Request weights: projects=N, <style>=N (default: projects=1,effort=4,elapsed=4)" )
+    parser.add_argument( '--replay',
+                         help="Replay the GET requests in a server access log, instead of the --mix" )
+    parser.add_argument( '--commit-every', type=float, default=0.0,
+                         help="Seconds between commits injected into the repository (default: none)" )
+    parser.add_argument( '--gzip', action="store_true",
+                         help="Accept gzip-encoded responses" )
+    parser.add_argument( '--url',
+                         help="Load an already running server, instead of starting one" )
+    parser.add_argument( '--server', default="asyncore",
+                         help="orgserver.py --server framework to start (default: asyncore)" )
+    parser.add_argument( '--option', action="append", default=[],
+                         help="Additional orgserver.py option (eg. --option=--workers=4)" )
+    parser.add_argument( '--commits', type=int, default=200,
+                         help="Commits of history, if generating a repository (default: 200)" )
+    parser.add_argument( '--projects', type=int, default=2,
+                         help="Projects, if generating a repository (default: 2)" )
+    parser.add_argument( '--seed', type=int, default=0,
+                         help="Random seed for the mix of requests (default: 0)" )
+    parser.add_argument( '--output',
+                         help="Write results (JSON) to file" )
+    parser.add_argument( 'repository', nargs='?',
+                         help="Git repository to serve; generated, if it doesn't exist (default: temporary)" )
+    args			= parser.parse_args( argv )
+
+    temporary			= None
+    repository			= args.repository
+    process			= None
+    try:
+        if repository is None and not args.url:
+            temporary		= repository = tempfile.mkdtemp( prefix="orgload-" )
+            os.rmdir( repository )
+        projects		= []
+        if repository:
+            if not os.path.exists( repository ):
+                projects	= orgbench.generate( repository, commits=args.commits,
+                                                     projects=args.projects, seed=args.seed )
+            else:
+                projects	= sorted( name[:-4] for name in os.listdir( repository )
+                                          if name.endswith( ".org" ))
+        if args.url:
+            address		= urlparse.urlparse( args.url ).netloc.split( ":" )
+            address		= ( address[0], int( address[1] ) if len( address ) > 1 else 80 )
+        else:
+            process, address	= spawn( repository, projects, server=args.server,
+                                         options=args.option )
+
+        rng			= random.Random( args.seed )
+        if args.replay:
+            with open( args.replay, 'r' ) as f:
+                requests	= list( parse_log( f ))
+        else:
+            assert projects, "A <repository> is required, to determine the projects"
+            mix			= dict( ( name, int( weight )) for name, weight in (
+                term.split( "=" ) for term in args.mix.split( "," )))
+            requests		= mixed( mix, projects, rng )
+
+        # Inject commits 'til the load is done
+        commits			= []
+        done			= threading.Event()
+        def injector():
+            while not done.wait( args.commit_every ):
+                try:
+                    inject( repository, rng.choice( projects ))
+                    commits.append( time.time() )
+                except Exception, e:
+                    sys.stderr.write( "Failed to inject commit: %s\n" % ( e ))
+        if args.commit_every:
+            assert repository and projects, "Commits require a local <repository>"
+            thread		= threading.Thread( target=injector )
+            thread.daemon	= True
+            thread.start()
+
+        driver			= load( address, requests, clients=args.clients,
+                                        duration=args.duration, limit=args.requests,
+                                        headers={ "Accept-Encoding": "gzip" } if args.gzip else {} )
+        try:
+            elapsed		= driver.run()
+        finally:
+            done.set()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if temporary:
+            shutil.rmtree( temporary, ignore_errors=True )
+
+    summary			= report( driver.samples, elapsed, commits=len( commits ))
+    print "\n".join( report_lines( summary ))
+    if args.output:
+        with open( args.output, 'w' ) as f:
+            f.write( json.dumps( summary, indent=4, sort_keys=True ) + "\n" )
+    return 0 if summary["requests"] and not summary["statuses"].get( "None" ) else 1
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,60 @@
+import random
+import subprocess
+
+import orgbench
+import orgload
+
+
+def test_parse_log():
+    log				= [
+        '127.0.0.1:47020 - - [19/Oct/2026 10:35:10] "HTTP/1.1 GET /api/data/p/effort.json" - 200 OK',
+        '127.0.0.1:47021 - - [19/Oct/2026 10:35:10] "HTTP/1.1 GET /api/events/p" - 200 OK',
+        'Some other diagnostic output',
+        '127.0.0.1:47022 - - [19/Oct/2026 10:35:11] "HTTP/1.1 POST /api/refresh" - 200 OK',
+        '127.0.0.1 - - [19/Oct/2026:10:35:12 +0000] "GET /api/projects.json?pretty=1 HTTP/1.1" 200 512',
+    ]
+    assert list( orgload.parse_log( log )) == [ "/api/data/p/effort.json",
+                                                "/api/projects.json?pretty=1" ]
+
+
+def test_mix_and_report():
+    requests			= orgload.mixed( { "projects": 1, "effort": 3 }, [ "a", "b" ],
+                                                 random.Random( 0 ))
+    paths			= [ next( requests ) for i in range( 400 ) ]
+    kinds			= [ orgload.request_kind( path ) for path in paths ]
+    assert set( kinds ) == set( [ "projects", "data/effort" ] )
+    assert 50 < kinds.count( "projects" ) < 150
+    assert set( path for path in paths if "effort" in path ) == set( [
+        "/api/data/a/effort.json", "/api/data/b/effort.json" ] )
+
+    samples			= [ ( "projects", 200, i / 1000.0, 10 ) for i in range( 1, 101 ) ]
+    samples.append( ( "data/effort", None, 1.0, 0 ) )
+    summary			= orgload.report( samples, 2.0, commits=1 )
+    assert summary["requests"] == 101 and summary["throughput"] == 50.5
+    assert summary["statuses"] == { "200": 100, "None": 1 }
+    assert summary["latency"]["projects"]["p50"] == .051
+    assert summary["latency"]["projects"]["p99"] == .099
+    assert summary["latency"]["all"]["max"] == 1.0
+
+
+def test_load( tmpdir ):
+    repository			= str( tmpdir.join( "repo" ))
+    projects			= orgbench.generate( repository, commits=6, projects=2, width=2, depth=1 )
+    orgload.inject( repository, "project1" )
+    assert subprocess.check_output( [ "git", "log", "-1", "--format=%s" ],
+                                    cwd=repository ).strip() == "Update project1 on 2012-01-08"
+
+    process, address		= orgload.spawn( repository, projects )
+    try:
+        requests		= [ "/api/projects.json" ] + [
+            "/api/data/%s/elapsed.json" % ( proj ) for proj in projects ] * 5 + [
+            "/api/data/missing/effort.json" ]
+        driver			= orgload.load( address, requests, clients=3 )
+        elapsed			= driver.run()
+    finally:
+        process.terminate()
+        process.wait()
+    summary			= orgload.report( driver.samples, elapsed )
+    assert summary["requests"] == 12
+    assert summary["statuses"] == { "200": 11, "404": 1 }
+    assert summary["latency"]["data/elapsed"]["count"] == 10
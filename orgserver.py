@@ -4,6 +4,9 @@ org-server.py	-- Provide HTTP access to project data in the supplied Git reposit
 
     org-server.py <repo> <project> ...
 
+A <project> is a <project>.org file's first org-mode table, or <file>:<table>
+for one of several tables in <file>.org, named by :id or top-level heading.
+
 api/projects
 
     Returns JSON describing all projects available.
@@ -16,34 +19,91 @@ api/data/<project>/<time-style>
        elapsed		Data is aggregated for periods of calendar time elapsed
        sprint           Data is aggregated for each sprint elapsed
 
+api/batch?projects=<project>,...&style=<time-style>
+
+   Returns several projects' data in one response, and their combined portfolio.
+
+api/metrics
+
+   The server's instrumentation (request latency, time spent in each stage,
+   cache hits, misses and sizes), in Prometheus text format.
+
+api/events[/<project>]
+
+   A Server-Sent Events stream, announcing each update to the project(s) data.
+
+POST api/refresh[?pull]
+
+   Walks any new commits now (after first fetching and fast-forwarding
+   "master", with ?pull); eg. from a Git hook (see orgserver-refresh).
+   Only permitted from the server's own host, or via its --control socket.
+
+api/data/<project>/<time-style>.bin (or Accept: application/x-msgpack)
+
+   Returns the <project> history in columnar form, encoded as MessagePack.
+
+GET Query options (all optional):
+
+    callback=<function>	Wrap the JSON in a function call (JSONP)
+    pretty=1		Indent the JSON, for human consumption (default: compact)
+    linear		Use linear, instead of best-fit, projections (api/data, api/batch)
+    since=<blob|date>	Only records from the given blob or date on (api/data only)
+    asof=<commit|blob|date> The data as it was at the given commit, blob or date (api/data only)
+    working		Append a provisional record from uncommitted edits (api/data only)
+    profile=cpu|mem	Profile the request, returning the summary (api/data, api/projects; see --profile)
+
+Responses are compressed (gzip or deflate), if the client's Accept-Encoding
+allows.
+
 """
 from __future__ import with_statement
 
 import argparse
+import binascii
 import cgi
+import collections
 import copy
+import cPickle
 import datetime
+import fcntl
+import gzip
+import hashlib
 try:
     import json
 except:
     import simplejson as json
 import logging
 import math
+import Queue
 import re
 import socket
 import string
 import os
+import struct
 import sys
 import textwrap
+import threading
 import time
+import zlib
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
 
 import git		# modules from site-packages
 
 from mathdict import *	# modules local to project
+import metrics
 
 global day_seconds
 day_seconds		= 8*60*60 # Default day is 8 hours
 
+# Diagnostics.  The detailed tracing of each commit, blob, record and bucket is
+# at DEBUG level; its (sometimes costly) arguments are only formatted, or even
+# computed, if DEBUG is enabled (see --log-level).
+log			= logging.getLogger( "orgserver" )
+log.addHandler( logging.NullHandler() )
+
 # For compatibility with 2.5
 # Lifted from:
 #     http://stackoverflow.com/questions/1716428/def-next-for-python-pre-2-6-instead-of-object-next-method/1716464#1716464
@@ -75,6 +135,94 @@ except NameError:
                 raise
         return default
 
+# Instrumentation, exposed by /api/metrics (see metrics_request)
+instruments			= metrics.registry()
+metric_requests			= instruments.histogram(
+    "orgserver_request_seconds", "API request latency, by endpoint and status" )
+metric_stages			= instruments.histogram(
+    "orgserver_stage_seconds", "Time spent in each stage of computing project data" )
+metric_commits			= instruments.counter(
+    "orgserver_git_commits_total", "Git commits visited, walking history" )
+metric_blob_bytes		= instruments.counter(
+    "orgserver_blob_read_bytes_total", "Bytes of org-mode blobs read from Git" )
+metric_blobs			= instruments.counter(
+    "orgserver_parse_blobs_total", "Org-mode blobs parsed" )
+metric_rows			= instruments.counter(
+    "orgserver_parse_rows_total", "Org-mode table rows parsed" )
+metric_hits			= instruments.counter(
+    "orgserver_cache_hits_total", "Cache hits, by layer" )
+metric_misses			= instruments.counter(
+    "orgserver_cache_misses_total", "Cache misses, by layer" )
+metric_evictions		= instruments.counter(
+    "orgserver_cache_evictions_total", "Cache entries discarded, by layer" )
+
+# Each stage and cache layer contributes to one phase of a request's
+# Server-Timing: header (see server_timing), if enabled for the request
+timing_phases			= ( "git", "parse", "stats", "transform", "encode" )
+timing_stages			= { "walk": "git", "read": "git", "parse": "parse",
+                                    "stats": "stats", "transform": "transform",
+                                    "serialize": "encode", "compress": "encode" }
+timing_layers			= { "commits": "git", "blobs": "parse", "working": "parse",
+                                    "stats": "stats", "transforms": "transform",
+                                    "responses": "encode", "store": "encode" }
+timing				= threading.local()	# .phases: { phase: [ seconds, hits, misses ] }
+
+
+def stage_observe( stage, seconds ):
+    """Record the seconds spent in a stage of computing project data"""
+    metric_stages.observe( seconds, stage=stage )
+    phases			= getattr( timing, "phases", None )
+    if phases is not None:
+        phases.setdefault( timing_stages[stage], [ 0.0, 0, 0 ] )[0] += seconds
+
+
+class staged( object ):
+    """A context manager, recording the seconds spent in a stage"""
+    def __init__( self, stage ):
+        self.stage		= stage
+
+    def __enter__( self ):
+        self.started		= time.time()
+        return self
+
+    def __exit__( self, typ, val, tbk ):
+        stage_observe( self.stage, time.time() - self.started )
+        return False
+
+
+def cache_lookup( layer, hit, count=1 ):
+    """Record 'count' cache hits (or misses) in a layer"""
+    if not count:
+        return
+    ( metric_hits if hit else metric_misses ).inc( count, layer=layer )
+    phases			= getattr( timing, "phases", None )
+    if phases is not None:
+        phases.setdefault( timing_layers[layer], [ 0.0, 0, 0 ] )[1 if hit else 2] += count
+
+
+def server_timing( phases, seconds ):
+    """Return a Server-Timing: header value, describing the time spent in each
+    phase of a request (and in total), in milliseconds.  Each phase is marked
+    "hit" if its results were all found in cache (or if it was unnecessary,
+    because a later phase's were), or "miss" if any were computed.
+    """
+    terms			= []
+    hit				= False
+    for phase in reversed( timing_phases ):
+        spent, hits, misses	= phases.get( phase, ( 0.0, 0, 0 ))
+        desc			= ""
+        if misses:
+            desc		= "miss"
+            hit			= False
+        elif hits or hit:
+            desc		= "hit"
+            hit			= True
+        terms.insert( 0, "%s;dur=%.1f%s" % ( phase, spent * 1000,
+                                              ';desc="%s"' % desc if desc else "" ))
+    terms.append( "total;dur=%.1f" % ( seconds * 1000 ))
+    return ", ".join( terms )
+
+
 def project_data( repository, projects ):
     """Given a repo name, return a dict containing a list of
     historical blobs for each project.  If the "master"" commit hasn't
@@ -103,8 +251,17 @@ def project_data( repository, projects ):
 
         project["name"] = [oldest, ..., newest]
 
+    When "master" advances (eg. by a fast-forward), only the new commits are
+    walked, back to the commit previously walked; its lists are extended.
+
     """
 
+    # Only one thread walks the Git history at a time; any others wait, and
+    # then (usually) find the data they need already cached.
+    with project_data.lock:
+        return project_data_walk( repository, projects )
+
+def project_data_walk( repository, projects ):
     # Obtain read-only access to the Git repo 'master' branch
     repo			= git.Repo( repository )
     assert repo.bare == False
@@ -115,51 +272,191 @@ def project_data( repository, projects ):
 
     # See if "master" commit has changed; if not, return cached result data
     if project_data.hexsha != commit.hexsha:
-        # A new "master" commit; recompute result data
+        # A new "master" commit; recompute result data.  Remember the last
+        # commit walked, so we need only walk back as far as it, again.
+        metric_evictions.inc( len( project_data.result or {} ), layer="commits" )
+        if project_data.result:
+            project_data.previous = ( project_data.hexsha, project_data.result )
         project_data.hexsha	= commit.hexsha
         project_data.result	= {}
 
     # See what project entries remain after removing those in cache
     remains			= set( projects ) - set( project_data.result.keys() )
+    if uncached():
+        remains			= set( projects )
+    cache_lookup( "commits", True, len( set( projects ) - remains ))
+    cache_lookup( "commits", False, len( remains ))
     if not remains:
         return project_data.hexsha, project_data.result
-
-    # Some project data remains to be gleaned.
+    started			= time.time()
+
+    # Some project data remains to be gleaned.  Collect it into a new copy of
+    # the result, so any other thread's reference to the old one is unchanged.
+    result			= dict( project_data.result )
+    for p in remains:
+        result.pop( p, None )
+
+    # If every remaining project was found in a previously walked commit, we
+    # may stop walking upon reaching it (usually, only a few commits back),
+    # and splice the newer blobs onto its lists.  Otherwise, walk it all.
+    since, before		= project_data.previous or ( None, {} )
+    if uncached() or not remains <= set( before ):
+        since			= None
+    debug			= log.isEnabledFor( logging.DEBUG )
     while commit:
-        #'''
-        print "Commit %8.8s by %-20.20s on %s" % (
-            commit.hexsha, commit.author, time.strftime( "%Y-%m-%d %H:%M:%S",
-                                                         time.localtime( commit.committed_date )))
-        print "  %s" % ( commit.message )
-        for b in commit.tree.blobs:
-            print "  %8.8s: %-20s: %-50.50s" % (
-                b.hexsha, b.name, repr( b.data_stream.read( 50 )))
-        #'''
+        if commit.hexsha == since:
+            for p in remains:
+                newer		= result.get( p, [] )
+                older		= before[p]
+                if newer and older and newer[0].hexsha == older[-1].hexsha:
+                    newer	= newer[1:]
+                result[p]	= older + newer
+            log.debug( "Commit %8.8s previously walked; spliced", commit.hexsha )
+            break
+        if debug:
+            log.debug( "Commit %8.8s by %-20.20s on %s", commit.hexsha, commit.author,
+                       time.strftime( "%Y-%m-%d %H:%M:%S", time.localtime( commit.committed_date )))
+            log.debug( "  %s", commit.message )
+            for b in commit.tree.blobs:
+                log.debug( "  %8.8s: %-20s: %-50.50r", b.hexsha, b.name, b.data_stream.read( 50 ))
         for p in remains:
             try:
-                b		= commit.tree/(p + ".org")
+                b		= commit.tree/( project_name( p )[0] + ".org" )
             except Exception, e:
-                print "No %s.org found in commit %8.8s" %( p, commit.hexsha )
+                log.debug( "No %s.org found in commit %8.8s", p, commit.hexsha )
                 continue
-            bl                  = project_data.result.setdefault( p, [] )
-            if not bl or bl[-1].hexsha != b.hexsha:
+            bl                  = result.setdefault( p, [] )
+            if not bl or bl[0].hexsha != b.hexsha:
                 bl.insert( 0, b )
             # else:d print "Dropping duplicate blob:" + b.hexsha
 
         commit              = commit.parents[0] if commit.parents else None
+        metric_commits.inc()
 
-    '''
-    for p, bl in project_data.result.items():
-        print "Project %s:" % ( p )
-        for b in bl:
-            print "  %8.8s: %-20s: %-50.50s" % (
-                b.hexsha, b.name, repr( b.data_stream.read( 50 )))
-    '''
+    stage_observe( "walk", time.time() - started )
+    project_data.result		= result
     return project_data.hexsha, project_data.result
 
-# Initial cache for project_data function
+# Initial cache for project_data function.  The lock also serializes access to
+# the Git repository's object database, which isn't thread-safe.
 project_data.hexsha		= None
 project_data.result		= None
+project_data.previous		= None	# ( hexsha, result ) last walked, before "master" advanced
+project_data.lock		= threading.RLock()
+
+
+def repository_head( repository ):
+    """Return the hexsha of the Git repository's "master" commit.  This is cheap
+    (no history is walked), and determines all of the project data.
+    """
+    return git.Repo( repository ).heads.master.commit.hexsha
+
+
+def repository_pull( repository, remote="origin" ):
+    """Fetch the remote, and fast-forward the Git repository's "master" (and its
+    working tree) to the remote's, as "git pull --ff-only" does.  Serialized
+    with our walking of the repository (see project_data).  Returns True iff
+    "master" moved; raises git.GitCommandError on failure (eg. if "master" has
+    diverged, or isn't checked out).
+    """
+    with project_data.lock:
+        repo			= git.Repo( repository )
+        before			= repo.heads.master.commit.hexsha
+        repo.git.pull( "--ff-only", remote, "master" )
+        return repo.heads.master.commit.hexsha != before
+
+
+class admission( object ):
+    """Admission control for expensive computations: at most 'limit' may run at
+    once, and at most 'queue' more may wait (for up to 'timeout' seconds) for
+    their turn.  Beyond that, acquire fails immediately, and the client should
+    be asked to try again in 'retry' seconds.
+    """
+    def __init__( self, limit=2, queue=8, timeout=30.0, retry=5 ):
+        self.limit		= limit
+        self.queue		= queue
+        self.timeout		= timeout
+        self.retry		= retry
+        self.running		= 0
+        self.waiting		= 0
+        self.condition		= threading.Condition()
+
+    def acquire( self ):
+        """Wait for a turn to run; returns False if refused (or timed out)."""
+        with self.condition:
+            if self.running < self.limit:
+                self.running   += 1
+                return True
+            if self.waiting >= self.queue:
+                return False
+            self.waiting       += 1
+            try:
+                deadline	= time.time() + self.timeout
+                while self.running >= self.limit:
+                    remaining	= deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.condition.wait( remaining )
+                self.running   += 1
+                return True
+            finally:
+                self.waiting   -= 1
+
+    def release( self ):
+        with self.condition:
+            self.running       -= 1
+            self.condition.notify()
+
+
+class single_flight( object ):
+    """Coalesce concurrent calls for the same key.  The first caller runs the
+    function; any others arriving before it finishes wait for, and share, its
+    result (or its exception).  Nothing is retained once the call completes;
+    caching the result is up to the function.
+    """
+    def __init__( self ):
+        self.lock		= threading.Lock()
+        self.flights		= {}	# { key: [ <Event>, result, exc_info ], ... }
+
+    def __call__( self, key, function, *args, **kwargs ):
+        with self.lock:
+            flight		= self.flights.get( key )
+            leader		= flight is None
+            if leader:
+                flight		= self.flights[key] = [ threading.Event(), None, None ]
+        if not leader:
+            flight[0].wait()
+            if flight[2]:
+                raise flight[2][0], flight[2][1], flight[2][2]
+            return flight[1]
+        try:
+            flight[1]		= function( *args, **kwargs )
+        except:
+            flight[2]		= sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight[0].set()
+        return flight[1]
+
+    def start( self, key, function, *args, **kwargs ):
+        """Call the function for key in a background thread, unless such a call
+        is already in flight.  Its result is discarded.
+        """
+        with self.lock:
+            if key in self.flights:
+                return
+        thread			= threading.Thread( target=self.background,
+                                                    args=( key, function ) + args, kwargs=kwargs )
+        thread.daemon		= True
+        thread.start()
+
+    def background( self, key, function, *args, **kwargs ):
+        try:
+            self( key, function, *args, **kwargs )
+        except Exception, e:
+            log.warning( "Background %r failed: %s", key, e )
 
 
 class task( object ):
@@ -180,14 +477,16 @@ class task( object ):
     From this we can collect a breakdown of effort estimates and
     actual clocked time, between all the different tasks states.
 
+    If a 'schema' (of the table's columns) is supplied, the times are held in
+    a <timevector> of that (shared) keyschema, instead of a <timedict>; all the
+    roll-up arithmetic then operates on whole rows at once.
     """
-    def __init__( self, state, description, times=None ):
+    def __init__( self, state, description, times=None, schema=None ):
         self.state		= state
         self.description	= description
-        self.data		= timedict(int)
+        self.data		= timedict(int) if schema is None else timevector( int, schema )
         if times:
-            for t in times:
-                self.data      += t
+            self.data.add_hms( list( times ))
         self.subtask		= []
 
 
@@ -244,38 +543,42 @@ class task( object ):
            o all subtasks contributions:
              <timedict>{"CLOCKSUM": 75600, "Effort": 79200}
         """
-        res			= {}
-
-        # Add all the subtask's times, into per-state buckets
+        # Add all the subtask's times, into per-state buckets; each is summed
+        # in one pass (see from_sum)
+        buckets			= {}
         for s in self.subtask:
             for state, times in s.totals()[0].iteritems():
-                if state not in res:
-                    res[state]	= timedict(int)
-                res[state]     += times
+                buckets.setdefault( state, [] ).append( times )
+        res			= {}
+        for state, times in buckets.iteritems():
+            res[state]		= from_sum( *times )
 
         # We now have the totals for all children.  If our own
         # data differs from the sum of all our subtasks, they
         # must be greater -- this means that this roll-up task has
         # also accrued additional individual effort and/or
         # clocksum.  Add that, too.
-        sub			= timedict(int)
-        for state, times in res.items():
-            sub                += times
-
-        our			= self.data - sub
-        if self.state not in res:
-            res[self.state]	= timedict(int)
-        res[self.state]        += our
+        if res:
+            sub			= from_sum( *res.values() )
+            our			= from_sum( self.data, sub, signs=(1, -1) )
+        else:
+            sub			= self.data.zero()
+            our			= from_sum( self.data )
+        if self.state in res:
+            res[self.state]    += our
+        else:
+            res[self.state]	= from_sum( our )
 
         return res, our, sub
 
 
-def parse_tasks( lines ):
+def parse_tasks( lines, begun=False ):
     """A generator that returns a sequence of (task, level).
 
     At level 0, scan lines of input from the 'lines iterator
-    'til we find the start of a table.  Then, deduces the column
-    names, and begins to scan tasks at level 1.
+    'til we find the start of a table (unless the #+BEGIN: line has already
+    begun).  Then, deduces the column names, and begins to scan tasks at level
+    1.  The lines after the table's #+END remain in the iterator.
 
     After parsing the next task, the level (number of leading *
     characters) is examined.  If it is greater than our level, the
@@ -283,17 +586,19 @@ def parse_tasks( lines ):
     is yielded and the parse ends.
     """
     # Scan and discard lines 'til we find the beginning of an org-table
-    found			= False
-    for line in lines:
+    found			= begun
+    for line in ( () if begun else lines ):
         if line.startswith("#+BEGIN:"):
             found		= True
             break
     if not found:
         raise Exception("No org-mode table found")
 
-    # Parse column names, discard separator |---|
+    # Parse column names, discard separator |---|.  Every task's times share
+    # the same schema of the table's (time) columns (unless disabled).
     line			= next( lines )
     cols			= list( c for c in map( string.strip, line.split( "|" )) if c )
+    schema			= keyschema.shared( cols[1:] ) if parse_tasks.vectors else None
     next( lines )
 
     # Parse records, yielding tasks, 'til end of org-table
@@ -328,15 +633,17 @@ def parse_tasks( lines ):
         assert cols[0] == "Task"
         descr			= vals[0]
 
-        yield task( state, descr, zip( cols[1:], vals[1:] )), len( stars )
+        yield task( state, descr, zip( cols[1:], vals[1:] ), schema=schema ), len( stars )
+
+parse_tasks.vectors		= True	# Use <timevector>s of a shared schema
 
 
-def parse_task_heirarchy( lines ):
+def parse_task_heirarchy( lines, begun=False ):
     """Produce a task heirarchy from a sequence of (task, level), correctly
     making sub-tasks a child of the correct parent task.  Return the root task.
     """
     stack		= []
-    for tsk, lvl in parse_tasks( lines ):
+    for tsk, lvl in parse_tasks( lines, begun=begun ):
         assert lvl > 0
         if lvl > len( stack ):
              #   | *  A  Stack Before: []
@@ -363,6 +670,231 @@ def parse_task_heirarchy( lines ):
     return stack[0]
 
 
+def project_name( project ):
+    """Split a project name into its org-mode file and table name:
+
+        "plans:alpha"	==> ( "plans", "alpha" )	-- table "alpha" in plans.org
+        "plans"		==> ( "plans", None )		-- the first table in plans.org
+    """
+    path, _, table		= project.partition( ":" )
+    return path, table or None
+
+
+def table_name( begin, heading ):
+    """The name of the org-mode table begun by a "#+BEGIN: columnview ..." line:
+    its :id (unless local, global or file:...); otherwise, that of the top-level
+    heading it is under, lower-cased, with each run of other than letters and
+    digits replaced by "-" (eg. "* Project Alpha  :work:" ==> "project-alpha").
+    None, if neither.
+    """
+    match			= re.search( r":id\s+(\S+)", begin )
+    if match and match.group( 1 ) not in ( "local", "global" ) \
+       and not match.group( 1 ).startswith( "file:" ):
+        return match.group( 1 )
+    if heading:
+        heading			= re.sub( r"\s+:[\w@#%:]+:\s*$", "", heading )
+        return re.sub( r"[^a-z0-9]+", "-", heading.lower() ).strip( "-" ) or None
+    return None
+
+
+def parse_tables( lines ):
+    """A generator that scans all the lines of an org-mode file once, yielding
+    ( name, <task> ) for the task heirarchy of each table in it (see table_name);
+    or ( name, <Exception> ), for any that can't be parsed.
+    """
+    heading			= None
+    for line in lines:
+        if line.startswith( "* " ):
+            heading		= line[2:]
+        elif line.startswith( "#+BEGIN:" ):
+            name		= table_name( line, heading )
+            try:
+                yield name, parse_task_heirarchy( lines, begun=True )
+            except Exception, e:
+                yield name, e
+
+
+def project_data_tables( blob ):
+    """Read and parse a blob (once), returning the task data of each table in
+    it: { <name>: { "task": <task>, "date": ..., "date#": ..., "sprint": ... }
+    or None (no data found), ... }.  The first table is also named None.  If
+    two tables have the same name, the first is used.
+    """
+    tables			= {}
+    try:
+        log.debug( "Parsing blob %s: %s", blob.hexsha, blob.name )
+        with staged( "read" ):
+            with project_data.lock:
+                text		= blob.data_stream.read()
+        metric_blob_bytes.inc( len( text ))
+        with staged( "parse" ):
+            lines		= text.splitlines()
+            found		= list( parse_tables( iter( lines )))
+        if not found:
+            raise Exception( "No org-mode table found" )
+        metric_blobs.inc()
+        metric_rows.inc( sum( 1 for line in lines if line.lstrip().startswith( "|" )))
+    except Exception, e:
+        log.info( "No Task Data in blob %s: %s", blob.hexsha, e )
+        return { None: None }
+
+    for i, ( name, root ) in enumerate( found ):
+        if name in tables:
+            continue
+        try:
+            if isinstance( root, Exception ):
+                raise root
+            ahead		= {}
+            ahead["task"]	= root
+            if log.isEnabledFor( logging.DEBUG ):
+                log.debug( "%s", ahead["task"].display() )
+            # ... <2012-03-02 Fri> ...
+            #      ^^^^^^^^^^
+            match		= re.search( r"<([0-9-]*)[^>]*>",
+                                     ahead["task"].description )
+            if match is None:
+                raise Exception( "No date found in task: %s" % (
+                    ahead["task"].description ))
+            ahead["date"]	= match.group( 1 )
+            ahead["date#"]	= time.mktime( time.strptime( ahead["date"],
+                                                      "%Y-%m-%d" ))
+            # ...Sprint 3...
+            #           ^
+            match		= re.search( r"[Ss]print\s+([0-9]+)",
+                                     ahead["task"].description )
+            sprint		= 0
+            if match is not None:
+                sprint		= int( match.group( 1 ))
+            ahead["sprint"]	= sprint
+        except Exception, e:
+            log.info( "No Task Data in blob %s table %s: %s", blob.hexsha, name, e )
+            ahead		= None
+        tables[name]		= ahead
+        if i == 0 and None not in tables:
+            tables[None]	= ahead
+    return tables
+
+
+def project_record( hexsha, stats, prior ):
+    """Return the summary record for the JSON result data list, of a blob's task
+    stats (see project_data_tables), given the prior record's stats (or None).
+    The stats' sums and differences are computed (and cached in stats) first,
+    if necessary.
+    """
+    # We have a valid task!  Create the summary rec for the JSON
+    # result data list.
+    rec				= {}
+    rec["blob"]			= hexsha
+    rec["date"]			= stats["date"]
+    rec["date#"]		= stats["date#"]
+    rec["sprint"]		= stats["sprint"]
+
+    dicts			= [		# (first contains *all* columns!)
+        "total", "project",			# Overall sums
+        "todo", "todoTotal",
+        "done", "doneTotal",			# Done since last, and sum total
+        "removed", "removedTotal",		# Existing tasks cancelled
+        "added", "addedTotal",			# New tasks added/uncancelled
+        "delta", "deltaTotal",			# net change and total change
+    ]
+    if dicts[0] not in stats:
+        # We haven't yet computed the cached stats for this blob.
+        #
+        # total     -- all tasks.
+        # todo		-- all incomplete tasks.  Tasks left to do.
+        # done		-- all complete tasks.  Tasks finished.
+        # project   -- all non-cancelled tasks.  Delivered
+        # added		-- New Tasks added to project this period. (delta total)
+        # removed   -- Tasks removed from project this period. (delta canc)
+        # growth	-- Net Project added - removed this period.
+        #
+        started			= time.time()
+        zero			= stats["task"].data.zero
+        stats["todoTotal"]    = zero()
+        stats["doneTotal"]    = zero()
+        stats["removedTotal"] = zero()
+
+        tot, our, sub		= stats["task"].totals()
+
+        for k,v in tot.iteritems():
+            if k in ("DONE"):
+                stats["doneTotal"] += v
+            elif k in ("CANC"):
+                # Items removed from project.  Both Effort estimate
+                # (and clocked time) no longer appear in the 'total'
+                # project data, so are effectively subtracted from any
+                # others "added".
+                stats["removedTotal"] += v
+            else: # ("TODO", "NEXT", "HOLD", "WAIT", "PHON", ...)
+                stats["todoTotal"] += v
+
+        # Each sum or difference is computed in one pass (see from_sum),
+        # without any intermediate <timedict>s.
+        stats["project"]	= from_sum( stats["todoTotal"], stats["doneTotal"] )
+        stats["total"]		= from_sum( stats["project"], stats["removedTotal"] )
+        if prior:
+            less		= (1, -1)
+            stats["todo"]	= from_sum( stats["todoTotal"], prior["todoTotal"], signs=less )
+            stats["done"]	= from_sum( stats["doneTotal"], prior["doneTotal"], signs=less )
+            # Added is the sum of: a) the the absolute increase in
+            # the total project size (including all tasks, even
+            # cancelled),
+            stats["added"]	= from_sum( stats["total"], prior["total"], signs=less )
+            # PLUS b) any existing tasks changed from cancelled to
+            # something else; if "removed" goes -'ve, this really
+            # means "added"; never let "removed" go -'ve.
+            stats["removed"]= from_sum( stats["removedTotal"], prior["removedTotal"],
+                                        signs=less )
+            for k, v in list( stats["removed"].items() ):
+                if v < 0:
+                    stats["added"]   += (k, -v)
+                    stats["removed"] += (k, -v)
+            stats["addedTotal"] = from_sum( stats["added"], prior["addedTotal"] )
+            stats["delta"]      = from_sum( stats["added"], stats["removed"], signs=less )
+            stats["deltaTotal"] = from_sum( stats["delta"], prior["deltaTotal"] )
+
+        # If there were no results for a stat (eg. no tasks in the
+        # given state), ensure that the resultant timedict at
+        # least have zero entries for all known columns.  Assumes
+        # total (first item in 'dicts'') will have all columns...
+        for d in dicts:
+            for k in stats[dicts[0]].keys():
+                if d not in stats:
+                    stats[d]  = zero()
+                if k not in stats[d]:
+                    stats[d] += (k, 0)
+        stage_observe( "stats", time.time() - started )
+
+        if log.isEnabledFor( logging.DEBUG ):
+            for d in dicts:
+                log.debug( "%s", task( state="",
+                                       description=d,
+                                       times=stats[d].items() ).format( level=0 ))
+
+
+    # Turn all the stats <timedict> back into textual time specs,
+    # using their custom __reversed__ method.
+    texts			= {}
+    for d in dicts:
+        texts[d]		= dict( reversed( stats[d] ))
+
+    # The "estimated" (the unfortunately named Effort) column
+    # deals in the total number of story points (estimated in
+    # hours, roughly) for all tasks.  Map some known columns to
+    # more correct names.
+    mapping			= {
+        "Effort":   "estimated",
+        "CLOCKSUM":	"work",
+    }
+    for i in stats[dicts[0]].keys():
+        n                   = mapping.get( i, i )
+        rec[n]			= {}
+        for d in dicts:
+            rec[n][d]		= texts[d][i]
+            rec[n][d+"#"]	= stats[d][i]
+    return rec
+
+
 def project_data_parse( data, project ):
     """Return the parsed org-mode project statistics data for one
     project, from the supplied data.
@@ -391,8 +923,9 @@ def project_data_parse( data, project ):
     same blog may appear in many consecutive commits...
 
     """
-    # cache[blob.hexsha] == {"todo": {}, ...} or None.
+    # cache[blob.hexsha, table] == {"todo": {}, ...} or None.
     cache			= project_data_parse.cache
+    table			= project_name( project )[1]
 
     results			= {}
 
@@ -405,55 +938,35 @@ def project_data_parse( data, project ):
     rec, old			= None, None
     stats, prior, ahead		= None, None, None
     for blob in data[project]:
-        # Now: rec, stats contains last cycle's computed data
-        if blob.hexsha in cache:
-            ahead		= cache[blob.hexsha] # May be None (no data found)
+        # Now: rec, stats contains last cycle's computed data.  Parsing a blob
+        # caches every one of its tables, for any other project in the file.
+        if ( blob.hexsha, table ) in cache and not uncached():
+            cache_lookup( "blobs", True )
+            ahead		= cache[blob.hexsha, table] # May be None (no data found)
         else:
-            try:
-                print "Parsing blob %s: %s" % ( blob.hexsha, blob.name )
-                ahead           = {}
-                ahead["task"]	= parse_task_heirarchy(
-                    iter( blob.data_stream.read().splitlines() ))
-                print ahead["task"].display()
-                # ... <2012-03-02 Fri> ...
-                #      ^^^^^^^^^^
-                match		= re.search( r"<([0-9-]*)[^>]*>",
-                                             ahead["task"].description )
-                if match is None:
-                    raise Exception( "No date found in task: %s" % (
-                        ahead["task"].description ))
-                ahead["date"]	= match.group( 1 )
-                ahead["date#"]	= time.mktime( time.strptime( ahead["date"],
-                                                              "%Y-%m-%d" ))
-                # ...Sprint 3...
-                #           ^
-                match		= re.search( r"[Ss]print\s+([0-9]+)",
-                                             ahead["task"].description )
-                sprint		= 0
-                if match is not None:
-                    sprint	= int( match.group( 1 ))
-                ahead["sprint"]	= sprint
-            except Exception, e:
-                print "No Task Data: %s" % ( e )
-                ahead           = None
-            cache[blob.hexsha]	= ahead
+            cache_lookup( "blobs", False )
+            tables		= project_data_tables( blob )
+            for name, parsed in tables.items():
+                cache[blob.hexsha, name] = parsed
+            ahead		= tables.get( table )
+            cache[blob.hexsha, table] = ahead
 
         # Now: rec, stats still contains last cycle's computed data;
         # ahead contains this blob's task's data.
 
         # This blob may need to be ignored for various reasons.
         if ahead is None:
-            print "Commit contains blob with no tasks data; skipping"
+            log.debug( "Commit contains blob with no tasks data; skipping" )
             continue
         if rec and blob.hexsha == rec["blob"]:
-            print "Commit contains same blob as last; skipping"
+            log.debug( "Commit contains same blob as last; skipping" )
             continue
         if stats and ahead["date"] == stats["date"]:
             # This record contains the same date as the last; must be a later
             # commit on the same day. 0 Use its data instead; throw away the
             # last record computed, and ensure we retain the same old, prior for
             # this round...
-            print "Commit contains same date; re-doing %r" % ahead["date"]
+            log.debug( "Commit contains same date; re-doing %r", ahead["date"] )
             results["list"]	= results["list"][:-1]
             rec, stats		= old, prior
 
@@ -463,118 +976,80 @@ def project_data_parse( data, project ):
         old, prior		= rec, stats
         stats			= ahead
 
-        # We have a valid task!  Create the summary rec for the JSON
-        # result data list.
-        rec			= {}
-        rec["blob"]		= blob.hexsha
-        rec["date"]		= stats["date"]
-        rec["date#"]		= stats["date#"]
-        rec["sprint"]		= stats["sprint"]
-
-        dicts			= [		# (first contains *all* columns!)
-            "total", "project",			# Overall sums
-            "todo", "todoTotal",
-            "done", "doneTotal",		# Done since last, and sum total
-            "removed", "removedTotal",		# Existing tasks cancelled
-            "added", "addedTotal",		# New tasks added/uncancelled
-            "delta", "deltaTotal",		# net change and total change
-        ]
-        if dicts[0] not in stats:
-            # We haven't yet computed the cached stats for this blob.
-            #
-            # total     -- all tasks.
-            # todo	-- all incomplete tasks.  Tasks left to do.
-            # done	-- all complete tasks.  Tasks finished.
-            # project   -- all non-cancelled tasks.  Delivered
-            # added	-- New Tasks added to project this period. (delta total)
-            # removed   -- Tasks removed from project this period. (delta canc)
-            # growth	-- Net Project added - removed this period.
-            #
-            stats["todoTotal"]    = timedict(int)
-            stats["doneTotal"]    = timedict(int)
-            stats["removedTotal"] = timedict(int)
-
-            tot, our, sub	= stats["task"].totals()
-
-            for k,v in tot.iteritems():
-                if k in ("DONE"):
-                    stats["doneTotal"] += v
-                elif k in ("CANC"):
-                    # Items removed from project.  Both Effort estimate
-                    # (and clocked time) no longer appear in the 'total'
-                    # project data, so are effectively subtracted from any
-                    # others "added".
-                    stats["removedTotal"] += v
-                else: # ("TODO", "NEXT", "HOLD", "WAIT", "PHON", ...)
-                    stats["todoTotal"] += v
-
-            stats["project"]	= stats["todoTotal"] + stats["doneTotal"]
-            stats["total"]	= stats["project"] + stats["removedTotal"]
-            if prior:
-                stats["todo"]	= stats["todoTotal"]    - prior["todoTotal"]
-                stats["done"]	= stats["doneTotal"]    - prior["doneTotal"]
-                # Added is the sum of: a) the the absolute increase in
-                # the total project size (including all tasks, even
-                # cancelled),
-                stats["added"]		= stats["total"]        - prior["total"]
-                # PLUS b) any existing tasks changed from cancelled to
-                # something else; if "removed" goes -'ve, this really
-                # means "added"; never let "removed" go -'ve.
-                stats["removed"]= stats["removedTotal"] - prior["removedTotal"]
-                for k, v in list( stats["removed"].items() ):
-                    if v < 0:
-                        stats["added"]   += (k, -v)
-                        stats["removed"] += (k, -v)
-                stats["addedTotal"] = stats["added"]	+ prior["addedTotal"]
-                stats["delta"]      = stats["added"]	- stats["removed"]
-                stats["deltaTotal"] = stats["delta"]	+ prior["deltaTotal"]
-
-            # If there were no results for a stat (eg. no tasks in the
-            # given state), ensure that the resultant timedict at
-            # least have zero entries for all known columns.  Assumes
-            # total (first item in 'dicts'') will have all columns...
-            for d in dicts:
-                for k in stats[dicts[0]].keys():
-                    if d not in stats:
-                        stats[d]  = timedict(int)
-                    if k not in stats[d]:
-                        stats[d] += (k, 0)
-
-            for d in dicts:
-                print task( state="",
-                            description=d,
-                            times=stats[d].items() ).format( level=0 )
-
-
-        # Turn all the stats <timedict> back into textual time specs,
-        # using their custom __reversed__ method.
-        texts			= {}
-        for d in dicts:
-            texts[d]		= dict( reversed( stats[d] ))
-
-        # The "estimated" (the unfortunately named Effort) column
-        # deals in the total number of story points (estimated in
-        # hours, roughly) for all tasks.  Map some known columns to
-        # more correct names.
-        mapping			= {
-            "Effort":   "estimated",
-            "CLOCKSUM":	"work",
-        }
-        for i in stats[dicts[0]].keys():
-            n                   = mapping.get( i, i )
-            rec[n]		= {}
-            for d in dicts:
-                rec[n][d]	= texts[d][i]
-                rec[n][d+"#"]	= stats[d][i]
-
+        rec			= project_record( blob.hexsha, stats, prior )
         results["list"].append( rec )
-        print "Adding record %3d for %r" % ( len( results["list"] ),  rec["date"] )
+        log.debug( "Adding record %3d for %r", len( results["list"] ), rec["date"] )
 
     return results
 
 project_data_parse.cache	= {}
 
 
+class working_blob( object ):
+    """A <project>.org file's contents in the Git working tree, standing in for
+    a git.Blob; its hexsha is the one Git would give it, once committed."""
+    def __init__( self, path, text ):
+        self.path		= path
+        self.name		= os.path.basename( path )
+        self.text		= text
+        self.hexsha		= hashlib.sha1( "blob %d\0" % len( text ) + text ).hexdigest()
+
+    @property
+    def data_stream( self ):
+        return StringIO( self.text )
+
+
+def project_data_working( repository, project, stats ):
+    """Return ( key, stats ), where the stats (parsed from the committed history;
+    see project_data_parse) have a provisional last record appended, from the
+    project's <project>.org file in the repository's working tree.  The key (the
+    file's ( mtime, size )) identifies this version of the working file; None if
+    there is none.  The stats are returned unchanged if the working file has no
+    data for the project, or is as committed.
+
+    The working file is reread and reparsed only when its mtime or size change;
+    the committed records are shared, not recomputed.  As for any later commit
+    on the same day, a working record with the same date as the last committed
+    record replaces it.  The stats' "working" is the provisional record's blob.
+    """
+    key				= working_key( repository, project )
+    if key is None:
+        return None, stats
+    path			= os.path.join( repository, project_name( project )[0] + ".org" )
+    found			= project_data_working.cache.get( path )
+    cache_lookup( "working", found is not None and found[0] == key )
+    if found is None or found[0] != key:
+        with open( path, 'r' ) as f:
+            blob		= working_blob( path, f.read() )
+        found			= ( key, blob.hexsha, project_data_tables( blob ))
+        project_data_working.cache[path] = found
+    key, hexsha, tables		= found
+
+    table			= project_name( project )[1]
+    ahead			= tables.get( table )
+    records			= stats["list"]
+    if ahead is None or records and records[-1]["blob"] == hexsha:
+        return key, stats
+    prior			= None
+    if records and records[-1]["date"] == ahead["date"]:
+        records			= records[:-1]
+    if records:
+        prior			= project_data_parse.cache.get( ( records[-1]["blob"], table ))
+        if prior is None:
+            log.info( "No stats for %s blob %s; working copy ignored", project,
+                      records[-1]["blob"] )
+            return key, stats
+    # The parsed data is retained for the next request; compute the working
+    # record's stats into a copy, since its prior changes with each commit.
+    rec				= project_record( hexsha, dict( ahead ), prior )
+    stats			= copy.copy( stats )	# Shallow copy
+    stats["list"]		= records + [ rec ]
+    stats["working"]		= hexsha
+    return key, stats
+
+project_data_working.cache	= {}	# { path: ( ( mtime, size ), hexsha, tables ) }
+
+
 def best_fit( points ):
     """
     Computes a best-fit line for the given [(x,y), ...] data.  Returns
@@ -654,13 +1129,14 @@ def project_stats_transform( results, style, bestfit=True ):
             # (keeping xxxxTotal data, but zeroing out the xxxxx change data)
             rec			= copy.deepcopy( rec )
             recymd		= date_components( rec["date"] )
-            print "Process %s" %( repr( recymd ))
+            log.debug( "Process %r", recymd )
             while filled: # (Skip for very first record, otherwise loop forever)
                 old		= filled[-1]
                 oldymd		= date_components( old["date"] )
                 if oldymd >= recymd:
-                    print "old: %s" % json.dumps( old, indent=4 )
-                    print "rec: %s" % json.dumps( rec, indent=4 )
+                    if log.isEnabledFor( logging.DEBUG ):
+                        log.debug( "old: %s", json.dumps( old, indent=4 ))
+                        log.debug( "rec: %s", json.dumps( rec, indent=4 ))
                     raise Exception( "Out of order records! %r (%s) >= %r (%s)" %(
                         oldymd, old["date"], recymd, rec["date"] ))
                 nxtdtm		= datetime.datetime( *oldymd ) + datetime.timedelta( 1 )
@@ -678,16 +1154,16 @@ def project_stats_transform( results, style, bestfit=True ):
                             nxt[d][k]		= "0:00"
                             nxt[d][k+"#"]	= 0
 
-                print "Filling %s" % ( repr( nxtymd ))
+                log.debug( "Filling %r", nxtymd )
                 nxt["label"]	= "Day %d" % ( len( filled ) + 1 )
-                print "  Emitting %s" % ( nxt["label"] )
-                #print "  Emitting %s: %s" % (
+                log.debug( "  Emitting %s", nxt["label"] )
+                #log.debug( "  Emitting %s: %s",
                 #    nxt["label"], json.dumps( nxt, sort_keys=True, indent=4 ))
                 filled.append( nxt )
-            print "Copying %s" % ( repr( recymd ))
+            log.debug( "Copying %r", recymd )
             rec["label"]	= "Day %d" % ( len( filled ) + 1 )
-            print "  Emitting %s" % ( rec["label"] )
-            #print "  Emitting %s: %s" % (
+            log.debug( "  Emitting %s", rec["label"] )
+            #log.debug( "  Emitting %s: %s",
             #    rec["label"], json.dumps( rec, sort_keys=True, indent=4 ))
             filled.append( rec )
     elif style == "effort":
@@ -704,6 +1180,7 @@ def project_stats_transform( results, style, bestfit=True ):
         changekeys		= [ "added", "delta", "done", "removed", "todo" ]
         masterkeys		= [ "work", "estimated" ]
         add			= None
+        debug			= log.isEnabledFor( logging.DEBUG )
         for rec in results["list"]:
             # The 'rec["total"]["CLOCKSUM"]' value defines how much work has
             # been clocked, so far.  This includes all tasks, whether still in
@@ -713,8 +1190,7 @@ def project_stats_transform( results, style, bestfit=True ):
             # including tasks we later decide to remove from the project's
             # scope.
             recymd		= date_components( rec["date"] )
-            print "Process %s: %5d hours effort" %( repr( recymd ),
-                                                    rec["work"]["total#"]/60/60 )
+            log.debug( "Process %r: %5d hours effort", recymd, rec["work"]["total#"]/60/60 )
             if add is None:
                 add		= dict( ( d, timedict(int) ) for d in masterkeys )
             nxt			= copy.deepcopy( rec )
@@ -735,13 +1211,14 @@ def project_stats_transform( results, style, bestfit=True ):
                             continue
                         for fn in add[d].keys():
                             assert fn.endswith("#")
-                            print "    Adding: %-10s %-10s of %s" % (
-                                d, fn, repr( dict( reversed( add[d] ))))
+                            if debug:
+                                log.debug( "    Adding: %-10s %-10s of %r",
+                                           d, fn, dict( reversed( add[d] )))
                             add[d]     += ( fn, nxt[d][fn] )
                         for fn, v in reversed( add[d] ):
                             f		= fn[:-1]
-                            print "    Update: %-10s %-10s of %7d (%5s) to %7d (%5s)" % (
-                                d, f, nxt[d][fn], nxt[d][f], add[d][fn], v )
+                            log.debug( "    Update: %-10s %-10s of %7d (%5s) to %7d (%5s)",
+                                       d, f, nxt[d][fn], nxt[d][f], add[d][fn], v )
                             nxt[d][fn]	= add[d][fn]
                             nxt[d][f]	= v
 
@@ -753,8 +1230,8 @@ def project_stats_transform( results, style, bestfit=True ):
                     # records.)  Zero out the xxxx change data, but retain the
                     # xxxxTotal data, in case we need to emit copies of this
                     # record.
-                    print "  Emitting %s" % ( nxt["label"] )
-                    #print "  Emitting %s: %s" % (
+                    log.debug( "  Emitting %s", nxt["label"] )
+                    #log.debug( "  Emitting %s: %s",
                     #    nxt["label"], json.dumps( nxt, sort_keys=True, indent=4 ))
                     filled.append( nxt )
                     nxt		= copy.deepcopy( nxt )
@@ -774,8 +1251,9 @@ def project_stats_transform( results, style, bestfit=True ):
                     fn		= f+"#"
                     if rec[d][fn] != 0:
                         add[d] += ( fn, rec[d][fn] )
-                        print "    Saving: %-10s %-10s of %7ds; now %s" % (
-                            d, f, rec[d][fn], repr( dict( reversed( add[d] ))))
+                        if debug:
+                            log.debug( "    Saving: %-10s %-10s of %7ds; now %r",
+                                       d, f, rec[d][fn], dict( reversed( add[d] )))
 
     else:
         raise Exception( "Unkown style: %s" % ( style ))
@@ -812,25 +1290,25 @@ def project_stats_transform( results, style, bestfit=True ):
         rec			= results["list"][i]
         rec["lines"]		= None
 
-        print "Record %d, %-10s" % ( i, rec["label"] )
+        log.debug( "Record %d, %-10s", i, rec["label"] )
 
         # If the delta (change) in the project is greater than a certain
         # percentage of the project size, then we'll  assume a "discontinous"
         # change to the project, and compute fresh slopes.
         estdlta			= rec["estimated"]["delta#"]
         estproj			= rec["estimated"]["project#"]
-        print "  Change:   %4d%%: project is %7d, change is %7d" % (
-            estdlta * 100 / estproj, estproj, estdlta )
+        log.debug( "  Change:   %4d%%: project is %7d, change is %7d",
+                   estdlta * 100 / estproj, estproj, estdlta )
         if ( abs( estdlta ) > estproj * change_max / 100 ):
-            print "    Discontinuity; %3d%% change" % ( abs( estdlta ) * 100 / estproj )
+            log.debug( "    Discontinuity; %3d%% change", abs( estdlta ) * 100 / estproj )
             prgrdata		= []
             chngdata		= []
             datedata		= []
 
         esttodoT		= rec["estimated"]["todoTotal#"]
         estdltaT		= rec["estimated"]["deltaTotal#"]
-        print "  Progress: %7d (%7d todo - %7d Change)" % (
-            esttodoT - estdltaT, esttodoT, estdltaT )
+        log.debug( "  Progress: %7d (%7d todo - %7d Change)",
+                   esttodoT - estdltaT, esttodoT, estdltaT )
         prgrdata.append( (i,  esttodoT - estdltaT) )
         chngdata.append( (i, -estdltaT) )
         datedata.append( (i,  rec["date#"]) )
@@ -910,7 +1388,7 @@ def project_stats_transform( results, style, bestfit=True ):
         #
         if cslope - pslope > 0:
             fx			= ( pC - cC ) / ( cslope - pslope )
-            print "Slopes will intercept in future at x == %f" % ( fx )
+            log.debug( "Slopes will intercept in future at x == %f", fx )
 
             # Compute the number of columns required to contain the point
             # where the progress and change lines meet.  However, clamp at a
@@ -929,10 +1407,9 @@ def project_stats_transform( results, style, bestfit=True ):
                 d		= datetime.date.fromtimestamp( ftimestamp )
                 fdate		= "%4d-%02d-%02d (Day %d)" % (
                     d.year, d.month, d.day, fxint+1  )
-                print "  Finish date at projected intercept: %s" % ( fdate )
+                log.debug( "  Finish date at projected intercept: %s", fdate )
             except:
-                print "  Finish date incomputable"
-                pass
+                log.debug( "  Finish date incomputable" )
             rec["finish"]	= fdate
 
 
@@ -943,22 +1420,21 @@ def project_stats_transform( results, style, bestfit=True ):
             lines["date"]       = {"x1":dx0,    "y1":dy0,
                                    "x2":fxnext, "y2":int( dslope * fxnext + dC )}
         else:
-            print "Slopes will intercept in past"
-
-        print "Record %d: progress: %-32s, %f slope (%s)" % (
-            i, repr( lines["progress"] ), pslope, "best-fit" if bestfit else "linear")
-        print "Record %d: change:   %-32s, %f slope" % (
-            i, repr( lines["change"] ),   cslope )
+            log.debug( "Slopes will intercept in past" )
 
-        print "Record %d: date:     %-32s, %f slope" % (
-            i, repr( lines["date"] ),     dslope )
+        log.debug( "Record %d: progress: %-32r, %f slope (%s)",
+                   i, lines["progress"], pslope, "best-fit" if bestfit else "linear" )
+        log.debug( "Record %d: change:   %-32r, %f slope",
+                   i, lines["change"],   cslope )
+        log.debug( "Record %d: date:     %-32r, %f slope",
+                   i, lines["date"],     dslope )
 
     # We've computed a finish-x.  Fill in the results["list"] with empty
     # records.  Since we've computed an intersection, compute the approximate
     # projected date for each (may be impossible; if so, None)
     if fxmax is not None:
-        print "Need %d total records; adding %d" % (
-            fxmax + 1, fxmax - len( results["list"] ) + 1 )
+        log.debug( "Need %d total records; adding %d",
+                   fxmax + 1, fxmax - len( results["list"] ) + 1 )
     while fxmax and fxmax >= len( results["list"] ):
         rec			= copy.deepcopy( results["list"][-1] )
         rec["date#"]		= dslope * len( results["list"] ) + dC
@@ -973,7 +1449,124 @@ def project_stats_transform( results, style, bestfit=True ):
         rec["estimated"]        = None
         rec["work"]             = None
 
-        print "Extend  %s" % ( rec["date"] )
+        log.debug( "Extend  %s", rec["date"] )
+        results["list"].append( rec )
+
+    return results
+
+
+def project_stats_offset( results, since ):
+    """Return the index of the first record of the (transformed) project results
+    matching 'since' (a blob hexsha, or a "YYYY-MM-DD" date), or None.
+    """
+    for i, rec in enumerate( results["list"] ):
+        blob			= rec.get( "blob" )
+        if ( blob and len( since ) >= 7 and blob.startswith( since )
+             or rec.get( "estimated" ) and rec.get( "date" ) == since ):
+            return i
+    return None
+
+
+def project_stats_since( results, offset ):
+    """Return only the tail of the (transformed) project results, starting at
+    the given offset: that of the first record matching the client's 'since'
+    (see project_stats_offset).  This is all a client holding the results up
+    to 'since' requires to bring itself up to date:
+
+        results["offset"]	-- index of the first record returned
+        results["since"]	-- the matching record's blob hexsha (or date)
+
+    The client replaces its records from "offset" on with the returned
+    "list".  The matching record(s) are themselves returned, because a later
+    commit on the same day replaces that day's record; all later records
+    (including the projected tail) follow.  If nothing matched (offset is
+    None), all the records are returned, with an "offset" of 0 (and a "since"
+    of None).  Each record's "lines" depend only on the records preceding it,
+    so no earlier record changes.
+    """
+    since			= None
+    if offset is not None:
+        rec			= results["list"][offset]
+        since			= rec.get( "blob" ) or rec.get( "date" )
+    results			= copy.copy( results )	# Shallow copy
+    results["list"]		= results["list"][offset or 0:]
+    results["offset"]		= offset or 0
+    results["since"]		= since
+    return results
+
+
+def project_stats_asof( results, asof ):
+    """Return how many of the (oldest) records of the project's parsed stats (see
+    project_data_parse) existed as of 'asof': a "YYYY-MM-DD" date, or a blob
+    hexsha (or unambiguous prefix, of at least 7 digits).  Returns None if
+    nothing matches.  The results computed from just that prefix of the
+    records are those a client would have seen at the time.
+    """
+    if re.match( r"^[0-9]{4}-[0-9]{2}-[0-9]{2}$", asof ):
+        count			= 0
+        for i, rec in enumerate( results["list"] ):
+            if rec["date"] <= asof:
+                count		= i + 1
+        return count or None
+    if len( asof ) >= 7:
+        for i, rec in enumerate( results["list"] ):
+            if rec["blob"].startswith( asof ):
+                return i + 1
+    return None
+
+
+def portfolio_stats( projects ):
+    """Combine several projects' parsed stats (see project_data_parse) into one
+    "portfolio" of the same form, suitable for project_stats_transform.  The
+    projects' records are aligned by date: there is a portfolio record for each
+    date on which any project has one, summing each project's xxxxTotal (and
+    total, project) data as of that date, and its xxxx (change) data on that
+    date.  Projects not yet begun contribute nothing.
+    """
+    changes			= ( "todo", "done", "removed", "added", "delta" )
+    results			= {}
+    results["project"]		= "portfolio"
+    results["projects"]		= [ stats["project"] for stats in projects ]
+    results["list"]		= []
+
+    dates			= {}	# { "YYYY-MM-DD": date#, ... }
+    for stats in projects:
+        for rec in stats["list"]:
+            dates.setdefault( rec["date"], rec["date#"] )
+    latest			= [ None ] * len( projects )
+    ahead			= [ 0 ] * len( projects )
+    for date in sorted( dates ):
+        sums			= {}	# { "estimated": <timedict>, ... }
+        sprint			= 0
+        for i, stats in enumerate( projects ):
+            current		= None
+            while ahead[i] < len( stats["list"] ) and stats["list"][ahead[i]]["date"] <= date:
+                current		= latest[i] = stats["list"][ahead[i]]
+                ahead[i]       += 1
+            if latest[i] is None:
+                continue
+            sprint		= max( sprint, latest[i]["sprint"] )
+            for n, values in latest[i].items():
+                if not isinstance( values, dict ):
+                    continue
+                total		= sums.setdefault( n, timedict( int ))
+                for d, v in values.items():
+                    if not d.endswith( "#" ):
+                        continue
+                    if current is None and d[:-1] in changes:
+                        v	= 0	# No change from this project, today
+                    total      += ( d, v )
+
+        rec			= {}
+        rec["blob"]		= None
+        rec["date"]		= date
+        rec["date#"]		= dates[date]
+        rec["sprint"]		= sprint
+        for n, total in sums.items():
+            rec[n]		= {}
+            for d, t in reversed( total ):
+                rec[n][d[:-1]]	= t
+                rec[n][d]	= total[d]
         results["list"].append( rec )
 
     return results
@@ -1031,21 +1624,321 @@ def deduce_encoding( available, environ, accept=None ):
                 if a != t and t != '*':
                     match = False
             if match:
-                print "Found %16s == %-16s;q=%.1f %s %-16s;q=%.1f" % (
-                    avail, encoding, q,
-                    '> ' if q > quality else '<=',
-                    accept, quality )
+                log.debug( "Found %16s == %-16s;q=%.1f %s %-16s;q=%.1f",
+                           avail, encoding, q, '> ' if q > quality else '<=',
+                           accept, quality )
                 if q > quality:
                     quality	= q
                     accept	= avail
     return accept
 
 
-def http_exception( framework, status, message ):
+def deduce_compression( environ ):
+    """Deduce acceptable content compression from HTTP Accept-Encoding: header:
+
+        Accept-Encoding: gzip,deflate,sdch
+
+    Returns "gzip" or "deflate" (gzip preferred, at equal quality), or None if
+    the content should be sent uncompressed (identity).
+    """
+    HTTP_ACCEPT_ENCODING= environ.get( "HTTP_ACCEPT_ENCODING", "" ).lower() if environ else ""
+    encoding		= None
+    quality		= 0.0
+    for stanza in HTTP_ACCEPT_ENCODING.split( ',' ):
+        # gzip;q=0.9
+        terms		= [ t.strip() for t in stanza.split( ';' ) ]
+        q		= 1.0
+        for t in terms[1:]:
+            if t.startswith( "q=" ):
+                try:
+                    q	= float( t[2:] )
+                except ValueError:
+                    q	= 0.0
+        if terms[0] in ( "gzip", "x-gzip" ):
+            avail	= "gzip"
+        elif terms[0] == "deflate":
+            avail	= "deflate"
+        else:
+            continue
+        if q > quality or ( q == quality and q and avail == "gzip" ):
+            quality	= q
+            encoding	= avail
+    return encoding
+
+
+def compress( body, encoding ):
+    """Return the body compressed using the supplied encoding ("gzip",
+    "deflate" or None).  The gzip header mtime is fixed, so the same body
+    always produces the same bytes.
+    """
+    if encoding == "gzip":
+        buf			= StringIO()
+        f			= gzip.GzipFile( fileobj=buf, mode="wb", mtime=0 )
+        try:
+            f.write( body )
+        finally:
+            f.close()
+        return buf.getvalue()
+    if encoding == "deflate":
+        return zlib.compress( body )
+    return body
+
+
+def compressed( variants, environ, headers=None ):
+    """Select (computing and remembering it, if necessary) the compressed form
+    of a response acceptable to the client.  The 'variants' dict always
+    contains the uncompressed response at variants[None]; each compressed form
+    is stored alongside it, so that a cached response need only be compressed
+    once.  Appends appropriate response headers to 'headers', if supplied.
+    """
+    encoding		= deduce_compression( environ )
+    response		= variants.get( encoding )
+    if response is None:
+        with staged( "compress" ):
+            response	= variants[encoding] = compress( variants[None], encoding )
+    if headers is not None:
+        if encoding:
+            headers.append( ( "Content-Encoding", encoding ))
+        headers.append( ( "Vary", "Accept, Accept-Encoding" ))
+    return response
+
+
+def jsonp( variants, callback ):
+    """Return the response variants (see compressed) of a JSON response, wrapped
+    in a call to the JSONP callback function, if any.  The JSON is cached (and
+    admitted) once, for all callers; each request wraps its own copy.
+    """
+    if not callback:
+        return variants
+    return { None: "%s( %s )" % ( callback, variants[None] ) }
+
+
+def json_dumps( content, pretty=False ):
+    """Encode content as JSON; compact, unless 'pretty' output is requested."""
+    with staged( "serialize" ):
+        if pretty:
+            return json.dumps( content, sort_keys=True, indent=4 )
+        return json.dumps( content, sort_keys=True, separators=(',', ':') )
+
+
+def msgpack_dumps( content ):
+    """Encode content in MessagePack (http://msgpack.org) form.  Handles None,
+    bool, int/long, float, str/unicode (as UTF-8 "str"), bytearray (as "bin"),
+    lists/tuples and dicts; enough for our columnar project data.
+    """
+    out				= []
+    def pack( obj ):
+        if obj is None:
+            out.append( "\xc0" )
+        elif obj is True:
+            out.append( "\xc3" )
+        elif obj is False:
+            out.append( "\xc2" )
+        elif isinstance( obj, ( int, long )):
+            if 0 <= obj < 0x80:
+                out.append( struct.pack( ">B", obj ))
+            elif -0x20 <= obj < 0:
+                out.append( struct.pack( ">b", obj ))
+            elif 0 <= obj < 2**64:
+                out.append( struct.pack( ">BQ", 0xcf, obj ))
+            else:
+                out.append( struct.pack( ">Bq", 0xd3, obj ))
+        elif isinstance( obj, float ):
+            out.append( struct.pack( ">Bd", 0xcb, obj ))
+        elif isinstance( obj, basestring ):
+            if isinstance( obj, unicode ):
+                obj		= obj.encode( "utf-8" )
+            n			= len( obj )
+            if n < 32:
+                out.append( struct.pack( ">B", 0xa0 | n ))
+            elif n < 2**8:
+                out.append( struct.pack( ">BB", 0xd9, n ))
+            elif n < 2**16:
+                out.append( struct.pack( ">BH", 0xda, n ))
+            else:
+                out.append( struct.pack( ">BI", 0xdb, n ))
+            out.append( obj )
+        elif isinstance( obj, bytearray ):
+            n			= len( obj )
+            if n < 2**8:
+                out.append( struct.pack( ">BB", 0xc4, n ))
+            elif n < 2**16:
+                out.append( struct.pack( ">BH", 0xc5, n ))
+            else:
+                out.append( struct.pack( ">BI", 0xc6, n ))
+            out.append( str( obj ))
+        elif isinstance( obj, ( list, tuple )):
+            n			= len( obj )
+            if n < 16:
+                out.append( struct.pack( ">B", 0x90 | n ))
+            elif n < 2**16:
+                out.append( struct.pack( ">BH", 0xdc, n ))
+            else:
+                out.append( struct.pack( ">BI", 0xdd, n ))
+            for o in obj:
+                pack( o )
+        elif isinstance( obj, dict ):
+            n			= len( obj )
+            if n < 16:
+                out.append( struct.pack( ">B", 0x80 | n ))
+            elif n < 2**16:
+                out.append( struct.pack( ">BH", 0xde, n ))
+            else:
+                out.append( struct.pack( ">BI", 0xdf, n ))
+            for k in sorted( obj.keys() ):
+                pack( k )
+                pack( obj[k] )
+        else:
+            raise TypeError( "Cannot MessagePack %s" % ( type( obj ).__name__ ))
+    with staged( "serialize" ):
+        pack( content )
+        return "".join( out )
+
+
+def columnar( results ):
+    """Return the (transformed) project results, in columnar form.  Rather than
+    a list of records each containing an "estimated" and "work" dict of
+    metrics, each metric becomes one packed little-endian typed array, and each
+    per-record datum (label, date, ...) becomes one list:
+
+        {
+            "project":	"project",
+            "style":	"effort",
+            "count":	<n>,
+            "dtypes":	{ "date#": "<f8", "estimated.todoTotal#": "<i8", ... },
+            "columns":	{ "date#": <bin>, "estimated.todoTotal#": <bin>, ... },
+            "valid":	<bin>,		# "|u1"; 0 for projected (data-less) records
+            "label":	[ "Day 1", ... ],
+            "date":	[ "2012-03-02", ... ],
+            "blob":	[ "01ab...", None, ... ],
+            "sprint":	[ 0, ... ],
+            "lines":	[ None, { "progress": [x1,y1,x2,y2], ... }, ... ],
+            "finish":	[ None, "2012-04-01 (Day 23)", ... ],
+        }
+
+    Partial results (see project_stats_since) also carry their "offset" and
+    "since", historical results their "asof", and those with a provisional
+    working tree record its "working" blob (see project_data_working).  Only
+    the numeric ("...#") metrics are carried; the textual "H:MM" forms are
+    trivially derived by the consumer.
+    """
+    records			= results["list"]
+    count			= len( records )
+    masterkeys			= [ "estimated", "work" ]
+
+    # The first complete record defines the metric names available.
+    metrics			= {}
+    for rec in records:
+        for d in masterkeys:
+            if rec.get( d ):
+                metrics[d]	= sorted( k for k in rec[d].keys() if k.endswith( "#" ))
+        if metrics:
+            break
+
+    columns			= {}
+    dtypes			= {}
+    columns["date#"]		= bytearray( struct.pack(
+        "<%dd" % count, *[ float( rec.get( "date#" ) or 0 ) for rec in records ] ))
+    dtypes["date#"]		= "<f8"
+    for d, keys in metrics.items():
+        for k in keys:
+            name		= d + "." + k
+            columns[name]	= bytearray( struct.pack(
+                "<%dq" % count, *[ int( rec[d][k] ) if rec.get( d ) else 0
+                                   for rec in records ] ))
+            dtypes[name]	= "<i8"
+
+    def line( lines ):
+        if not lines:
+            return None
+        return dict( ( n, [ l["x1"], l["y1"], l["x2"], l["y2"] ] )
+                     for n, l in lines.items() )
+
+    content			= {
+        "project":	results.get( "project" ),
+        "style":	results.get( "style" ),
+        "count":	count,
+        "dtypes":	dtypes,
+        "columns":	columns,
+        "valid":	bytearray( struct.pack(
+            "<%dB" % count, *[ 1 if rec.get( "estimated" ) else 0 for rec in records ] )),
+        "label":	[ rec.get( "label" ) for rec in records ],
+        "date":		[ rec.get( "date" ) for rec in records ],
+        "blob":		[ rec.get( "blob" ) for rec in records ],
+        "sprint":	[ rec.get( "sprint", 0 ) for rec in records ],
+        "lines":	[ line( rec.get( "lines" )) for rec in records ],
+        "finish":	[ rec.get( "finish" ) for rec in records ],
+    }
+    for k in "offset", "since", "asof", "working": # Only for partial results
+        if k in results:
+            content[k]		= results[k]
+    return content
+
+
+def query_flag( queries, name ):
+    """True iff the named query option is present, and isn't "0" (or "false").
+    Thus, ?pretty, ?pretty=1 and ?pretty=yes are True, but ?pretty=0 isn't.
+    """
+    if not queries or name not in queries:
+        return False
+    return str( queries.get( name ) or "" ).lower() not in ( "0", "false", "no" )
+
+
+def entity_tag( *terms ):
+    """Return a strong HTTP ETag (a quoted string) uniquely identifying the
+    response determined by the supplied terms (eg. commit, project, style,
+    encoding and query options).
+    """
+    return '"%s"' % hashlib.sha1( "\0".join( repr( t ) for t in terms )).hexdigest()
+
+
+def not_modified( etag, environ ):
+    """Test the supplied ETag against any HTTP If-None-Match: header:
+
+        If-None-Match: "a7c1...", W/"9e3b..."
+
+    Returns True iff the client already has the current entity.
+    """
+    HTTP_IF_NONE_MATCH	= environ.get( "HTTP_IF_NONE_MATCH", "" ) if environ else ""
+    for tag in HTTP_IF_NONE_MATCH.split( ',' ):
+        tag		= tag.strip()
+        if tag.startswith( "W/" ):
+            tag		= tag[2:]
+        if tag and tag in ( etag, "*" ):
+            return True
+    return False
+
+
+class request_failed( Exception ):
+    """A failure to be reported with the given HTTP status.  Unlike the web
+    framework's own exceptions (which may affect the response of the thread
+    creating them), it may be shared between threads (eg. by single_flight);
+    each then raises its own http_exception.
+    """
+    def __init__( self, status, message, headers=None ):
+        Exception.__init__( self, "%d %s" % ( status, message ))
+        self.status		= status
+        self.message		= message
+        self.headers		= headers
+
+
+def http_exception( framework, status, message, headers=None ):
     """Return an exception appropriate for the given web framework,
-    encoding the HTTP status code and message provided.
+    encoding the HTTP status code and message provided.  Any supplied
+    (header, value) pairs are included in the response (eg. the ETag:
+    of a 304 Not Modified).
     """
     if framework and framework.__name__ == "web":
+        if status == 304:
+            return framework.HTTPError( "304 Not Modified", headers=dict( headers or [] ))
+
+        if status == 400:
+            return framework.HTTPError( "400 Bad Request", headers=dict( headers or [] ),
+                                        data=message )
+
+        if status == 403:
+            return framework.Forbidden()
+
         if status == 404:
             return framework.NotFound( message )
 
@@ -1056,28 +1949,275 @@ def http_exception( framework, status, message ):
                     framework.NotAcceptable.__init__(self)
             return NotAcceptable( message )
 
+        if status == 503:
+            return framework.HTTPError( "503 Service Unavailable",
+                                        headers=dict( headers or [] ), data=message )
+
     elif framework and framework.__name__ == "itty":
+        # itty's errors carry no headers; these do (see itty_error)
+        class RequestError( framework.RequestError ):
+            def __init__( self, message ):
+                framework.RequestError.__init__( self, message )
+                self.headers = list( headers or [] )
+
+        if status == 304:
+            class NotModified( RequestError ):
+                status  = 304
+            return NotModified( message )
+
+        if status == 400:
+            class BadRequest( RequestError ):
+                status  = 400
+            return BadRequest( message )
+
+        if status == 403:
+            return framework.Forbidden( message )
+
         if status == 404:
             return framework.NotFound( message )
 
         if status == 406:
-            class NotAcceptable( itty.RequestError ):
+            class NotAcceptable( RequestError ):
                 status  = 406
             return NotAcceptable( message )
 
+        if status == 503:
+            class ServiceUnavailable( RequestError ):
+                status  = 503
+            return ServiceUnavailable( message )
+
+    elif framework and framework.__name__ == "asynchttp":
+        return framework.HTTPError( status, message, headers=headers )
+
     return Exception( "%d %s" % ( status, message ))
 
 
+def itty_error( framework, request, exception ):
+    """Respond to one of http_exception's itty errors, including its headers (eg.
+    the ETag of a 304 Not Modified, or the Retry-After of a 503 Service
+    Unavailable), which itty's own error handlers would drop.
+    """
+    status			= getattr( exception, "status", 500 )
+    response			= framework.Response( "" if status == 304 else "%s\n" % exception,
+                                              headers=getattr( exception, "headers", None ) or [],
+                                              status=status, content_type="text/plain" )
+    return response.send( request._start_response )
+
+
+def exception_status( exc, framework=None ):
+    """Deduce the HTTP status code an exception will produce (default: 500)."""
+    status			= getattr( exc, "status", None )
+    if framework and hasattr( framework, "ctx" ):
+        status			= framework.ctx.get( "status" )	# web.py: eg. "404 Not Found"
+    for text in ( str( status ), str( exc )):
+        match			= re.match( r"^([1-5][0-9][0-9])\b", text )
+        if match:
+            return int( match.group( 1 ))
+    return 500
+
+
+def instrumented( endpoint ):
+    """Decorate a request handler, observing each request's latency and status
+    (see metric_requests).  If the handler's .timing attribute is set, each
+    successful response's 'headers' also get a Server-Timing: header (see
+    server_timing); otherwise, the phases aren't collected at all.  A request
+    made within another (eg. by profile_request) restores the outer request's
+    phases, when done.
+    """
+    def decorator( function ):
+        def request( *args, **kwds ):
+            started		= time.time()
+            status		= 200
+            outer		= getattr( timing, "phases", None )	# Eg. if profiled
+            if request.timing:
+                timing.phases	= {}
+            try:
+                result		= function( *args, **kwds )
+                if request.timing and kwds.get( "headers" ) is not None:
+                    kwds["headers"].append( ( "Server-Timing", server_timing(
+                        timing.phases, time.time() - started )))
+                return result
+            except Exception, e:
+                status		= exception_status( e, kwds.get( "framework" ))
+                raise
+            finally:
+                timing.phases	= outer
+                metric_requests.observe( time.time() - started,
+                                         endpoint=endpoint, status=status )
+        request.__name__	= function.__name__
+        request.__doc__		= function.__doc__
+        request.timing		= False
+        return request
+    return decorator
+
+
+# A request being profiled (see profile_request) computes everything afresh,
+# neither consulting nor filling the caches, so the profile shows the real work.
+profiling			= threading.local()	# .fresh: True while profiling
+
+
+def uncached():
+    return getattr( profiling, "fresh", False )
+
+
+def local_request( environ ):
+    """True iff the request was made directly (not via a proxy) from the server's
+    own host, or over its local control socket (see --control).
+    """
+    environ			= environ or {}
+    if environ.get( "orgserver.control" ):
+        return True
+    return ( environ.get( "REMOTE_ADDR", "" ) in ( "127.0.0.1", "::1", "::ffff:127.0.0.1" )
+             and not environ.get( "HTTP_X_FORWARDED_FOR" ))
+
+
+def profile_permitted( environ ):
+    """Profiling is for administrators: only local requests are permitted."""
+    return local_request( environ )
+
+
+def profile_request( function, *args, **kwds ):
+    """Run a request handler (sans its ?profile=cpu|mem query option) under
+    cProfile, or tracemalloc, and return ( "text/plain", summary ) naming the
+    top functions (by cumulative and own time) or allocation sites.  If
+    profile_request.enabled is a directory, the pstats (or tracemalloc
+    snapshot) are also saved there, for closer inspection.  Any failure of the
+    request itself is raised, as usual.
+
+    Refused with 403 Forbidden unless enabled (see --profile), and permitted
+    for the request (see profile_permitted).
+    """
+    queries			= dict( kwds.get( "queries" ) or {} )
+    kind			= queries.pop( "profile" )
+    environ			= dict( kwds.get( "environ" ) or {} )
+    framework			= kwds.get( "framework" )
+    if profile_request.enabled is None or not profile_permitted( environ ):
+        raise http_exception( framework, 403, "Profiling not permitted" )
+    if kind not in profile_request.kinds:
+        raise http_exception( framework, 400, "Unknown profile: %s (valid: %s)" % (
+            kind, ", ".join( profile_request.kinds )))
+
+    # The profiled request must do its work; it can't be Not Modified.  Its
+    # own response headers (ETag, ...) aren't ours.
+    environ.pop( "HTTP_IF_NONE_MATCH", None )
+    kwds.update( queries=queries, environ=environ, headers=[] )
+    saving			= None
+    if profile_request.enabled:
+        saving			= os.path.join( profile_request.enabled, "%s-%s-%d" % (
+            function.__name__, time.strftime( "%Y%m%d-%H%M%S" ), os.getpid() ))
+
+    profiling.fresh		= True
+    started			= time.time()
+    try:
+        if kind == "cpu":
+            result, lines	= profile_cpu( function, args, kwds, saving )
+        else:
+            result, lines	= profile_mem( function, args, kwds, saving )
+    finally:
+        profiling.fresh		= False
+    content, response		= result
+    summary			= [ "Profile (%s) of %s %s: %s, %d bytes, %.3fs" % (
+        kind, function.__name__, " ".join( str( a ) for a in args ),
+        content, len( response ), time.time() - started ) ] + lines
+    log.info( "%s", summary[0] )
+    return "text/plain", "\n".join( summary ) + "\n"
+
+# None: disabled; "": return summaries; "<dir>": also save profiles there
+profile_request.enabled		= os.environ.get( "ORGSERVER_PROFILE" )
+profile_request.top		= 25	# Functions or allocation sites shown
+profile_request.kinds		= ( "cpu", "mem" )
+
+
+def profile_cpu( function, args, kwds, saving=None ):
+    """Return the function's result, and the lines of its cProfile summary."""
+    import cProfile
+    import pstats
+    profiler			= cProfile.Profile()
+    result			= profiler.runcall( function, *args, **kwds )
+    output			= StringIO()
+    stats			= pstats.Stats( profiler, stream=output )
+    stats.strip_dirs()
+    stats.sort_stats( "cumulative" ).print_stats( profile_request.top )
+    stats.sort_stats( "time" ).print_stats( profile_request.top )
+    lines			= output.getvalue().splitlines()
+    if saving:
+        profiler.dump_stats( saving + ".pstats" )
+        lines.append( "Saved: %s.pstats" % ( saving ))
+    return result, lines
+
+
+def profile_mem( function, args, kwds, saving=None ):
+    """Return the function's result, and the lines of a summary of the memory
+    it allocated.  With tracemalloc (Python 3.4+), these are the top allocation
+    sites still holding memory when the request completes.  Otherwise, we can
+    only report the growth in the number of (garbage collected) objects of each
+    type, and in the process' peak memory.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc		= None
+    lines			= []
+    if tracemalloc:
+        tracemalloc.start( 10 )
+        try:
+            result		= function( *args, **kwds )
+            snapshot		= tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        statistics		= snapshot.statistics( "lineno" )
+        lines.append( "Top %d of %d allocation sites, by size:" % (
+            min( profile_request.top, len( statistics )), len( statistics )))
+        for stat in statistics[:profile_request.top]:
+            lines.append( "  %s" % ( stat ))
+        if saving:
+            snapshot.dump( saving + ".snapshot" )
+            lines.append( "Saved: %s.snapshot" % ( saving ))
+        return result, lines
+
+    import gc
+    import resource
+    def population():
+        counts			= {}
+        for obj in gc.get_objects():
+            name		= type( obj ).__name__
+            counts[name]	= counts.get( name, 0 ) + 1
+        return counts
+    gc.collect()
+    before			= population()
+    peak			= resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    result			= function( *args, **kwds )
+    after			= population()
+    rss				= resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    growth			= sorted( ( ( after[name] - before.get( name, 0 ), name )
+                                            for name in after ), reverse=True )
+    lines.append( "tracemalloc unavailable; allocation sites not traced." )
+    lines.append( "Peak memory: %d KB (+%d KB)" % ( rss, rss - peak ))
+    lines.append( "Top %d object types, by growth in count:" % ( profile_request.top ))
+    for count, name in growth[:profile_request.top]:
+        if count > 0:
+            lines.append( "  %8d %s" % ( count, name ))
+    if saving:
+        with open( saving + ".txt", 'w' ) as f:
+            f.write( "\n".join( lines ) + "\n" )
+        lines.append( "Saved: %s.txt" % ( saving ))
+    return result, lines
+
+
 #
 # URL request handlers
 #
 #     projects_request	-- Returns all available projects, and styles
 #     data_request	-- Returns statistics for one project
+#     batch_request	-- Returns statistics for several projects, and their portfolio
+#     metrics_request	-- Returns the server's instrumentation
+#     refresh_request	-- Pulls (optionally), and walks any new commits, now
 #
 
+@instrumented( "projects" )
 def projects_request( repository, project,
                       queries=None, environ=None, accept=None,
-                      framework=None ):
+                      framework=None, headers=None ):
     """Render a projects requests in the accepted form.  If an accept
     encoding is supplied, us it.  Otherwise, detect it from the
     environ's' "HTTP_ACCEPT"; default to "text/html".
@@ -1088,14 +2228,50 @@ def projects_request( repository, project,
         environ		-- HTTP request environment (headers)
         accept		-- A forced MIME encoding (eg. application/json).
         framework	-- The web framework module being used
+        headers		-- A list, to receive any additional response headers
+
+    The response is compressed, if the environ's "HTTP_ACCEPT_ENCODING" allows;
+    if so, the appropriate Content-Encoding header is added to 'headers'.
+
+    With ?profile=cpu|mem, the request is profiled instead (see profile_request).
     """
+    if queries and 'profile' in queries:
+        return profile_request( projects_request, repository, project,
+                                queries=queries, environ=environ, accept=accept,
+                                framework=framework, headers=headers )
     accept		= deduce_encoding( [ "application/json",
                                              "text/javascript",
                                              "text/plain",
                                              "text/html" ],
                                            environ=environ, accept=accept )
 
+    # The projects list is determined by the "master" commit, the encoding and
+    # the query options.  Skip all work, if the client already has it.
+    if headers is None:
+        headers		= []
+    head		= repository_head( repository )
+    etag		= entity_tag( head, accept, deduce_compression( environ ), *sorted(
+                                          ( queries or {} ).items() ) + list( project ))
+    if not_modified( etag, environ ):
+        raise http_exception( framework, 304, "Not Modified",
+                              headers=[ ( "ETag", etag ) ] )
+
+    # If another process has published the (default) response for this commit
+    # in the shared results store, serve it from there.
+    if ( projects_request.store is not None and not uncached()
+         and accept in ("application/json", "text/javascript", "text/plain")
+         and not query_flag( queries, 'pretty' )):
+        callback	= queries and queries.get( 'callback', "" ) or ""
+        encoding	= None if callback else deduce_compression( environ )
+        response	= projects_request.store.get( store_key( head, None, None, False, encoding ))
+        cache_lookup( "store", response is not None )
+        if response is not None:
+            headers.append( ( "ETag", etag ))
+            return accept, compressed( jsonp( { encoding: response }, callback ), environ,
+                                       headers=headers )
+
     hexsha, data	= project_data( repository, project )
+    headers.append( ( "ETag", etag ))
     # TODO: Deduce available graph styles from data (eg. see if sprint specified)
     styles		= [ "effort", "elapsed", "sprint" ]
 
@@ -1111,13 +2287,9 @@ def projects_request( repository, project,
 
     if accept and accept in ("application/json", "text/javascript", "text/plain"):
         # JSON
-        response		= ""
         callback		= queries and queries.get( 'callback', "" ) or ""
-        if callback:
-            response		= callback + "( "
-        response               += json.dumps( content, sort_keys=True, indent=4 )
-        if callback:
-            response           += " )"
+        response		= jsonp( { None: json_dumps( content, pretty=query_flag( queries, 'pretty' )) },
+                                         callback )[None]
     elif accept in ("text/html"):
         # HTML5.  Yes, this minimal markup is cross-browser standards
         # compliant (including the unquoted attributes!)
@@ -1168,16 +2340,34 @@ def projects_request( repository, project,
             accept, environ.get( "HTTP_ACCEPT", "*.*" ))
         raise http_exception( framework, 406, message )
 
-    # Return the content-type we've agreed to produce, and the result.
-    return accept, response
+    # Return the content-type we've agreed to produce, and the (compressed) result.
+    return accept, compressed( { None: response }, environ, headers=headers )
+
+# The shared results store, if any (see publish_results)
+projects_request.store		= None
 
 
+@instrumented( "data" )
 def data_request( repository, project, path, style=None,
                   queries=None, environ=None, accept=None,
-                  framework=None ):
+                  framework=None, headers=None, stale=None ):
     """Return the project data specified by path:
 
-           .../<project>[/<style>][?linear]
+           .../<project>[/<style>][?linear][&pretty=1][&since=<blob|date>][&asof=<commit|blob|date>][&working]
+
+    If 'since' is supplied, only the records from that blob or date on are
+    returned (see project_stats_since).  If 'asof' is supplied, the results
+    (including projections) are as they would have been at that commit, blob or
+    date (see project_results).  Either must be a "YYYY-MM-DD" date or a hexsha
+    (of at least 7 digits), else 400 Bad Request.  Their responses are cached by
+    the records they resolve to, not as supplied, so equivalent queries share
+    one.  With 'working' (and no 'asof'), a provisional last record is
+    appended from the project's file in the working tree, if it has uncommitted
+    changes (see project_data_working); such responses aren't cached, but their
+    ETag changes only when the working file does.
+
+    If "application/x-msgpack" is accepted, the data is returned in columnar
+    form (see columnar), encoded as MessagePack.
 
     We'll parse the historical org-mode data, and cache it based on the
     hash of the commit.  The optional linear query option will changed
@@ -1185,11 +2375,34 @@ def data_request( repository, project, path, style=None,
 
     The style may be provided either as an argument or as a term in
     the URL.  If none is provided, the 'effort' is assumed.
+
+    The rendered JSON (and any compressed forms of it) are also cached for the
+    commit (the data_request.responses_limit most recently used), so repeated
+    requests need neither transform, serialize nor compress the data again.
+    JSONP (callback) responses are found, or computed, as the plain JSON is;
+    only then is the callback wrapped around it (see jsonp).
+
+    Once "master" advances, the previous commit's response may be served for up
+    to 'stale' seconds (default: data_request.stale; 0 disables), while the new
+    commit's response is computed in the background; it is marked with an
+    "X-Stale: <hexsha>" header.  A previous response computed more than
+    data_request.max_age seconds ago is never served; the request waits.
+
+    Requests which must compute their response are subject to admission
+    control (see data_request.admission); when too busy, they are refused
+    with 503 Service Unavailable.  Already rendered responses are not.
+
+    With ?profile=cpu|mem, the request is profiled instead (see profile_request).
     """
+    if queries and 'profile' in queries:
+        return profile_request( data_request, repository, project, path, style=style,
+                                queries=queries, environ=environ, accept=accept,
+                                framework=framework, headers=headers, stale=0 )
     accept		= deduce_encoding( [ "application/json",
                                              "text/javascript",
                                              "text/plain",
-                                             "text/html" ],
+                                             "text/html",
+                                             "application/x-msgpack" ],
                                            environ=environ, accept=accept )
 
     # Confirm that project name and (optional) style are valid.
@@ -1209,59 +2422,990 @@ def data_request( repository, project, path, style=None,
             style		= terms[1]
         if style not in [ "sprint", "elapsed", "effort" ]:
             raise Exception( "Unknown style for project '%s': %s" % ( proj, style ))
-
-        try:
-            hexsha, data	= project_data( repository, [ proj ] )
-        except Exception, e:
-            raise http_exception( framework, 500,
-                                  "Project data bad: %s" % ( e.message ))
-        if proj not in data.keys():
-            raise http_exception( framework, 404, "Unknown project: %s" % ( proj ))
     except Exception, e:
         # Invalid project/style requested.  Return 404 Not Found
         raise http_exception( framework, 404, e.message )
 
-    # hexsha updated, data[proj] available.  Check that our cached data still
-    # valid and/or exists, and go parse it if not.
-    if data_request.hexsha != hexsha:
-        data_request_hexsha	= hexsha
-        data_request.cache	= {}
-    stats			= data_request.cache.get( proj, None )
-    if not stats:
-        stats                   = project_data_parse( data, proj )
-        data_request.cache[proj]= stats
-
-
-    # Transform the raw stats into the desired x-axis style.  We must perform a
-    # shallow copy of the stats dict, because we modify it "in-place".  We
-    # promise to do a deep copy of any dicts within this that we have to change.
-    trans			= project_stats_transform(
-        stats, style, bestfit=(( "linear" not in queries ) if queries else True ))
-
-    response			= None
-    if accept and accept in ("application/json", "text/javascript", "text/plain"):
-        response		= ""
-        callback		= queries and queries.get( 'callback', "" ) or ""
-        if callback:
-            response		= callback + "( "
-        response               += json.dumps( trans, sort_keys=True, indent=4 )
-        if callback:
-            response           += " )"
+    # The result is fully determined by the "master" commit, project, style,
+    # format and query options (see data_request_serve).
+    binary			= accept == "application/x-msgpack"
+    bestfit			= not query_flag( queries, 'linear' )
+    pretty			= query_flag( queries, 'pretty' ) and not binary
+    callback			= not binary and queries and queries.get( 'callback', "" ) or ""
+    since			= queries and queries.get( 'since', "" ) or ""
+    asof			= queries and queries.get( 'asof', "" ) or ""
+    working			= query_flag( queries, 'working' ) and not asof
+    for name, value in ( ( "since", since ), ( "asof", asof ) ):
+        if value and not re.match( r"^([0-9]{4}-[0-9]{2}-[0-9]{2}|[0-9a-f]{7,40})$", value ):
+            raise http_exception( framework, 400, "Invalid %s: %s (a YYYY-MM-DD date, or hexsha)"
+                                  % ( name, value ))
+    key				= ( proj, style, bestfit, pretty, binary, since, asof )
+    if working:
+        key		       += ( working_key( repository, proj ), )
+
+    # The rendered response is cached by the 'since' offset and 'asof' count of
+    # records they resolve to (see data_request_resolve), not by the strings
+    # supplied; a 'since' matching nothing has an offset of None.
+    def resolved( offset=None, count=None ):
+        return key[:5] + ( since and ( offset, ), count ) + key[7:]
+    if stale is None:
+        stale			= data_request.stale
+
+    def found( head ):
+        # If another process has published the (default) response for this
+        # commit in the shared results store, serve it from there; no work at all.
+        if ( data_request.store is not None and not uncached()
+             and bestfit and not ( pretty or since or asof or working )):
+            encoding		= None if callback else deduce_compression( environ )
+            response		= data_request.store.get( store_key( head, proj, style, binary, encoding ))
+            cache_lookup( "store", response is not None )
+            if response is not None:
+                return head, { encoding: response }
+
+        # If the new commit's response isn't ready yet, perhaps serve the
+        # previous commit's, and compute the new one in the background (just once).
+        if stale and not ( working or since or asof ) and not uncached():
+            previous		= data_request_stale( head, resolved(), stale )
+            if previous is not None:
+                data_request.flights.start( ( "refresh", head ) + key, data_request,
+                                            repository, project, path, style=style,
+                                            queries=queries, environ={}, accept=accept, stale=0 )
+                return previous
+
+        # A response already rendered for this commit needs no further work; it
+        # doesn't wait for admission, nor does it consult the Git history.
+        if working or uncached():
+            return None
+        variants		= None
+        resolution		= data_request_resolve( head, proj, style, bestfit, since, asof )
+        if resolution is not None:
+            variants		= data_request_rendered( head, resolved( *resolution ))
+        cache_lookup( "responses", variants is not None )
+        if variants is not None:
+            return head, variants
+        return None
+
+    def compute():
+        hexsha, stats, trans	= project_results( repository, proj, style, bestfit, asof=asof,
+                                                   working=working )
+        offset, count		= None, None
+        if asof:
+            count		= project_results_asof( repository, proj, stats, asof )
+        if since:
+            offset		= project_stats_offset( trans, since )
+        if not ( uncached() or working ):
+            variants		= data_request_rendered( hexsha, resolved( offset, count ))
+            if variants is not None:
+                return hexsha, variants
+        if since:
+            trans		= project_stats_since( trans, offset )
+        if binary:
+            response		= msgpack_dumps( columnar( trans ))
+        else:
+            response		= json_dumps( trans, pretty=pretty )
+        if uncached() or working:
+            return hexsha, { None: response }
+        return hexsha, data_request_respond( hexsha, resolved( offset, count ), response )
 
-    #elif accept and accept in ("text/html"):
-    #    pass
+    return data_request_serve( repository, key, compute, accept,
+                               ( "application/json", "text/javascript", "text/plain",
+                                 "application/x-msgpack" ),
+                               callback=callback, environ=environ, framework=framework,
+                               headers=headers, found=found )
 
-    else:
+
+# Initial cache for data_request function
+data_request.hexsha		= None
+data_request.cache		= None
+data_request.transforms		= None
+data_request.responses		= None	# The most recently used last
+data_request.responses_limit	= 1024
+data_request.computed		= None	# When the current cache was started
+data_request.previous		= None	# ( hexsha, responses, computed, superseded )
+data_request.lock		= threading.Lock()
+data_request.flights		= single_flight()
+data_request.admission		= admission()
+data_request.stale		= 0.0	# Seconds a previous commit's response may be served
+data_request.max_age		= 3600.0 # ... if computed no more than this long ago
+data_request.store		= None	# The shared results store, if any (see publish_results)
+
+
+def data_request_serve( repository, key, compute, accept, acceptable, callback="",
+                        environ=None, framework=None, headers=None, found=None ):
+    """Serve the response fully determined by the "master" commit and the key, in
+    the accepted encoding (one of the 'acceptable'; else 406 Not Acceptable), and
+    return ( accept, body ); the course shared by data_request and batch_request.
+
+    If the client already has it (its If-None-Match: matches our ETag), we're
+    done -- before doing any work.  Otherwise, found( head ) may supply the
+    ( hexsha, variants ) already available; if not for the head commit, it is
+    marked with an "X-Stale: <hexsha>" header.  Failing that, compute() returns
+    them.  If too many such computations are already underway or waiting (see
+    data_request.admission), fail fast with 503 Service Unavailable; concurrent
+    requests for the same key await just one.  Any request_failed raised becomes
+    the framework's HTTP error.
+    """
+    if not ( accept and accept in acceptable ):
         # Invalid encoding requested.  Return appropriate 406 Not Acceptable
         message			=  "Invalid encoding: %s, for Accept: %s" % (
-            accept, environ.get( "HTTP_ACCEPT", "*.*" ))
+            accept, ( environ or {} ).get( "HTTP_ACCEPT", "*.*" ))
         raise http_exception( framework, 406, message )
 
-    return accept, response
+    if headers is None:
+        headers			= []
+    def etag( hexsha ):
+        return entity_tag( hexsha, accept, deduce_compression( environ ),
+                           callback, day_seconds, *key )
+    try:
+        head			= repository_head( repository )
+    except Exception, e:
+        raise http_exception( framework, 404, "Project data bad: %s" % ( e.message ))
+    if not_modified( etag( head ), environ ):
+        raise http_exception( framework, 304, "Not Modified",
+                              headers=[ ( "ETag", etag( head )) ] )
+
+    def admitted():
+        if not data_request.admission.acquire():
+            raise request_failed( 503, "Too busy; try again later", headers=[
+                ( "Retry-After", "%d" % ( data_request.admission.retry )) ] )
+        try:
+            return compute()
+        finally:
+            data_request.admission.release()
+
+    available			= found and found( head )
+    if available is not None and available[0] != head:
+        hexsha, variants	= available
+        headers.extend( [ ( "ETag", etag( hexsha )), ( "X-Stale", hexsha ) ] )
+        if not_modified( etag( hexsha ), environ ):
+            raise http_exception( framework, 304, "Not Modified", headers=headers )
+        return accept, compressed( jsonp( variants, callback ), environ, headers=headers )
+    if available is not None:
+        hexsha, variants	= available
+    else:
+        try:
+            if uncached():
+                hexsha, variants = admitted()
+            else:
+                hexsha, variants = data_request.flights( ( "admit", head ) + key, admitted )
+        except request_failed, e:
+            raise http_exception( framework, e.status, e.message, headers=e.headers )
+    headers.append( ( "ETag", etag( hexsha )) )
+    return accept, compressed( jsonp( variants, callback ), environ, headers=headers )
+
+def data_request_respond( hexsha, key, response ):
+    """Remember the rendered response for the key at commit hexsha (unless the
+    cache has since moved on to another commit), and return its variants.  Once
+    there are more than data_request.responses_limit, the least recently used
+    are discarded.
+    """
+    variants			= { None: response }
+    with data_request.lock:
+        if data_request.hexsha == hexsha:
+            responses		= data_request.responses
+            variants		= responses.setdefault( key, variants )
+            while len( responses ) > data_request.responses_limit:
+                responses.popitem( last=False )
+                metric_evictions.inc( layer="responses" )
+    return variants
+
+
+def data_request_rendered( hexsha, key ):
+    """Return the variants of the response already rendered for the key at
+    commit hexsha, if any, marking it most recently used; otherwise None.
+    """
+    with data_request.lock:
+        if data_request.hexsha != hexsha or key not in data_request.responses:
+            return None
+        variants		= data_request.responses.pop( key )
+        data_request.responses[key] = variants
+        return variants
+
+
+def data_request_resolve( hexsha, proj, style, bestfit, since, asof ):
+    """Resolve 'since' and 'asof' to the ( offset, count ) of the records they
+    identify (see project_stats_offset, project_results_asof), using only the
+    stats and results already cached for commit hexsha.  Returns None if these
+    aren't cached (yet), or 'asof' names a commit; the response must then be
+    computed (its records resolved anew) to find it.
+    """
+    with data_request.lock:
+        if data_request.hexsha != hexsha:
+            return None
+        stats			= data_request.cache.get( proj )
+        transforms		= data_request.transforms
+    offset, count		= None, None
+    tkey			= ( proj, style, bestfit )
+    if asof:
+        count			= project_stats_asof( stats, asof ) if stats else None
+        if count is None:
+            return None
+        tkey		       += ( count, )
+    if since:
+        trans			= transforms.get( tkey )
+        if trans is None:
+            return None
+        offset			= project_stats_offset( trans, since )
+    return offset, count
+
+
+def project_results( repository, proj, style=None, bestfit=True, asof=None, working=False ):
+    """Return the project's ( hexsha, stats, results ) for the current "master"
+    commit: the parsed stats (see project_data_parse), and the results of
+    transforming them into the given style (see project_stats_transform; None,
+    if no style).  These are cached 'til the commit changes, in data_request's
+    cache.  If several threads want the same thing at once (eg. many clients,
+    just after "master" advances), only one does the work; the others wait for
+    its result.  Failures raise request_failed.
+
+    If 'asof' (a commit, blob or date) is supplied, the results are transformed
+    from only the records which existed then (see project_results_asof); no
+    Git history is walked, nor anything reparsed.  These are cached by the
+    number of records, so stepping back and forth through history is cheap.
+    Their "asof" is the blob hexsha of the last such record.
+
+    If 'working', the stats include any provisional record from the working
+    tree (see project_data_working); only the latest working version of each
+    project's results is retained.
+    """
+    try:
+        hexsha, data		= project_data( repository, [ proj ] )
+    except Exception, e:
+        raise request_failed( 404, "Project data bad: %s" % ( e.message ))
+    if proj not in data.keys():
+        # Invalid project requested.  Return 404 Not Found
+        raise request_failed( 404, "Unknown project: %s" % ( proj ))
+
+    # hexsha updated, data[proj] available.  Check that our cached data still
+    # valid and/or exists, and take our own references to it (in case another
+    # thread resets it meanwhile).
+    with data_request.lock:
+        if data_request.hexsha != hexsha:
+            data_request_advance( hexsha )
+        cache			= data_request.cache
+        transforms		= data_request.transforms
+
+    flights			= data_request.flights
+    if uncached():
+        # Being profiled; compute everything anew (in this thread), caching nothing
+        cache, transforms	= {}, {}
+        flights			= lambda key, function, *args: function( *args )
+
+    def parse():
+        stats			= cache.get( proj, None )
+        if not stats:
+            stats		= project_data_parse( data, proj )
+            cache[proj]		= stats
+        return stats
+
+    def transform( tkey, stats ):
+        # Transform the raw stats into the desired x-axis style.  We must
+        # perform a shallow copy of the stats dict, because we modify it
+        # "in-place".  We promise to do a deep copy of any dicts within
+        # this that we have to change.
+        trans			= transforms.get( tkey )
+        if trans is None:
+            with staged( "transform" ):
+                trans		= project_stats_transform( stats, style, bestfit=bestfit )
+            transforms[tkey]	= trans
+        return trans
+
+    def cached( layer, found ):
+        cache_lookup( layer, bool( found ))
+        return found
+
+    stats			= ( cached( "stats", cache.get( proj ))
+                                    or flights( ( hexsha, proj ), parse ))
+    if working:
+        wkey, stats		= project_data_working( repository, proj, stats )
+        if "working" in stats:
+            if style is None:
+                return hexsha, stats, None
+            tkey		= ( proj, style, bestfit, "working" )
+            found		= transforms.get( tkey )
+            if cached( "transforms", found and found[0] == wkey ):
+                return hexsha, stats, found[1]
+            with staged( "transform" ):
+                trans		= project_stats_transform( stats, style, bestfit=bestfit )
+            transforms[tkey]	= ( wkey, trans )
+            return hexsha, stats, trans
+    if style is None:
+        return hexsha, stats, None
+    if not asof:
+        tkey			= ( proj, style, bestfit )
+        trans			= ( cached( "transforms", transforms.get( tkey ))
+                                    or flights( ( hexsha, ) + tkey, transform, tkey, stats ))
+        return hexsha, stats, trans
+
+    # As of some prior commit, blob or date; identified by its last record's blob
+    count			= project_results_asof( repository, proj, stats, asof )
+    prefix			= copy.copy( stats )	# Shallow copy
+    prefix["list"]		= stats["list"][:count]
+    tkey			= ( proj, style, bestfit, count )
+    trans			= copy.copy( cached( "transforms", transforms.get( tkey ))
+                                             or flights( ( hexsha, ) + tkey, transform, tkey, prefix ))
+    trans["asof"]		= prefix["list"][-1]["blob"]
+    return hexsha, stats, trans
+
+
+def project_results_asof( repository, proj, stats, asof ):
+    """Return how many of the project's parsed stats records existed as of
+    'asof': a commit, blob or date (see project_stats_asof).  A commit is found
+    via its blob.  Failures raise request_failed.
+    """
+    count			= project_stats_asof( stats, asof )
+    if count is None:
+        try:
+            with project_data.lock:
+                commit		= git.Repo( repository ).commit( asof )
+                blob		= ( commit.tree/( project_name( proj )[0] + ".org" )).hexsha
+        except Exception, e:
+            raise request_failed( 404, "No %s data as of %s" % ( proj, asof ))
+        count			= project_stats_asof( stats, blob )
+        if count is None:
+            # That blob's record was superseded by a later one on the same day
+            count		= project_stats_asof( stats, time.strftime(
+                "%Y-%m-%d", time.localtime( commit.committed_date )))
+    if count is None:
+        raise request_failed( 404, "No %s data as of %s" % ( proj, asof ))
+    return count
+
+
+def working_key( repository, proj ):
+    """Identify the version of the project's file in the working tree: its
+    ( mtime, size ), or None if none (see project_data_working)."""
+    try:
+        st			= os.stat( os.path.join( repository, project_name( proj )[0] + ".org" ))
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
 
-# Initial cache for data_request function
-data_request.hexsha		= None
-data_request.cache		= None
+def data_request_advance( hexsha ):
+    """Start data_request's cache afresh for a new commit (with data_request.lock
+    held), remembering the previous commit's responses; unless none were ever
+    rendered, in which case we retain the ones before that.  Each request's
+    response for the new commit becomes visible (atomically) once rendered.
+    """
+    now				= time.time()
+    metric_evictions.inc( len( data_request.cache or {} ), layer="stats" )
+    metric_evictions.inc( len( data_request.transforms or {} ), layer="transforms" )
+    if data_request.responses:
+        if data_request.previous:
+            metric_evictions.inc( len( data_request.previous[1] ), layer="responses" )
+        data_request.previous	= ( data_request.hexsha, data_request.responses,
+                                    data_request.computed, now )
+    data_request.hexsha		= hexsha
+    data_request.computed	= now
+    data_request.cache		= {}
+    data_request.transforms	= {}
+    data_request.responses	= collections.OrderedDict()
+
+
+def data_request_stale( head, key, stale ):
+    """If data_request has no response for the key at commit head yet, return the
+    previous commit's ( hexsha, variants ), if it was superseded no more than
+    'stale' seconds ago, and computed no more than data_request.max_age seconds
+    ago.  Otherwise, None.
+    """
+    now				= time.time()
+    with data_request.lock:
+        if data_request.hexsha != head:
+            data_request_advance( head )
+        if key in data_request.responses or data_request.previous is None:
+            return None
+        hexsha, responses, computed, superseded = data_request.previous
+    variants			= responses.get( key )
+    if ( variants is None or now - superseded > stale
+         or now - computed > data_request.max_age ):
+        return None
+    return hexsha, variants
+
+
+@instrumented( "batch" )
+def batch_request( repository, project, style=None,
+                   queries=None, environ=None, accept=None,
+                   framework=None, headers=None ):
+    """Return the data for several projects at once, and their portfolio:
+
+           .../batch?projects=<project>,<project>,...[&style=<style>][&linear][&pretty=1]
+
+    If no projects are specified, all of them are returned; the style defaults
+    as for data_request.  Each project's data is computed (or found in cache)
+    in parallel, exactly as for data_request.  The "portfolio" combines them
+    (see portfolio_stats), and has its own forecast lines, computed from the
+    combined series.  A project whose results can't be computed is returned as
+    { "project": <project>, "error": <message> }, and left out of the portfolio.
+    Returns:
+
+        {
+            "style":		<style>,
+            "projects":		{ <project>: { ...as for data_request... }, ... },
+            "portfolio":	{ "project": "portfolio", "projects": [...], "list": [...], ... }
+        }
+    """
+    accept		= deduce_encoding( [ "application/json",
+                                             "text/javascript",
+                                             "text/plain",
+                                             "text/html" ],
+                                           environ=environ, accept=accept )
+    names			= []
+    for proj in ( queries and queries.get( 'projects' ) or "" ).split( "," ):
+        if proj and proj not in names:
+            names.append( proj )
+    names			= names or list( project )
+    for proj in names:
+        if proj not in project:
+            raise http_exception( framework, 404, "Unknown project: %s" % ( proj ))
+    style			= queries and queries.get( 'style' ) or style or 'effort'
+    if style not in [ "sprint", "elapsed", "effort" ]:
+        raise http_exception( framework, 404, "Unknown style: %s" % ( style ))
+
+    bestfit			= not query_flag( queries, 'linear' )
+    pretty			= query_flag( queries, 'pretty' )
+    callback			= queries and queries.get( 'callback', "" ) or ""
+    key				= ( "batch", tuple( names ), style, bestfit, pretty )
+
+    def found( head ):
+        variants		= data_request_rendered( head, key )
+        cache_lookup( "responses", variants is not None )
+        if variants is not None:
+            return head, variants
+        return None
+
+    def compute():
+        # Collect all the projects' blobs in one walk of the Git history, then
+        # parse and transform each project in its own thread.
+        try:
+            project_data( repository, names )
+        except Exception, e:
+            raise request_failed( 404, "Project data bad: %s" % ( e.message ))
+        outcomes		= {}
+        def work( proj ):
+            try:
+                outcomes[proj]	= project_results( repository, proj, style, bestfit )
+            except Exception, e:
+                outcomes[proj]	= e
+        threads			= [ threading.Thread( target=work, args=( proj, ))
+                                    for proj in names ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # A project whose data is bad fails the batch (eg. 404 Not Found).  One
+        # whose results can't be computed (eg. in an unimplemented style) gets
+        # just an "error" in its place, and is left out of the portfolio; unless
+        # none can be, which is 404 Not Found (as for an unknown style).
+        failed			= {}
+        for proj in names:
+            if isinstance( outcomes[proj], request_failed ):
+                raise outcomes[proj]
+            if isinstance( outcomes[proj], Exception ):
+                log.warning( "Batch %s results failed: %s", proj, outcomes[proj] )
+                failed[proj]	= str( outcomes[proj] )
+        computed		= [ proj for proj in names if proj not in failed ]
+        if not computed:
+            raise request_failed( 404, "No %s results: %s" % ( style, "; ".join(
+                "%s: %s" % ( proj, failed[proj] ) for proj in names )))
+
+        hexsha			= outcomes[computed[0]][0]
+        content			= {}
+        content["style"]	= style
+        content["projects"]	= dict( ( proj, outcomes[proj][2] ) for proj in computed )
+        content["projects"].update( ( proj, { "project": proj, "error": failed[proj] } )
+                                    for proj in failed )
+        with staged( "transform" ):
+            content["portfolio"] = project_stats_transform(
+                portfolio_stats( [ outcomes[proj][1] for proj in computed ] ), style,
+                bestfit=bestfit )
+        response		= json_dumps( content, pretty=pretty )
+        return hexsha, data_request_respond( hexsha, key, response )
+
+    return data_request_serve( repository, key, compute, accept,
+                               ( "application/json", "text/javascript", "text/plain" ),
+                               callback=callback, environ=environ, framework=framework,
+                               headers=headers, found=found )
+
+
+def cache_layers():
+    """Return each cache layer's contents: { <layer>: [ <dict>, ... ], ... }"""
+    with data_request.lock:
+        responses		= [ data_request.responses or {} ]
+        if data_request.previous:
+            responses.append( data_request.previous[1] )
+        return {
+            "commits":		[ project_data.result or {} ],
+            "blobs":		[ project_data_parse.cache ],
+            "stats":		[ data_request.cache or {} ],
+            "transforms":	[ data_request.transforms or {} ],
+            "responses":	responses,
+        }
+
+
+instruments.gauge( "orgserver_cache_entries", "Cache entries, by layer",
+                   function=lambda: dict(
+                       ( ( ( "layer", layer ), ), sum( len( d ) for d in dicts ))
+                       for layer, dicts in cache_layers().items() ))
+instruments.gauge( "orgserver_cache_bytes", "Cache memory use (estimated), by layer",
+                   function=lambda: dict(
+                       ( ( ( "layer", layer ), ), metrics.deep_size( dicts ))
+                       for layer, dicts in cache_layers().items() ))
+instruments.gauge( "orgserver_admission_running", "Project data computations running",
+                   function=lambda: data_request.admission.running )
+instruments.gauge( "orgserver_admission_waiting", "Project data computations waiting",
+                   function=lambda: data_request.admission.waiting )
+
+
+def metrics_request( environ=None, framework=None, headers=None ):
+    """Return the server's instrumentation, in Prometheus text format:
+
+        orgserver_request_seconds	-- API request latency histograms, by endpoint, status
+        orgserver_stage_seconds		-- Time in each stage: walk, read, parse, stats,
+                                           transform, serialize, compress
+        orgserver_git_commits_total	-- Git commits visited
+        orgserver_blob_read_bytes_total	-- Bytes of org-mode blobs read
+        orgserver_parse_{blobs,rows}_total -- Blobs, table rows parsed
+        orgserver_cache_{hits,misses,evictions}_total -- by cache layer: commits,
+                                           blobs, stats, transforms, responses, store
+        orgserver_cache_{entries,bytes}	-- Cache size, by layer
+        orgserver_admission_{running,waiting} -- See data_request.admission
+    """
+    return "text/plain; version=0.0.4", compressed( { None: instruments.exposition() },
+                                                    environ or {}, headers=headers )
+
+
+@instrumented( "refresh" )
+def refresh_request( repository, project,
+                     queries=None, environ=None, accept=None,
+                     framework=None, headers=None ):
+    """Bring the server up to date with the Git repository now, rather than
+    waiting for the next request (or poll) to notice: with ?pull, first fetch
+    and fast-forward "master" (see repository_pull); then walk any new commits
+    (see project_data), and parse each project's new blobs.  Any event stream
+    subscribers are notified immediately.  Meant to be POSTed by a Git hook
+    (see orgserver-refresh), so only local requests are permitted (see
+    local_request).  Returns JSON describing the refresh:
+
+        {"hexsha": "3f2a...", "previous": "9e3b...", "pulled": true,
+         "projects": {"project": 42, "another": "Unknown project: another"}}
+
+    giving each project's number of records, or why it failed.
+    """
+    if not local_request( environ ):
+        raise http_exception( framework, 403, "Refresh not permitted" )
+    previous			= project_data.hexsha
+    pulled			= False
+    if query_flag( queries, 'pull' ):
+        try:
+            pulled		= repository_pull( repository )
+        except Exception, e:
+            log.warning( "Refresh failed to pull %s: %s", repository, e )
+            raise http_exception( framework, 503, "Pull failed: %s" % ( e ),
+                                  headers=[ ( "Retry-After", "%d" % ( refresh_request.retry )) ] )
+
+    # Walk all the projects' new commits at once, then parse each one's blobs
+    try:
+        hexsha, data		= project_data( repository, project )
+    except Exception, e:
+        raise http_exception( framework, 404, "Project data bad: %s" % ( e ))
+    records			= {}
+    for proj in project:
+        try:
+            _, stats, _		= project_results( repository, proj )
+            records[proj]	= len( stats["list"] )
+        except request_failed, e:
+            records[proj]	= e.message
+    log.info( "Refreshed %8.8s (was %8.8s)%s", hexsha, previous or "",
+              ", pulled" if pulled else "" )
+    if events_request.publisher is not None:
+        events_request.publisher.wake()
+
+    if headers is not None:
+        headers.append( ( "Cache-Control", "no-cache" ))
+    return "application/json", json_dumps( { "hexsha": hexsha, "previous": previous,
+                                 "pulled": pulled, "projects": records },
+                               pretty=query_flag( queries, 'pretty' ))
+
+refresh_request.retry		= 30	# Seconds before retrying a failed pull
+
+
+def control_server( path, repository, project, refreshed=None ):
+    """Serve POST /api/refresh (only) on a Unix domain socket at path, in a
+    daemon thread, replacing any stale socket there.  Only the server's own
+    user may connect, and such requests are local (see local_request); eg.
+
+        curl -X POST --unix-socket <path> http://localhost/api/refresh?pull
+
+    After each successful refresh, any refreshed() supplied is called.
+    Returns the asynchttp.server.
+    """
+    import asynchttp
+    import urlparse
+
+    def application( environ ):
+        if environ["PATH_INFO"] != "/api/refresh":
+            raise asynchttp.HTTPError( 404, "Not found: %s" % ( environ["PATH_INFO"] ))
+        if environ["REQUEST_METHOD"] != "POST":
+            raise asynchttp.HTTPError( 405, "Method not allowed: %s" % ( environ["REQUEST_METHOD"] ),
+                                       headers=[ ( "Allow", "POST" ) ] )
+        queries			= dict( ( k, v[-1] ) for k, v in urlparse.parse_qs(
+            environ["QUERY_STRING"], keep_blank_values=True ).items() )
+        environ			= dict( environ )
+        environ["orgserver.control"] = True
+        headers			= []
+        content, response	= refresh_request( repository, project,
+                                                   queries=queries, environ=environ,
+                                                   framework=asynchttp, headers=headers )
+        if refreshed:
+            refreshed()
+        return 200, [ ( "Content-Type", content ) ] + headers, response
+
+    try:
+        os.unlink( path )
+    except OSError:
+        pass
+    sock			= socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    umask			= os.umask( 0177 )
+    try:
+        sock.bind( path )
+    finally:
+        os.umask( umask )
+    sock.listen( 16 )
+    httpd			= asynchttp.server( None, application, workers=1, sock=sock )
+    thread			= threading.Thread( target=httpd.serve_forever, name="control" )
+    thread.daemon		= True
+    thread.start()
+    return httpd
+
+
+def reload_save( path ):
+    """Save the caches that are costly to rebuild -- the commit index (each
+    project's blobs, as of the last "master" walked; see project_data) and
+    the blob summaries (see project_data_parse) -- to the file at path, for a
+    successor process (see reload_restore).
+    """
+    with project_data.lock:
+        index			= dict( ( p, [ ( b.hexsha, b.path ) for b in blobs ] )
+                                        for p, blobs in ( project_data.result or {} ).items() )
+        state			= {
+            "version":		reload_save.version,
+            "hexsha":		project_data.hexsha,
+            "index":		index,
+            "blobs":		dict( project_data_parse.cache ),
+        }
+    temp			= "%s.%d.tmp" % ( path, os.getpid() )
+    with open( temp, 'wb' ) as f:
+        cPickle.dump( state, f, cPickle.HIGHEST_PROTOCOL )
+    os.rename( temp, path )
+    log.info( "Saved %d projects' commit index, and %d blob summaries, to %s",
+              len( index ), len( state["blobs"] ), path )
+
+reload_save.version		= 1	# Of the saved caches; change, if incompatible
+
+
+def reload_restore( path, repository ):
+    """Restore the caches saved by a predecessor process (see reload_save) from
+    the file at path, which is then removed.  If they can't be (eg. they were
+    saved in an incompatible form), the failure is logged, and we start cold.
+    Returns the number of blob summaries restored.
+    """
+    try:
+        try:
+            with open( path, 'rb' ) as f:
+                state		= cPickle.load( f )
+        finally:
+            os.unlink( path )
+        if state.get( "version" ) != reload_save.version:
+            raise ValueError( "version %r, not %r" % ( state.get( "version" ), reload_save.version ))
+        repo			= git.Repo( repository )
+        result			= dict( ( p, [ git.Blob( repo, binascii.a2b_hex( hexsha ), path=name )
+                                               for hexsha, name in blobs ] )
+                                        for p, blobs in state["index"].items() )
+    except Exception, e:
+        log.warning( "Failed to restore caches from %s: %s", path, e )
+        return 0
+    with project_data.lock:
+        if project_data.result is None:
+            project_data.hexsha	= state["hexsha"]
+            project_data.result	= result
+    project_data_parse.cache.update( state["blobs"] )
+    log.info( "Restored %d projects' commit index (%8.8s), and %d blob summaries",
+              len( result ), state["hexsha"] or "", len( state["blobs"] ))
+    return len( state["blobs"] )
+
+
+def reload_socket():
+    """Return the listening socket handed on by our predecessor (see
+    reload_exec), or None.
+    """
+    fd				= os.environ.pop( "ORGSERVER_LISTEN_FD", None )
+    if fd is None:
+        return None
+    sock			= socket.fromfd( int( fd ), socket.AF_INET, socket.SOCK_STREAM )
+    os.close( int( fd ))	# fromfd dup'ed it
+    return sock
+
+
+def reload_exec( sock, path ):
+    """Replace this process' code with the (possibly updated) orgserver.py, run
+    with the same arguments (and PID), handing on the listening socket, and
+    the caches saved at path (see reload_save).  Any connections queued on the
+    socket meanwhile are accepted by the successor.  Never returns.
+    """
+    fd				= sock.fileno()
+    fcntl.fcntl( fd, fcntl.F_SETFD, fcntl.fcntl( fd, fcntl.F_GETFD ) & ~fcntl.FD_CLOEXEC )
+    environ			= dict( os.environ, ORGSERVER_LISTEN_FD=str( fd ),
+                                        ORGSERVER_CACHES=path )
+    log.info( "Reloading %s", " ".join( sys.argv ))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Nothing else (eg. a client's connection, or a Git subprocess' pipe) must
+    # be inherited
+    os.closerange( 3, fd )
+    os.closerange( fd + 1, 65536 )
+    os.execve( sys.executable, [ sys.executable ] + sys.argv, environ )
+
+
+def store_key( hexsha, project, style, binary, encoding ):
+    """The name of a response in the shared results store: the projects list
+    (if project is None), or a project's data in the given style; in JSON or
+    binary (MessagePack) form, with the given compression (or None).
+    """
+    return "%s %s %s %s" % ( hexsha, "%s/%s" % ( project, style ) if project else "projects",
+                             "bin" if binary else "json", encoding or "identity" )
+
+
+def publish_results( results, repository, projects, styles=( "effort", "elapsed" ),
+                     force=False ):
+    """Compute every default response (projects list, and each project's data
+    in each style; JSON and binary, in each compression) for the current
+    "master" commit, and publish them into the shared results store (an
+    mmapstore.store), along with the commit's hexsha.  Other processes may then
+    serve them (see data_request.store) without recomputing.  Returns the
+    hexsha of the results published.  Unless 'force'd, results already
+    published for the commit are left alone.
+
+    The results are published all together, or not at all: if any fails to
+    compute, or "master" advances meanwhile, nothing is published (the store
+    retains the previous commit's), and None is returned; try again later.
+    """
+    head			= repository_head( repository )
+    if results.meta().get( "hexsha" ) == head and not force:
+        return head
+    items			= {}
+    for encoding in None, "gzip", "deflate":
+        environ			= { "HTTP_ACCEPT_ENCODING": encoding or "identity" }
+        accept, response	= projects_request( repository, projects, queries={},
+                                                    environ=environ, accept="application/json" )
+        items[store_key( head, None, None, False, encoding )] = response
+        for proj in projects:
+            for style in styles:
+                for binary in False, True:
+                    try:
+                        accept, response = data_request(
+                            repository, projects, proj + "/" + style, queries={}, environ=environ,
+                            accept="application/x-msgpack" if binary else "application/json",
+                            stale=0 )
+                    except Exception, e:
+                        log.warning( "Failed to compute %s/%s for %8.8s; not publishing: %s",
+                                     proj, style, head, e )
+                        return None
+                    items[store_key( head, proj, style, binary, encoding )] = response
+    if data_request.hexsha not in ( None, head ):
+        # "master" advanced while we were computing; try again later
+        return None
+    results.publish( items, meta={ "hexsha": head } )
+    return head
+
+
+class publisher( object ):
+    """Watches the Git repository's "master" commit, and publishes a (hexsha,
+    project) event to each interested subscriber, whenever "master" advances.
+    Each project's results are computed (and hence cached) *before* its event
+    is published, so subscribers' subsequent requests are cheap.
+
+    The watcher thread is only started when the first subscriber arrives.
+    Each subscriber (by default, a new Queue.Queue; anything with a .put
+    method) receives the events for the projects it is interested in (or all
+    projects, if None).
+    """
+    def __init__( self, repository, projects, interval=10.0,
+                  styles=( "effort", "elapsed" )):
+        self.repository		= repository
+        self.projects		= projects
+        self.interval		= interval
+        self.styles		= styles
+        self.hexsha		= None	# The last commit fully published
+        self.published		= ( None, set() ) # ( hexsha, projects ) being published
+        self.lock		= threading.Lock()
+        self.subscribers	= {}	# { <Queue>: set( projects ) or None, ... }
+        self.thread		= None
+        self.awake		= threading.Event()
+
+    def subscribe( self, projects=None, queue=None ):
+        if queue is None:
+            queue		= Queue.Queue()
+        with self.lock:
+            self.subscribers[queue] = set( projects ) if projects else None
+            if self.thread is None:
+                self.thread	= threading.Thread( target=self.watch, name="publisher" )
+                self.thread.daemon = True
+                self.thread.start()
+        return queue
+
+    def unsubscribe( self, queue ):
+        with self.lock:
+            self.subscribers.pop( queue, None )
+
+    def active( self ):
+        with self.lock:
+            return len( self.subscribers )
+
+    def wake( self ):
+        """Poll now, rather than after the rest of the interval (eg. when a
+        refresh_request has just advanced "master")."""
+        self.awake.set()
+
+    def watch( self ):
+        while True:
+            try:
+                self.poll()
+            except Exception, e:
+                log.warning( "Publisher failed to compute project data: %s", e )
+            self.awake.wait( self.interval )
+            self.awake.clear()
+
+    def poll( self ):
+        """See if "master" has advanced; if so, compute each project's results,
+        and publish an event to each interested subscriber.  The first poll
+        simply remembers the current "master".  A project whose results fail
+        to compute is logged, and retried at the next poll; only once every
+        project's event has been published is the commit done with.
+        """
+        hexsha			= repository_head( self.repository )
+        if hexsha == self.hexsha:
+            return
+        if self.hexsha is None:
+            self.hexsha		= hexsha
+            return
+        if self.published[0] != hexsha:
+            self.published	= ( hexsha, set() )
+        published		= self.published[1]
+        for proj in self.projects:
+            if proj in published:
+                continue
+            try:
+                for style in self.styles:
+                    data_request( self.repository, self.projects, proj + "/" + style,
+                                  queries={}, environ={}, stale=0 )
+            except Exception, e:
+                log.warning( "Publisher failed to compute %s data for %8.8s: %s",
+                             proj, hexsha, e )
+                continue
+            self.publish( hexsha, proj )
+            published.add( proj )
+        if len( published ) == len( self.projects ):
+            self.hexsha		= hexsha
+
+    def publish( self, hexsha, project ):
+        with self.lock:
+            for queue, projects in self.subscribers.items():
+                if projects is None or project in projects:
+                    queue.put( ( hexsha, project ))
+
+
+def event_text( hexsha, project ):
+    """Format one Server-Sent Events "update" event"""
+    return "id: %s\nevent: update\ndata: %s\n\n" % (
+        hexsha, json_dumps( { "hexsha": hexsha, "project": project } ))
+
+
+def events_subscribe( repository, project, subscriber, path=None,
+                      queries=None, environ=None, framework=None,
+                      headers=None, streams=None ):
+    """Subscribe to "update" events for the projects selected by path and/or
+    queries (see events_request), returning the publisher.  The subscriber
+    (anything with a .put method) is sent a ( hexsha, project ) tuple for each.
+    The caller must unsubscribe it from the publisher, when done.
+    """
+    selected			= set()
+    if path:
+        selected.add( path )
+    if queries and queries.get( 'project' ):
+        selected.update( p for p in queries.get( 'project' ).split( ',' ) if p )
+    unknown			= selected - set( project )
+    if unknown:
+        raise http_exception( framework, 404, "Unknown project: %s" % (
+            ", ".join( sorted( unknown ))))
+
+    if events_request.publisher is None:
+        events_request.publisher = publisher( repository, project )
+    pub				= events_request.publisher
+    if streams is not None and pub.active() >= streams:
+        raise http_exception( framework, 503, "Too many event streams",
+                              headers=[ ( "Retry-After", "%d" % ( pub.interval )) ] )
+
+    if headers is not None:
+        headers.append( ( "Cache-Control", "no-cache" ))
+    last			= environ.get( "HTTP_LAST_EVENT_ID", "" ) if environ else ""
+    pub.subscribe( selected, subscriber )
+    if last:
+        hexsha			= repository_head( repository )
+        if hexsha != last:
+            for proj in sorted( selected or project ):
+                subscriber.put( ( hexsha, proj ))
+    return pub
+
+
+def events_request( repository, project, path=None,
+                    queries=None, environ=None, accept=None,
+                    framework=None, headers=None, streams=None,
+                    heartbeat=15.0 ):
+    """Return a Server-Sent Events (text/event-stream) generator, publishing
+    an "update" event for the selected projects whenever the Git repository's
+    "master" commit advances, and their new results are available:
+
+        .../events[/<project>][?project=<project>[,<project>...]]
+
+    Each event carries the "master" hexsha as its id, and its data is JSON:
+
+        id: 3f2a...
+        event: update
+        data: {"hexsha":"3f2a...","project":"project"}
+
+    Clients (eg. EventSource) reconnecting with a Last-Event-ID: that is no
+    longer "master" are immediately sent an update for each selected project.
+    A comment is sent every 'heartbeat' seconds, to detect departed clients.
+
+    The generator blocks, so each stream holds its connection (and, for
+    threaded web servers, a thread) open; if 'streams' is supplied, at most
+    that many are allowed at once -- any more are refused with 503 Service
+    Unavailable, and a Retry-After:.  Non-threaded servers should instead use
+    events_subscribe, and write each event_text as it arrives.
+    """
+    queue			= Queue.Queue()
+    pub				= events_subscribe( repository, project, queue, path=path,
+                                            queries=queries, environ=environ,
+                                            framework=framework, headers=headers,
+                                            streams=streams )
+    def stream():
+        try:
+            yield "retry: %d\n\n" % ( pub.interval * 1000 )
+            while True:
+                try:
+                    hexsha, proj = queue.get( timeout=heartbeat )
+                except Queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield event_text( hexsha, proj )
+        finally:
+            pub.unsubscribe( queue )
+
+    return "text/event-stream", stream()
+
+# The publisher of events_request, created on first use
+events_request.publisher	= None
 
 #
 # Web Server
@@ -1285,16 +3429,44 @@ if __name__ == "__main__":
 
     parser.add_argument( '-s', '--server',
                          default="web.py",
-                         help="Webserver framework to use (web.py, itty)" )
+                         help="Webserver framework to use (web.py, itty, asyncore)" )
+    parser.add_argument( '-t', '--threads', type=int, default=4,
+                         help="Worker threads for API requests, for asyncore (default: 4)" )
+    parser.add_argument( '-w', '--workers', type=int, default=0,
+                         help="Pre-forked server processes sharing the port, for asyncore (default: 0)" )
+    parser.add_argument( '--store',
+                         help="Shared results file, for --workers (default: a temporary file)" )
     parser.add_argument( '-a', '--address',
                          default="0.0.0.0:8080",
                          help="Default interface[:port] to bind to (default: all, port 80)" )
     parser.add_argument( '-l', '--log',
                          help="Log file, if desired" )
+    parser.add_argument( '--log-level', default="INFO",
+                         help="Diagnostics logged: DEBUG, INFO, WARNING or ERROR (default: INFO)" )
     parser.add_argument( '-d', '--day',
                          help="Hours in a day (default: %d)" % day_seconds )
     parser.add_argument( '-r', '--redundant', action="store_true",
                          help="If server is already bound to port, fail quietly" )
+    parser.add_argument( '--events', type=int, default=4,
+                         help="Maximum concurrent event streams (default: 4)" )
+    parser.add_argument( '--watch', type=float, default=10.0,
+                         help="Seconds between checks for new commits, for events (default: 10)" )
+    parser.add_argument( '--compute', type=int, default=2,
+                         help="Maximum concurrent project data computations (default: 2)" )
+    parser.add_argument( '--queue', type=int, default=8,
+                         help="Maximum computations waiting, before refusing with 503 (default: 8)" )
+    parser.add_argument( '--stale', type=float, default=0.0,
+                         help="Seconds to serve the prior commit's data, while computing (default: 0)" )
+    parser.add_argument( '--max-age', type=float, default=3600.0,
+                         help="Never serve prior commit's data computed longer ago (default: 3600)" )
+    parser.add_argument( '--server-timing', action="store_true",
+                         help="Add a Server-Timing header to each /api/data response" )
+    parser.add_argument( '--profile', nargs='?', const="", default=profile_request.enabled,
+                         help="Permit local ?profile=cpu|mem requests, saving profiles in any DIR given (default: $ORGSERVER_PROFILE)" )
+    parser.add_argument( '--drain', type=float, default=30.0,
+                         help="Seconds for requests in hand to finish, on SIGHUP reload, for asyncore (default: 30)" )
+    parser.add_argument( '--control',
+                         help="Also serve POST /api/refresh on a Unix domain socket at this path (eg. for Git hooks)" )
     parser.add_argument( '--style',
                          default=None,
                          help="Specify a default style; if None, default is 'effort'" )
@@ -1310,6 +3482,30 @@ if __name__ == "__main__":
     if args.day:
         day_seconds		= int( float( args.day ) * 60 *60 )
 
+    # Diagnostics go wherever sys.stdout goes at the time (eg. the --log file,
+    # once redirected there).  Below --log-level, they cost (almost) nothing.
+    class stdout_handler( logging.StreamHandler ):
+        def emit( self, record ):
+            self.stream		= sys.stdout
+            logging.StreamHandler.emit( self, record )
+    handler			= stdout_handler()
+    handler.setFormatter( logging.Formatter( "%(asctime)s %(levelname)-7s %(message)s" ))
+    for logger in log, logging.getLogger( "asynchttp" ):
+        logger.addHandler( handler )
+        logger.setLevel( getattr( logging, args.log_level.upper() ))
+        logger.propagate	= False
+    events_request.publisher	= publisher( args.repository[0], args.project,
+                                             interval=args.watch )
+    data_request.admission	= admission( limit=args.compute, queue=args.queue )
+    data_request.stale		= args.stale
+    data_request.timing		= args.server_timing
+    data_request.max_age	= args.max_age
+    profile_request.enabled	= args.profile
+    refreshed			= threading.Event()	# Set by each refresh via --control
+    if args.control:
+        control_server( args.control, args.repository[0], args.project,
+                        refreshed=refreshed.set )
+
     # Implement the various Web Servers
     if args.server == "web.py":
         """The web.py webserver.
@@ -1392,6 +3588,10 @@ if __name__ == "__main__":
             "/",				"home",
             "/api/projects(.json)?",		"projects",
             "/api/data/(.*)",			"data",
+            "/api/batch(.json)?",		"batch",
+            "/api/metrics",			"instrumentation",
+            "/api/events/?(.*)",		"events",
+            "/api/refresh",			"refresh",
             "/(.*)",				"html",
         )
 
@@ -1409,7 +3609,7 @@ if __name__ == "__main__":
                 if proxy:
                     proxy	= "http://" + proxy
                 target		= proxy + "/static/burn-down-charts.html"
-                print "Redirect / to %s" % ( target )
+                log.info( "Redirect / to %s", target )
                 web.seeother( target )
 
         class projects:
@@ -1428,11 +3628,15 @@ if __name__ == "__main__":
                 # from the supplied framework to carry a meaningful
                 # HTTP status code.  Otherwise, a generic 500 Server
                 # Error will be produced.
+                headers		= []
                 content, response = projects_request( args.repository[0], args.project,
                                                       queries=queries, environ=environ,
-                                                      accept=accept, framework=web )
+                                                      accept=accept, framework=web,
+                                                      headers=headers )
                 web.header( "Cache-Control", "no-cache" )
                 web.header( "Content-Type", content )
+                for hdr, val in headers:
+                    web.header( hdr, val )
                 return response
 
         class data:
@@ -1443,13 +3647,80 @@ if __name__ == "__main__":
                 if path.endswith( ".json" ):
                     accept	= "application/json"
                     path	= path[:-5] # Clip off .json
+                elif path.endswith( ".bin" ):
+                    accept	= "application/x-msgpack"
+                    path	= path[:-4] # Clip off .bin
 
+                headers		= []
                 content, response = data_request( args.repository[0], args.project, path,
                                                   style=args.style,
                                                   queries=queries, environ=environ,
-                                                  accept=accept, framework=web )
+                                                  accept=accept, framework=web,
+                                                  headers=headers )
+                web.header( "Cache-Control", "no-cache" )
+                web.header( "Content-Type", content )
+                for hdr, val in headers:
+                    web.header( hdr, val )
+                return response
+
+        class batch:
+            def GET( self, path ):
+                environ		= web.ctx.environ
+                queries		= web.input()
+                accept		= None
+                if path and path.endswith( ".json" ):
+                    accept	= "application/json"
+
+                headers		= []
+                content, response = batch_request( args.repository[0], args.project,
+                                                   style=args.style,
+                                                   queries=queries, environ=environ,
+                                                   accept=accept, framework=web,
+                                                   headers=headers )
                 web.header( "Cache-Control", "no-cache" )
                 web.header( "Content-Type", content )
+                for hdr, val in headers:
+                    web.header( hdr, val )
+                return response
+
+        class instrumentation:
+            def GET( self ):
+                headers		= []
+                content, response = metrics_request( environ=web.ctx.environ, framework=web,
+                                                     headers=headers )
+                web.header( "Content-Type", content )
+                for hdr, val in headers:
+                    web.header( hdr, val )
+                return response
+
+        class events:
+            def GET( self, path ):
+                """Each event stream occupies one of the web.py server's
+                threads for as long as the client remains connected, so
+                allow only a limited number at once.
+                """
+                environ		= web.ctx.environ
+                queries		= web.input()
+                headers		= []
+                content, response = events_request( args.repository[0], args.project,
+                                                    path=path, queries=queries,
+                                                    environ=environ, framework=web,
+                                                    headers=headers, streams=args.events )
+                web.header( "Content-Type", content )
+                for hdr, val in headers:
+                    web.header( hdr, val )
+                return response
+
+        class refresh:
+            def POST( self ):
+                headers		= []
+                content, response = refresh_request( args.repository[0], args.project,
+                                                     queries=web.input(),
+                                                     environ=web.ctx.environ, framework=web,
+                                                     headers=headers )
+                web.header( "Content-Type", content )
+                for hdr, val in headers:
+                    web.header( hdr, val )
                 return response
 
         class html:
@@ -1603,6 +3874,9 @@ if __name__ == "__main__":
         """
         import itty
 
+        for status in 304, 400, 406, 503:
+            itty.error( status )( lambda request, exception: itty_error( itty, request, exception ))
+
         #     Instead of just returning the response directly and
         # taking the default headers, encode the supplied
         # Content-Type.
@@ -1617,13 +3891,15 @@ if __name__ == "__main__":
             """
             queries		= request.GET
             environ		= request._environ
+            headers		= []
             content, response	= projects_request( args.repository[0], args.project,
                                                     queries=queries, environ=environ,
-                                                    framework=itty )
+                                                    framework=itty,
+                                                    headers=headers )
             return itty.Response( response, headers=[
                 ("Cache-Control", "no-cache"),
                 ("Content-Type", content)
-            ])
+            ] + headers )
 
         @itty.get( "/api/projects.json" )
         def index( request ):
@@ -1632,15 +3908,338 @@ if __name__ == "__main__":
             """
             queries		= request.GET
             environ		= request._environ
+            headers		= []
             content, response	= projects_request( args.repository[0], args.project,
                                                     queries=queries, environ=environ,
-                                                    accept="application/json", framework=itty )
+                                                    accept="application/json", framework=itty,
+                                                    headers=headers )
+            return itty.Response( response, headers=[
+                ("Cache-Control", "no-cache"),
+                ("Content-Type", content)
+            ] + headers )
+
+        @itty.get( "/api/data/(?P<path>.*)" )
+        def index( request, path ):
+            """
+            Explicit .json (or .bin) forces JSON (or MessagePack); otherwise,
+            responds according to content of Accept: header.
+            """
+            queries		= request.GET
+            environ		= request._environ
+            accept		= None
+            if path.endswith( ".json" ):
+                accept		= "application/json"
+                path		= path[:-5] # Clip off .json
+            elif path.endswith( ".bin" ):
+                accept		= "application/x-msgpack"
+                path		= path[:-4] # Clip off .bin
+            headers		= []
+            content, response	= data_request( args.repository[0], args.project, path,
+                                                style=args.style,
+                                                queries=queries, environ=environ,
+                                                accept=accept, framework=itty,
+                                                headers=headers )
+            return itty.Response( response, headers=[
+                ("Cache-Control", "no-cache"),
+                ("Content-Type", content)
+            ] + headers )
+
+        @itty.get( "/api/batch(?P<path>(.json)?)" )
+        def index( request, path ):
+            queries		= request.GET
+            environ		= request._environ
+            accept		= "application/json" if path else None
+            headers		= []
+            content, response	= batch_request( args.repository[0], args.project,
+                                                 style=args.style,
+                                                 queries=queries, environ=environ,
+                                                 accept=accept, framework=itty,
+                                                 headers=headers )
             return itty.Response( response, headers=[
                 ("Cache-Control", "no-cache"),
                 ("Content-Type", content)
-            ])
+            ] + headers )
+
+        @itty.get( "/api/metrics" )
+        def index( request ):
+            headers		= []
+            content, response	= metrics_request( environ=request._environ, framework=itty,
+                                                   headers=headers )
+            return itty.Response( response, headers=[
+                ("Content-Type", content)
+            ] + headers )
+
+        @itty.post( "/api/refresh" )
+        def index( request ):
+            headers		= []
+            content, response	= refresh_request( args.repository[0], args.project,
+                                                   queries=request.GET, environ=request._environ,
+                                                   framework=itty, headers=headers )
+            return itty.Response( response, headers=[
+                ("Content-Type", content)
+            ] + headers )
 
         itty.run_itty( host=address[0], port=address[1] )
 
+    elif args.server == "asyncore":
+        """The asynchttp webserver.  A single asyncore event loop handles all
+        connections, including idle keep-alive connections and long-lived
+        event streams, without an OS thread each.  The API requests (Git
+        walking, parsing and transforms) are made in a bounded pool of
+        --threads worker threads.  Serves the same URLs as the web.py server,
+        including /static/... files (relative to the current directory).
+        """
+        import asynchttp
+        import mimetypes
+        import signal
+        import tempfile
+        import urlparse
+
+        def application( environ ):
+            method		= environ["REQUEST_METHOD"]
+            path		= environ["PATH_INFO"]
+            queries		= dict( ( k, v[-1] ) for k, v in urlparse.parse_qs(
+                environ["QUERY_STRING"], keep_blank_values=True ).items() )
+            headers		= []
+            if path == "/api/refresh":
+                if method != "POST":
+                    raise asynchttp.HTTPError( 405, "Method not allowed: %s" % ( method ),
+                                               headers=[ ( "Allow", "POST" ) ] )
+                content, response = refresh_request( args.repository[0], args.project,
+                                                     queries=queries, environ=environ,
+                                                     framework=asynchttp, headers=headers )
+                return 200, [ ( "Content-Type", content ) ] + headers, response
+
+            if method not in ( "GET", "HEAD" ):
+                raise asynchttp.HTTPError( 405, "Method not allowed: %s" % ( method ),
+                                           headers=[ ( "Allow", "GET, HEAD" ) ] )
+
+            if path == "/":
+                # Forward to an appropriate start page (see web.py home)
+                proxy		= environ.get( "HTTP_X_FORWARDED_HOST", "" )
+                if proxy:
+                    proxy	= "http://" + proxy
+                raise asynchttp.HTTPError( 303, "", headers=[
+                    ( "Location", proxy + "/static/burn-down-charts.html" ) ] )
+
+            if path.endswith( "/" ):
+                raise asynchttp.HTTPError( 303, "", headers=[ ( "Location", path.rstrip( "/" )) ] )
+
+            if path in ( "/api/projects", "/api/projects.json" ):
+                accept		= "application/json" if path.endswith( ".json" ) else None
+                content, response = projects_request( args.repository[0], args.project,
+                                                      queries=queries, environ=environ,
+                                                      accept=accept, framework=asynchttp,
+                                                      headers=headers )
+                return 200, [ ( "Cache-Control", "no-cache" ),
+                              ( "Content-Type", content ) ] + headers, response
+
+            if path.startswith( "/api/data/" ):
+                path		= path[len( "/api/data/" ):]
+                accept		= None
+                if path.endswith( ".json" ):
+                    accept	= "application/json"
+                    path	= path[:-5] # Clip off .json
+                elif path.endswith( ".bin" ):
+                    accept	= "application/x-msgpack"
+                    path	= path[:-4] # Clip off .bin
+                content, response = data_request( args.repository[0], args.project, path,
+                                                  style=args.style,
+                                                  queries=queries, environ=environ,
+                                                  accept=accept, framework=asynchttp,
+                                                  headers=headers )
+                return 200, [ ( "Cache-Control", "no-cache" ),
+                              ( "Content-Type", content ) ] + headers, response
+
+            if path in ( "/api/batch", "/api/batch.json" ):
+                accept		= "application/json" if path.endswith( ".json" ) else None
+                content, response = batch_request( args.repository[0], args.project,
+                                                   style=args.style,
+                                                   queries=queries, environ=environ,
+                                                   accept=accept, framework=asynchttp,
+                                                   headers=headers )
+                return 200, [ ( "Cache-Control", "no-cache" ),
+                              ( "Content-Type", content ) ] + headers, response
+
+            if path == "/api/metrics":
+                content, response = metrics_request( environ=environ, framework=asynchttp,
+                                                     headers=headers )
+                return 200, [ ( "Content-Type", content ) ] + headers, response
+
+            if path == "/api/events" or path.startswith( "/api/events/" ):
+                # Each event is written to the stream by the publisher's
+                # thread; no thread waits on the (idle) stream.
+                stream		= asynchttp.stream( heartbeat=": heartbeat\n\n" )
+                class subscriber( object ):
+                    def put( self, event ):
+                        stream.write( event_text( *event ))
+                sub		= subscriber()
+                stream.write( "retry: %d\n\n" % ( args.watch * 1000 ))
+                pub		= events_subscribe( args.repository[0], args.project, sub,
+                                                    path=path[len( "/api/events/" ):],
+                                                    queries=queries, environ=environ,
+                                                    framework=asynchttp, headers=headers )
+                stream.closing.append( lambda: pub.unsubscribe( sub ))
+                return 200, [ ( "Content-Type", "text/event-stream" ) ] + headers, stream
+
+            if path.startswith( "/static/" ):
+                final		= os.path.normpath( os.path.join( os.getcwd(), path[1:] ))
+                if not final.startswith( os.path.join( os.getcwd(), "static" ) + os.sep ):
+                    raise asynchttp.HTTPError( 404, "Not found: %s" % ( path ))
+                try:
+                    with open( final, 'rb' ) as f:
+                        response = f.read()
+                except Exception, e:
+                    raise asynchttp.HTTPError( 404, "Not found: %s" % ( path ))
+                content		= mimetypes.guess_type( final )[0] or "application/octet-stream"
+                return 200, [ ( "Content-Type", content ) ], response
+
+            # If an arbitary /*[.html] name is provided, look for a
+            # corresponding .html file in the org directory (and only there).
+            path		= path[1:]
+            if path.endswith( ".html" ):
+                path		= path[:-5] # Clip off .html; it is assumed
+            root		= os.path.abspath( args.repository[0] )
+            final		= os.path.normpath( os.path.join( root, path + ".html" ))
+            if not final.startswith( root + os.sep ):
+                raise asynchttp.HTTPError( 404, "Not found: /%s.html" % ( path ))
+            try:
+                with open( final, 'r' ) as f:
+                    response	= f.read()
+            except Exception, e:
+                raise asynchttp.HTTPError( 404, e.message or str( e ))
+            return 200, [ ( "Content-Type", "text/html" ) ], response
+
+        # On SIGHUP, we reload (see reload_exec): the listening socket is
+        # handed on, with the warm caches, to the new orgserver.py code.  If
+        # we are that successor, restore them.
+        caches			= os.path.join( tempfile.gettempdir(),
+                                                "orgserver-%d.caches" % ( os.getpid() ))
+        inherited		= reload_socket()
+        restore			= os.environ.pop( "ORGSERVER_CACHES", None )
+
+        if args.workers <= 0:
+            try:
+                httpd		= asynchttp.server( address, application, workers=args.threads,
+                                                    sock=inherited )
+            except socket.error:
+                if not args.redundant:
+                    raise
+                sys.exit( 0 )
+            if args.log:
+                sys.stdout	= open( args.log, 'a', 1 )
+                sys.stderr	= sys.stdout
+            if restore:
+                reload_restore( restore, args.repository[0] )
+            # Finish the requests in hand (new connections wait, queued),
+            # then reload
+            signal.signal( signal.SIGHUP, lambda signum, frame: httpd.drain( args.drain ))
+            httpd.serve_forever()
+            if httpd.draining:
+                reload_save( caches )
+                reload_exec( httpd.socket, caches )
+            sys.exit( 0 )
+
+        # Pre-fork --workers server processes, all accepting on the one
+        # listening socket.  This (parent) process computes each new commit's
+        # default responses, and publishes them to a shared (mmap'ed) results
+        # store; each worker serves them straight out of the store, only
+        # computing locally for non-default requests (eg. ?since=...)
+        import mmapstore
+
+        sock			= inherited
+        if sock is None:
+            sock		= socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+            sock.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+            try:
+                sock.bind( address )
+            except socket.error:
+                if not args.redundant:
+                    raise
+                sys.exit( 0 )
+            sock.listen( 1024 )
+        if args.log:
+            sys.stdout		= open( args.log, 'a', 1 )
+            sys.stderr		= sys.stdout
+        if restore:
+            reload_restore( restore, args.repository[0] )
+
+        # A predecessor's results store remains (its PID was ours); the
+        # workers serve it at once, 'til our code has republished it.
+        path			= args.store or os.path.join(
+            tempfile.gettempdir(), "orgserver-%d.results" % ( os.getpid() ))
+        results			= mmapstore.store( path )
+        republish		= bool( restore )
+        if not republish:
+            publish_results( results, args.repository[0], args.project )
+
+        def spawn():
+            pid			= os.fork()
+            if pid:
+                return pid
+            try:
+                signal.signal( signal.SIGTERM, signal.SIG_DFL )
+                signal.signal( signal.SIGINT, signal.SIG_DFL )
+                data_request.store = projects_request.store = results
+                httpd		= asynchttp.server( address, application, workers=args.threads,
+                                                    sock=sock )
+                signal.signal( signal.SIGHUP, lambda signum, frame: httpd.drain( args.drain ))
+                httpd.serve_forever()
+                os._exit( 0 )
+            finally:
+                os._exit( 1 )
+
+        children		= set( spawn() for i in range( args.workers ))
+        def terminate( signum, frame ):
+            raise SystemExit( 0 )
+        signal.signal( signal.SIGTERM, terminate )
+        reloading		= threading.Event()
+        def reload( signum, frame ):
+            reloading.set()
+            refreshed.set()
+        signal.signal( signal.SIGHUP, reload )
+        try:
+            while True:
+                if reloading.is_set():
+                    # The workers finish the requests in hand, while our
+                    # successor (with the same PID) starts new ones
+                    for pid in children:
+                        try:
+                            os.kill( pid, signal.SIGHUP )
+                        except OSError:
+                            pass
+                    reload_save( caches )
+                    reload_exec( sock, caches )
+                try:
+                    if publish_results( results, args.repository[0], args.project,
+                                        force=republish ):
+                        republish = False
+                except Exception, e:
+                    log.warning( "Failed to publish results: %s", e )
+                deadline	= time.time() + args.watch
+                refreshed.clear()
+                while time.time() < deadline and not refreshed.is_set():
+                    try:
+                        pid, status = os.waitpid( -1, os.WNOHANG )
+                    except OSError:
+                        pid	= 0
+                    if pid in children:
+                        log.warning( "Worker %d exited (status %d); restarting", pid, status )
+                        children.remove( pid )
+                        children.add( spawn() )
+                    else:
+                        refreshed.wait( .5 )
+        finally:
+            for pid in children:
+                try:
+                    os.kill( pid, signal.SIGTERM )
+                except OSError:
+                    pass
+            if not args.store:
+                try:
+                    os.unlink( path )
+                except OSError:
+                    pass
+
     else:
         raise Exception("Unknown Web Server framework: %s" % ( args.server ))
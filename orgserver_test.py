@@ -1,10 +1,59 @@
+import gzip
 import json
+import os
 import re
+import StringIO
+import struct
+import subprocess
 import textwrap
+import threading
+import time
+import types
+import zlib
 
 import orgserver
 from mathdict import *
 
+def git_commit( repository, name, content, date ):
+    """Commit the supplied content to <repository>/<name>, on the given date"""
+    with open( os.path.join( repository, name ), 'w' ) as f:
+        f.write( content )
+    environ			= dict( os.environ,
+                                        GIT_AUTHOR_DATE=date + " 12:00",
+                                        GIT_COMMITTER_DATE=date + " 12:00" )
+    for cmd in ( [ "git", "add", name ],
+                 [ "git", "commit", "-q", "-m", "Update %s on %s" % ( name, date ) ] ):
+        subprocess.check_call( cmd, cwd=repository, env=environ )
+
+
+def project_org( date, done ):
+    """A simple project.org file, with 'done' of its 10 hours Effort complete"""
+    return textwrap.dedent( """\
+        * Project
+        #+BEGIN: columnview :hlines 1 :id local
+        | Task                                                   | Effort | CLOCKSUM |
+        |--------------------------------------------------------+--------+----------|
+        | * TODO Project burndown <%(date)s Fri>                 |  10:00 |    %(work)d:00 |
+        | ** DONE Completed work                                 |   %(done)d:00 |    %(work)d:00 |
+        | ** TODO Remaining work                                 |   %(todo)d:00 |          |
+        #+END:
+        """ ) % { "date": date, "done": done, "todo": 10 - done, "work": 8 * done }
+
+
+def make_repo( path, days=5 ):
+    """Create a Git repository at path, containing 'days' of project.org history"""
+    repository			= str( path )
+    subprocess.check_call( [ "git", "init", "-q", repository ] )
+    subprocess.check_call( [ "git", "symbolic-ref", "HEAD", "refs/heads/master" ], cwd=repository )
+    for cmd in ( [ "git", "config", "user.email", "test@example.com" ],
+                 [ "git", "config", "user.name", "Test" ] ):
+        subprocess.check_call( cmd, cwd=repository )
+    for day in range( days ):
+        git_commit( repository, "project.org", project_org(
+            "2012-03-%02d" % ( day + 1 ), day ), "2012-03-%02d" % ( day + 1 ))
+    return repository
+
+
 def test_best_fit():
     x, y, s			= orgserver.best_fit( [(0,0), (1,1), (2,2)] )
     assert abs( y -  0.0 ) < 0.0001
@@ -76,3 +125,949 @@ def test_task_parse():
 
     t1				= orgserver.parse_task_heirarchy( iter( raw.split( "\n" )))
     print t1.display()
+
+
+def test_compression():
+    assert orgserver.deduce_compression( None ) is None
+    assert orgserver.deduce_compression( {} ) is None
+    assert orgserver.deduce_compression( {"HTTP_ACCEPT_ENCODING": "gzip,deflate,sdch"} ) == "gzip"
+    assert orgserver.deduce_compression( {"HTTP_ACCEPT_ENCODING": "deflate, gzip;q=0.5"} ) == "deflate"
+    assert orgserver.deduce_compression( {"HTTP_ACCEPT_ENCODING": "gzip;q=0, identity"} ) is None
+
+    body			= orgserver.json_dumps( {"b": [1, 2], "a": None} )
+    assert body == '{"a":null,"b":[1,2]}'
+    assert "\n" in orgserver.json_dumps( {"b": [1, 2], "a": None}, pretty=True )
+
+    variants			= { None: body * 100 }
+    headers			= []
+    gz				= orgserver.compressed( variants, {"HTTP_ACCEPT_ENCODING": "gzip"},
+                                                    headers=headers )
+    assert ( "Content-Encoding", "gzip" ) in headers
+    assert variants["gzip"] is gz
+    assert gzip.GzipFile( fileobj=StringIO.StringIO( gz )).read() == body * 100
+    # Compressed once; the same bytes are returned thereafter
+    assert orgserver.compressed( variants, {"HTTP_ACCEPT_ENCODING": "gzip"} ) is gz
+    df				= orgserver.compressed( variants, {"HTTP_ACCEPT_ENCODING": "deflate"} )
+    assert zlib.decompress( df ) == body * 100
+    assert orgserver.compressed( variants, None ) == body * 100
+
+    assert orgserver.query_flag( {"pretty": "1"}, "pretty" )
+    assert orgserver.query_flag( {"linear": ""}, "linear" )
+    assert not orgserver.query_flag( {"pretty": "0"}, "pretty" )
+    assert not orgserver.query_flag( None, "pretty" )
+
+
+def test_msgpack_columnar():
+    assert orgserver.msgpack_dumps( None ) == "\xc0"
+    assert orgserver.msgpack_dumps( [1, -1, True] ) == "\x93\x01\xff\xc3"
+    assert orgserver.msgpack_dumps( {"a": u"b"} ) == "\x81\xa1a\xa1b"
+    assert orgserver.msgpack_dumps( bytearray( "\x00\x01" )) == "\xc4\x02\x00\x01"
+    assert orgserver.msgpack_dumps( 1.5 ) == "\xcb" + struct.pack( ">d", 1.5 )
+    assert orgserver.msgpack_dumps( 2**40 ) == "\xcf" + struct.pack( ">Q", 2**40 )
+
+    results			= {
+        "project":	"project",
+        "style":	"effort",
+        "list": [
+            { "label": "Day 1", "date": "2012-03-01", "date#": 1330560000.0,
+              "blob": "01ab", "sprint": 0, "lines": None,
+              "estimated": { "todoTotal": "2:00", "todoTotal#": 7200 },
+              "work": { "todoTotal": "1:00", "todoTotal#": 3600 }},
+            { "label": "Day 2", "date": None, "date#": 1330646400.0,
+              "blob": None, "sprint": 0, "finish": "2012-03-02 (Day 2)",
+              "lines": { "progress": { "x1": 0, "y1": 7200, "x2": 1, "y2": 0 }},
+              "estimated": None, "work": None },
+        ]
+    }
+    cols			= orgserver.columnar( results )
+    assert cols["count"] == 2
+    assert struct.unpack( "<2q", str( cols["columns"]["estimated.todoTotal#"] )) == ( 7200, 0 )
+    assert struct.unpack( "<2d", str( cols["columns"]["date#"] ))[1] == 1330646400.0
+    assert str( cols["valid"] ) == "\x01\x00"
+    assert cols["lines"] == [ None, { "progress": [ 0, 7200, 1, 0 ] } ]
+    assert cols["finish"] == [ None, "2012-03-02 (Day 2)" ]
+    assert "estimated.todoTotal" not in cols["columns"]
+    orgserver.msgpack_dumps( cols )
+
+
+def test_etag( tmpdir ):
+    repository			= make_repo( tmpdir, days=3 )
+    headers			= []
+    accept, response		= orgserver.data_request(
+        repository, [ "project" ], "project/elapsed", queries={}, environ={}, headers=headers )
+    etag			= dict( headers )["ETag"]
+    assert json.loads( response )["project"] == "project"
+
+    # Revalidation with the current ETag yields 304 Not Modified
+    try:
+        orgserver.data_request(
+            repository, [ "project" ], "project/elapsed", queries={},
+            environ={ "HTTP_IF_NONE_MATCH": 'W/"abc", ' + etag } )
+        assert False, "Expected 304 Not Modified"
+    except Exception, e:
+        assert str( e ).startswith( "304" )
+
+    # Different options, or a new commit, produce a different ETag
+    headers			= []
+    orgserver.data_request(
+        repository, [ "project" ], "project/elapsed", queries={ "pretty": "1" },
+        environ={ "HTTP_IF_NONE_MATCH": etag }, headers=headers )
+    assert dict( headers )["ETag"] != etag
+    git_commit( repository, "project.org", project_org( "2012-03-04", 5 ), "2012-03-04" )
+    headers			= []
+    orgserver.data_request(
+        repository, [ "project" ], "project/elapsed", queries={},
+        environ={ "HTTP_IF_NONE_MATCH": etag }, headers=headers )
+    assert dict( headers )["ETag"] != etag
+
+
+def test_itty_errors( tmpdir ):
+    # A stand-in for the itty module: its errors, and a Response recording its send
+    itty			= types.ModuleType( "itty" )
+    class RequestError( Exception ):
+        status			= 404
+        def __init__( self, message, hide_traceback=False ):
+            Exception.__init__( self, message )
+    class Response( object ):
+        def __init__( self, output, headers=None, status=200, content_type="text/html" ):
+            self.output, self.headers, self.status = output, headers, status
+        def send( self, start_response ):
+            start_response( self.status, self.headers )
+            return self.output
+    itty.RequestError		= RequestError
+    itty.NotFound		= itty.Forbidden = RequestError
+    itty.Response		= Response
+    class request( object ):
+        @staticmethod
+        def _start_response( status, headers ):
+            sent.append( ( status, headers ))
+
+    # The ETag of a 304, and the Retry-After of a 503, reach the response
+    repository			= make_repo( tmpdir, days=3 )
+    headers			= []
+    orgserver.data_request( repository, [ "project" ], "project/elapsed", queries={},
+                            environ={}, headers=headers )
+    etag			= dict( headers )["ETag"]
+    for status, exception in (
+            ( 304, lambda: orgserver.data_request(
+                repository, [ "project" ], "project/elapsed", queries={}, framework=itty,
+                environ={ "HTTP_IF_NONE_MATCH": etag } )),
+            ( 503, lambda: orgserver.data_request(
+                repository, [ "project" ], "project/effort", queries={}, framework=itty,
+                environ={} ))):
+        admission		= orgserver.data_request.admission
+        orgserver.data_request.admission = orgserver.admission( limit=0, queue=0, retry=7 )
+        try:
+            exception()
+            assert False, "Expected %d" % status
+        except RequestError, e:
+            sent		= []
+            body		= orgserver.itty_error( itty, request, e )
+        finally:
+            orgserver.data_request.admission = admission
+        assert sent[0][0] == status
+        if status == 304:
+            assert sent[0][1] == [ ( "ETag", etag ) ] and body == ""
+        else:
+            assert sent[0][1] == [ ( "Retry-After", "7" ) ] and body.startswith( "Too busy" )
+
+
+def test_since( tmpdir ):
+    repository			= make_repo( tmpdir, days=4 )
+    old				= {}
+    for style in "elapsed", "effort":
+        accept, response	= orgserver.data_request(
+            repository, [ "project" ], "project/" + style, queries={}, environ={} )
+        old[style]		= json.loads( response )
+
+    for day in 5, 6, 7:
+        git_commit( repository, "project.org", project_org( "2012-03-%02d" % day, day ),
+                    "2012-03-%02d" % day )
+
+    for style in "elapsed", "effort":
+        accept, response	= orgserver.data_request(
+            repository, [ "project" ], "project/" + style, queries={}, environ={} )
+        new			= json.loads( response )
+        last			= [ rec for rec in old[style]["list"] if rec["blob"] ][-1]
+        for since in last["blob"], last["date"]:
+            accept, response	= orgserver.data_request(
+                repository, [ "project" ], "project/" + style,
+                queries={ "since": since }, environ={} )
+            delta		= json.loads( response )
+            first		= delta["list"][0]
+            assert delta["since"] == ( first["blob"] or first["date"] )
+            assert 0 < delta["offset"] < len( new["list"] )
+            assert len( delta["list"] ) < len( new["list"] )
+            merged		= old[style]["list"][:delta["offset"]] + delta["list"]
+            assert merged == new["list"]
+
+    # An unknown 'since' returns everything
+    accept, response		= orgserver.data_request(
+        repository, [ "project" ], "project/elapsed", queries={ "since": "1999-01-01" },
+        environ={} )
+    assert json.loads( response )["offset"] == 0
+    assert json.loads( response )["since"] is None
+
+    # Queries resolving to the same record share one cached response
+    last			= [ rec for rec in new["list"] if rec["blob"] ][-1]
+    before			= len( orgserver.data_request.responses )
+    for since in last["blob"], last["blob"][:7], last["blob"][:12]:
+        orgserver.data_request( repository, [ "project" ], "project/elapsed",
+                                queries={ "since": since }, environ={} )
+    assert len( orgserver.data_request.responses ) == before + 1
+
+    # Anything but a date or hexsha is refused
+    for since in "yesterday", "abc", "2012-3-5":
+        try:
+            orgserver.data_request( repository, [ "project" ], "project/elapsed",
+                                    queries={ "since": since }, environ={} )
+            assert False, "Expected 400 Bad Request"
+        except Exception, e:
+            assert str( e ).startswith( "400" )
+
+    # Only the most recently used responses are retained
+    limit			= orgserver.data_request.responses_limit
+    evictions			= orgserver.metric_evictions.value( layer="responses" )
+    orgserver.data_request.responses_limit = 2
+    try:
+        for queries in {}, { "linear": "1" }, { "pretty": "1" }:
+            orgserver.data_request( repository, [ "project" ], "project/elapsed",
+                                    queries=queries, environ={} )
+        responses		= orgserver.data_request.responses
+        assert [ k[2:4] for k in responses ] == [ ( False, False ), ( True, True ) ]
+        assert orgserver.metric_evictions.value( layer="responses" ) > evictions
+    finally:
+        orgserver.data_request.responses_limit = limit
+
+
+def test_events( tmpdir ):
+    repository			= make_repo( tmpdir, days=3 )
+    pub				= orgserver.publisher( repository, [ "project" ] )
+    pub.thread			= True	# Don't start the watcher; we'll poll()
+    queue			= pub.subscribe( [ "project" ] )
+    other			= pub.subscribe( [ "another" ] )
+    pub.poll()
+    assert queue.empty()
+    git_commit( repository, "project.org", project_org( "2012-03-04", 5 ), "2012-03-04" )
+    pub.poll()
+    hexsha, proj		= queue.get_nowait()
+    assert proj == "project" and hexsha == orgserver.repository_head( repository )
+    assert other.empty()
+
+    # A failure to compute is retried at the next poll; "master" isn't done
+    # with 'til the event has been published (just once)
+    original			= orgserver.project_stats_transform
+    def project_stats_transform( *args, **kwds ):
+        raise Exception( "Transform failed" )
+    git_commit( repository, "project.org", project_org( "2012-03-05", 6 ), "2012-03-05" )
+    orgserver.project_stats_transform = project_stats_transform
+    try:
+        pub.poll()
+    finally:
+        orgserver.project_stats_transform = original
+    assert queue.empty() and pub.hexsha == hexsha
+    pub.poll()
+    hexsha, proj		= queue.get_nowait()
+    assert proj == "project" and hexsha == orgserver.repository_head( repository )
+    assert pub.hexsha == hexsha
+    pub.poll()
+    assert queue.empty()
+
+    pub.unsubscribe( queue )
+    pub.unsubscribe( other )
+    assert pub.active() == 0
+
+    # A reconnecting client with a stale Last-Event-ID is immediately updated
+    orgserver.events_request.publisher = pub
+    try:
+        content, stream		= orgserver.events_request(
+            repository, [ "project" ], path="project",
+            environ={ "HTTP_LAST_EVENT_ID": "0" * 40 }, heartbeat=0.01 )
+        assert content == "text/event-stream"
+        assert next( stream ).startswith( "retry: " )
+        event			= next( stream )
+        assert event.startswith( "id: %s\nevent: update\ndata: " % hexsha )
+        assert next( stream ) == ": heartbeat\n\n"
+        assert pub.active() == 1
+        stream.close()
+        assert pub.active() == 0
+
+        try:
+            orgserver.events_request( repository, [ "project" ], path="unknown" )
+            assert False, "Expected 404 Not Found"
+        except Exception, e:
+            assert str( e ).startswith( "404" )
+
+        # Beyond the (threaded server's) limit, streams are refused 'til later
+        content, stream		= orgserver.events_request( repository, [ "project" ], streams=1 )
+        try:
+            orgserver.events_request( repository, [ "project" ], streams=1 )
+            assert False, "Expected 503 Service Unavailable"
+        except Exception, e:
+            assert str( e ).startswith( "503" )
+        next( stream )
+        stream.close()
+        assert pub.active() == 0
+    finally:
+        orgserver.events_request.publisher = None
+
+
+def test_publish_results( tmpdir ):
+    import mmapstore
+    repository			= make_repo( tmpdir, days=3 )
+    results			= mmapstore.store( str( tmpdir.join( "results" )))
+
+    # If any response fails to compute, nothing is published
+    original			= orgserver.project_stats_transform
+    def project_stats_transform( results, style, bestfit=True ):
+        if style == "elapsed":
+            raise Exception( "Transform failed" )
+        return original( results, style, bestfit=bestfit )
+    orgserver.project_stats_transform = project_stats_transform
+    try:
+        assert orgserver.publish_results( results, repository, [ "project" ] ) is None
+    finally:
+        orgserver.project_stats_transform = original
+    assert results.meta().get( "hexsha" ) is None
+
+    head			= orgserver.publish_results( results, repository, [ "project" ] )
+    assert head == results.meta()["hexsha"] == orgserver.repository_head( repository )
+
+    # Published responses are served from the store, identical to those computed
+    accept, computed		= orgserver.data_request(
+        repository, [ "project" ], "project/effort", queries={},
+        environ={ "HTTP_ACCEPT_ENCODING": "gzip" } )
+    orgserver.data_request.store = results
+    try:
+        orgserver.data_request.cache = None	# Would fail, if consulted
+        headers			= []
+        accept, stored		= orgserver.data_request(
+            repository, [ "project" ], "project/effort", queries={},
+            environ={ "HTTP_ACCEPT_ENCODING": "gzip" }, headers=headers )
+        assert isinstance( stored, buffer )
+        assert str( stored ) == computed
+        assert ( "Content-Encoding", "gzip" ) in headers
+        assert "ETag" in dict( headers )
+    finally:
+        orgserver.data_request.store = None
+        orgserver.data_request.hexsha = None
+
+
+def test_concurrent( tmpdir ):
+    repository			= make_repo( tmpdir, days=4 )
+    parsed			= []
+    original			= orgserver.project_data_parse
+    def project_data_parse( data, project ):
+        parsed.append( project )
+        time.sleep( .2 )	# Ensure that the others arrive while we're busy
+        return original( data, project )
+    project_data_parse.cache	= original.cache
+
+    # Many simultaneous requests for the same cold data do the work once
+    start			= threading.Event()
+    responses			= []
+    def request( style ):
+        start.wait()
+        responses.append( orgserver.data_request(
+            repository, [ "project" ], "project/" + style, queries={},
+            environ={ "HTTP_ACCEPT_ENCODING": "gzip" } ))
+    threads			= [ threading.Thread( target=request, args=( style, ))
+                                    for style in [ "elapsed", "effort" ] * 10 ]
+    orgserver.project_data_parse = project_data_parse
+    try:
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+    finally:
+        orgserver.project_data_parse = original
+    assert parsed == [ "project" ]
+    assert len( responses ) == 20
+    for style in "elapsed", "effort":
+        accept, response	= orgserver.data_request(
+            repository, [ "project" ], "project/" + style, queries={},
+            environ={ "HTTP_ACCEPT_ENCODING": "gzip" } )
+        assert responses.count( ( accept, response )) == 10
+
+    # An exception is shared by all the waiters, and nothing is retained
+    flights			= orgserver.single_flight()
+    def fail():
+        time.sleep( .2 )
+        raise ValueError( "failed" )
+    failures			= []
+    def call():
+        try:
+            flights( "key", fail )
+        except ValueError, e:
+            failures.append( e )
+    threads			= [ threading.Thread( target=call ) for i in range( 5 ) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len( failures ) == 5 and len( set( map( id, failures ))) == 1
+    assert not flights.flights
+
+
+def test_stale( tmpdir ):
+    repository			= make_repo( tmpdir, days=3 )
+    old				= orgserver.repository_head( repository )
+    def request( **kwds ):
+        headers			= []
+        accept, response	= orgserver.data_request(
+            repository, [ "project" ], "project/elapsed", queries={}, environ={},
+            headers=headers, **kwds )
+        return dict( headers ), response
+    headers, before		= request( stale=0 )
+    assert "X-Stale" not in headers
+
+    # After master advances, the prior response is served while it's recomputed
+    git_commit( repository, "project.org", project_org( "2012-03-04", 5 ), "2012-03-04" )
+    headers, response		= request( stale=30 )
+    assert headers["X-Stale"] == old
+    assert response == before
+    for i in range( 50 ):
+        headers, response	= request( stale=30 )
+        if "X-Stale" not in headers:
+            break
+        time.sleep( .1 )
+    assert "X-Stale" not in headers
+    assert response != before
+
+    # Beyond the maximum age, the request waits for the new response
+    git_commit( repository, "project.org", project_org( "2012-03-05", 6 ), "2012-03-05" )
+    max_age			= orgserver.data_request.max_age
+    orgserver.data_request.max_age = 0
+    try:
+        headers, later		= request( stale=30 )
+    finally:
+        orgserver.data_request.max_age = max_age
+    assert "X-Stale" not in headers
+    assert later != response
+
+
+def test_admission( tmpdir ):
+    repository			= make_repo( tmpdir, days=3 )
+    def request( style ):
+        return orgserver.data_request(
+            repository, [ "project" ], "project/" + style, queries={}, environ={} )
+    accept, elapsed		= request( "elapsed" )
+
+    # While one computation runs, no others are admitted; a rendered response is
+    original			= orgserver.project_stats_transform
+    running, proceed		= threading.Event(), threading.Event()
+    def project_stats_transform( *args, **kwds ):
+        running.set()
+        proceed.wait()
+        return original( *args, **kwds )
+    admission			= orgserver.data_request.admission
+    orgserver.data_request.admission = orgserver.admission( limit=1, queue=0, retry=7 )
+    orgserver.project_stats_transform = project_stats_transform
+    try:
+        thread			= threading.Thread( target=request, args=( "effort", ))
+        thread.start()
+        assert running.wait( 5 )
+        try:
+            request( "sprint" )
+            assert False, "Expected 503 Service Unavailable"
+        except Exception, e:
+            assert str( e ).startswith( "503" )
+        assert request( "elapsed" ) == ( accept, elapsed )
+
+        # A JSONP request wraps the rendered JSON; it needn't be admitted
+        hits			= orgserver.metric_hits.value( layer="responses" )
+        assert orgserver.data_request(
+            repository, [ "project" ], "project/elapsed", queries={ "callback": "cb" },
+            environ={} ) == ( accept, "cb( " + elapsed + " )" )
+        assert orgserver.metric_hits.value( layer="responses" ) == hits + 1
+    finally:
+        proceed.set()
+        thread.join()
+        orgserver.project_stats_transform = original
+        orgserver.data_request.admission = admission
+
+    # A queued computation waits for its turn, or times out
+    admission			= orgserver.admission( limit=1, queue=1, timeout=0.1 )
+    assert admission.acquire()
+    assert not admission.acquire()
+    admission.release()
+    assert admission.acquire()
+
+
+def test_batch( tmpdir ):
+    repository			= make_repo( tmpdir, days=4 )
+    for day, done in ( 3, 1 ), ( 5, 2 ):
+        date			= "2012-03-%02d" % day
+        git_commit( repository, "another.org", project_org( date, done ), date )
+    projects			= [ "project", "another" ]
+
+    # The portfolio sums each project's latest data on each date
+    stats			= [ orgserver.project_results( repository, proj )[1]
+                                    for proj in projects ]
+    portfolio			= orgserver.portfolio_stats( stats )
+    assert [ rec["date"] for rec in portfolio["list"] ] == [
+        "2012-03-%02d" % day for day in 1, 2, 3, 4, 5 ]
+    hours			= lambda rec, d: rec["estimated"][d + "#"] / 3600
+    assert [ hours( rec, "todoTotal" ) for rec in portfolio["list"] ] == [ 10, 9, 17, 16, 15 ]
+    assert [ hours( rec, "done" ) for rec in portfolio["list"] ] == [ 0, 1, 1, 1, 1 ]
+    assert portfolio["list"][2]["estimated"]["todoTotal"] == "17:00"
+
+    # A batch returns each project's data as data_request does, and the portfolio
+    headers			= []
+    accept, response		= orgserver.batch_request(
+        repository, projects, queries={ "projects": "another,project", "style": "elapsed" },
+        environ={}, headers=headers )
+    content			= json.loads( response )
+    assert content["style"] == "elapsed"
+    for proj in projects:
+        accept, single		= orgserver.data_request(
+            repository, projects, proj + "/elapsed", queries={}, environ={} )
+        assert content["projects"][proj] == json.loads( single )
+    assert content["portfolio"]["project"] == "portfolio"
+    assert content["portfolio"]["projects"] == [ "another", "project" ]
+    assert content["portfolio"]["list"][4]["lines"]["progress"]
+
+    try:
+        orgserver.batch_request(
+            repository, projects, queries={ "projects": "project,unknown" }, environ={} )
+        assert False, "Expected 404 Not Found"
+    except Exception, e:
+        assert str( e ).startswith( "404" )
+
+    # A project whose results fail gets an error in its place; if all do, 404
+    original			= orgserver.project_stats_transform
+    def project_stats_transform( results, style, bestfit=True ):
+        if results["project"] == "another":
+            raise Exception( "Transform failed" )
+        return original( results, style, bestfit=bestfit )
+    orgserver.project_stats_transform = project_stats_transform
+    try:
+        accept, response	= orgserver.batch_request(
+            repository, projects, queries={ "linear": "1" }, environ={} )
+    finally:
+        orgserver.project_stats_transform = original
+    content			= json.loads( response )
+    assert content["projects"]["another"] == { "project": "another", "error": "Transform failed" }
+    assert content["projects"]["project"]["list"]
+    assert content["portfolio"]["projects"] == [ "project" ]
+    try:
+        orgserver.batch_request(
+            repository, projects, queries={ "style": "sprint" }, environ={} )
+        assert False, "Expected 404 Not Found"
+    except Exception, e:
+        assert str( e ).startswith( "404" )
+
+
+def test_asof( tmpdir ):
+    repository			= make_repo( tmpdir, days=3 )
+    commit			= orgserver.repository_head( repository )
+    accept, before		= orgserver.data_request(
+        repository, [ "project" ], "project/elapsed", queries={}, environ={} )
+    before			= json.loads( before )
+    last			= [ rec for rec in before["list"] if rec["blob"] ][-1]
+    for day in 4, 5:
+        date			= "2012-03-%02d" % day
+        git_commit( repository, "project.org", project_org( date, day ), date )
+
+    # The data as of a prior commit, blob or date is as it was then
+    parsed			= []
+    original			= orgserver.project_data_parse
+    def project_data_parse( data, project ):
+        parsed.append( project )
+        return original( data, project )
+    project_data_parse.cache	= original.cache
+    orgserver.project_data_parse = project_data_parse
+    try:
+        accept, response	= orgserver.data_request(
+            repository, [ "project" ], "project/elapsed", queries={}, environ={} )
+        assert parsed == [ "project" ]
+        for asof in commit, before["list"][2]["blob"][:7], "2012-03-03":
+            accept, response	= orgserver.data_request(
+                repository, [ "project" ], "project/elapsed", queries={ "asof": asof },
+                environ={} )
+            response		= json.loads( response )
+            assert response.pop( "asof" ) == last["blob"]
+            assert response == before
+        assert parsed == [ "project" ]
+        # ... and each, resolving to the same records, shares one response
+        assert len( [ k for k in orgserver.data_request.responses if k[6] ] ) == 1
+    finally:
+        orgserver.project_data_parse = original
+
+    # Each distinct prefix is transformed once
+    assert len( [ k for k in orgserver.data_request.transforms if len( k ) == 4 ] ) == 1
+    try:
+        orgserver.data_request(
+            repository, [ "project" ], "project/elapsed", queries={ "asof": "2012-02-01" },
+            environ={} )
+        assert False, "Expected 404 Not Found"
+    except Exception, e:
+        assert str( e ).startswith( "404" )
+
+
+def test_metrics( tmpdir ):
+    repository			= make_repo( tmpdir, days=3 )
+    def value( metric, **labels ):
+        return metric.value( **labels )
+    misses			= value( orgserver.metric_misses, layer="responses" )
+    hits			= value( orgserver.metric_hits, layer="responses" )
+    for i in range( 2 ):
+        orgserver.data_request( repository, [ "project" ], "project/effort",
+                                queries={}, environ={} )
+    assert value( orgserver.metric_misses, layer="responses" ) == misses + 1
+    assert value( orgserver.metric_hits, layer="responses" ) == hits + 1
+    assert value( orgserver.metric_requests, endpoint="data", status=200 ) >= 2
+    try:
+        orgserver.data_request( repository, [ "project" ], "unknown/effort",
+                                queries={}, environ={} )
+    except Exception, e:
+        pass
+    assert value( orgserver.metric_requests, endpoint="data", status=404 ) >= 1
+
+    headers			= []
+    content, text		= orgserver.metrics_request( environ={}, headers=headers )
+    assert content.startswith( "text/plain" )
+    for stage in "walk", "parse", "stats", "transform", "serialize":
+        assert 'orgserver_stage_seconds_count{stage="%s"}' % stage in text
+    assert re.search( r'^orgserver_cache_bytes{layer="stats"} [1-9][0-9]*$', text, re.M )
+    assert re.search( r'^orgserver_git_commits_total [1-9][0-9]*$', text, re.M )
+
+
+def test_server_timing( tmpdir ):
+    repository			= make_repo( tmpdir, days=3 )
+    def request( path ):
+        headers			= []
+        orgserver.data_request( repository, [ "project" ], path, queries={},
+                                environ={}, headers=headers )
+        return dict( headers ).get( "Server-Timing" )
+    assert request( "project/effort" ) is None
+
+    orgserver.data_request.timing = True
+    try:
+        cold			= request( "project/elapsed" )
+        warm			= request( "project/elapsed" )
+    finally:
+        orgserver.data_request.timing = False
+    phases			= re.findall( r'(\w+);dur=[0-9.]+(?:;desc="(\w+)")?', cold )
+    assert phases == [ ( "git", "hit" ), ( "parse", "hit" ), ( "stats", "hit" ),
+                       ( "transform", "miss" ), ( "encode", "miss" ), ( "total", "" ) ]
+    phases			= re.findall( r'(\w+);dur=[0-9.]+(?:;desc="(\w+)")?', warm )
+    assert [ desc for phase, desc in phases ] == [ "hit" ] * 5 + [ "" ]
+    assert orgserver.timing.phases is None
+
+
+def test_profile( tmpdir ):
+    repository			= make_repo( tmpdir, days=3 )
+    local			= { "REMOTE_ADDR": "127.0.0.1" }
+    def request( kind, environ=local, path="project/effort" ):
+        return orgserver.data_request( repository, [ "project" ], path, queries={ "profile": kind },
+                                       environ=environ, headers=[] )
+    enabled			= orgserver.profile_request.enabled
+    orgserver.profile_request.enabled = None
+    try:
+        try:
+            request( "cpu" )
+            assert False, "Profiling should be disabled"
+        except Exception, e:
+            assert str( e ).startswith( "403 " )
+
+        orgserver.profile_request.enabled = str( tmpdir )
+        for environ in ( {}, { "REMOTE_ADDR": "10.0.0.1" },
+                         dict( local, HTTP_X_FORWARDED_FOR="10.0.0.1" )):
+            try:
+                request( "cpu", environ=environ )
+                assert False, "Profiling should be refused for %r" % ( environ )
+            except Exception, e:
+                assert str( e ).startswith( "403 " )
+
+        # The profiled request does all its work, though its response is cached
+        orgserver.data_request( repository, [ "project" ], "project/effort",
+                                queries={}, environ={} )
+        content, summary	= request( "cpu" )
+        assert content == "text/plain"
+        assert summary.startswith( "Profile (cpu) of data_request" )
+        saved			= [ f for f in os.listdir( str( tmpdir )) if f.endswith( ".pstats" ) ]
+        assert saved
+        import pstats
+        functions		= set( name for _, _, name in pstats.Stats(
+            os.path.join( str( tmpdir ), saved[0] )).stats )
+        assert "project_data_parse" in functions and "project_stats_transform" in functions
+
+        content, summary	= request( "mem" )
+        assert summary.startswith( "Profile (mem) of data_request" )
+        try:
+            request( "disk" )
+            assert False, "Unknown profile should be refused"
+        except Exception, e:
+            assert str( e ) == "400 Unknown profile: disk (valid: cpu, mem)"
+        content, summary	= orgserver.projects_request(
+            repository, [ "project" ], queries={ "profile": "cpu" }, environ=local )
+        assert summary.startswith( "Profile (cpu) of projects_request" )
+        assert "project_data_walk" in summary
+
+        # The profiled (inner) request leaves the outer one's Server-Timing
+        orgserver.data_request.timing = True
+        headers			= []
+        content, summary	= orgserver.data_request(
+            repository, [ "project" ], "project/effort", queries={ "profile": "cpu" },
+            environ=local, headers=headers )
+        assert summary.startswith( "Profile (cpu) of data_request" )
+        assert "total;dur=" in dict( headers )["Server-Timing"]
+        assert orgserver.timing.phases is None
+    finally:
+        orgserver.profile_request.enabled = enabled
+        orgserver.data_request.timing = False
+    assert not orgserver.uncached()
+
+
+def plans_org( date, alpha, beta ):
+    """A plans.org file containing two projects' tables, named by heading and :id"""
+    return textwrap.dedent( """\
+        * Project Alpha                                                       :work:
+        #+BEGIN: columnview :hlines 1 :id local
+        | Task                                                   | Effort | CLOCKSUM |
+        |--------------------------------------------------------+--------+----------|
+        | * TODO Alpha <%(date)s Fri>                            |  10:00 |          |
+        | ** DONE Completed work                                 |   %(alpha)d:00 |          |
+        | ** TODO Remaining work                                 |   %(alphatodo)d:00 |          |
+        #+END:
+        * Project Beta
+          :PROPERTIES:
+          :ID:       beta
+          :END:
+        #+BEGIN: columnview :hlines 1 :id beta
+        | Task                                                   | Effort |
+        |--------------------------------------------------------+--------|
+        | * TODO Beta <%(date)s Fri>                             |  20:00 |
+        | ** DONE Completed work                                 |   %(beta)d:00 |
+        | ** TODO Remaining work                                 |   %(betatodo)d:00 |
+        #+END:
+        """ ) % { "date": date, "alpha": alpha, "alphatodo": 10 - alpha,
+                  "beta": beta, "betatodo": 20 - beta }
+
+
+def test_tables( tmpdir ):
+    assert orgserver.project_name( "plans" ) == ( "plans", None )
+    assert orgserver.project_name( "plans:beta" ) == ( "plans", "beta" )
+    assert orgserver.table_name( "#+BEGIN: columnview :id local", "Project Alpha  :work:" ) \
+        == "project-alpha"
+    assert orgserver.table_name( "#+BEGIN: columnview :id beta", "Other" ) == "beta"
+    assert orgserver.table_name( "#+BEGIN: columnview :id file:x.org", None ) is None
+
+    repository			= make_repo( tmpdir, days=1 )
+    for day in range( 3 ):
+        date			= "2012-03-%02d" % ( day + 2 )
+        git_commit( repository, "plans.org", plans_org( date, day, 2 * day ), date )
+
+    projects			= [ "project", "plans", "plans:project-alpha", "plans:beta",
+                                    "plans:missing" ]
+    hexsha, data		= orgserver.project_data( repository, projects )
+    assert len( data["plans:beta"] ) == 3
+
+    cache			= orgserver.project_data_parse.cache
+    original			= dict( cache )
+    cache.clear()
+    try:
+        beta			= orgserver.project_data_parse( data, "plans:beta" )
+        # Each blob was read and scanned once, caching both its tables
+        blobs			= set( b.hexsha for b in data["plans"] )
+        assert set( cache ) == set( ( b, t ) for b in blobs
+                                    for t in ( None, "project-alpha", "beta" ))
+        alpha			= orgserver.project_data_parse( data, "plans:project-alpha" )
+        first			= orgserver.project_data_parse( data, "plans" )
+        assert first["list"] == alpha["list"]
+        assert [ rec["estimated"]["doneTotal"] for rec in alpha["list"] ] == [
+            "0:00", "1:00", "2:00" ]
+        assert [ rec["estimated"]["doneTotal"] for rec in beta["list"] ] == [
+            "0:00", "2:00", "4:00" ]
+        assert "work" not in beta["list"][-1]		# Beta has no CLOCKSUM column
+        assert orgserver.project_data_parse( data, "plans:missing" )["list"] == []
+        assert orgserver.project_data_parse( data, "project" )["list"]
+    finally:
+        cache.clear()
+        cache.update( original )
+
+
+def test_working( tmpdir ):
+    repository			= make_repo( tmpdir, days=3 )
+    def request( **queries ):
+        headers			= []
+        accept, response	= orgserver.data_request(
+            repository, [ "project" ], "project/effort", queries=queries, environ={},
+            headers=headers )
+        return json.loads( response ), dict( headers )["ETag"]
+    def records( working=True ):
+        return orgserver.project_results( repository, "project", working=working )[1]
+
+    committed, etag		= request()
+    same, etag_same		= request( working="1" )
+    assert "working" not in same			# Working file is as committed
+    assert same == committed
+    assert records() == records( working=False )
+
+    # An uncommitted edit on a new day appends a provisional record
+    path			= os.path.join( repository, "project.org" )
+    with open( path, 'w' ) as f:
+        f.write( project_org( "2012-03-04", 5 ))
+    edited, etag_edited		= request( working="1" )
+    stats			= records()
+    assert edited["working"] == stats["working"] == stats["list"][-1]["blob"]
+    assert stats["list"][:-1] == records( working=False )["list"]
+    assert stats["list"][-1]["date"] == "2012-03-04"
+    assert stats["list"][-1]["estimated"]["doneTotal"] == "5:00"
+    assert stats["list"][-1]["estimated"]["done"] == "3:00"	# vs. the last committed
+    assert etag_edited != etag_same
+    assert request()[0] == committed			# Without ?working, unchanged
+
+    # Unchanged, it isn't reparsed; an edit on the last committed day replaces it
+    hits			= orgserver.metric_hits.value( layer="working" )
+    assert request( working="1" )[0] == edited
+    assert orgserver.metric_hits.value( layer="working" ) == hits + 1
+    with open( path, 'w' ) as f:
+        f.write( project_org( "2012-03-03", 7 ) + "\n" )
+    stats			= records()
+    assert len( stats["list"] ) == 3
+    assert stats["list"][-1]["blob"] == stats["working"]
+    assert stats["list"][-1]["estimated"]["done"] == "6:00"	# vs. 2012-03-02's
+
+    # Once committed, the working copy is the last committed record
+    git_commit( repository, "project.org", project_org( "2012-03-03", 7 ) + "\n", "2012-03-03" )
+    assert "working" not in request( working="1" )[0]
+    assert records() == records( working=False )
+
+
+def test_refresh( tmpdir ):
+    origin			= make_repo( tmpdir.join( "origin" ), days=3 )
+    repository			= str( tmpdir.join( "clone" ))
+    subprocess.check_call( [ "git", "clone", "-q", origin, repository ] )
+    for cmd in ( [ "git", "config", "user.email", "test@example.com" ],
+                 [ "git", "config", "user.name", "Test" ] ):
+        subprocess.check_call( cmd, cwd=repository )
+    local			= { "REMOTE_ADDR": "127.0.0.1" }
+    def refresh( environ=local, **queries ):
+        headers			= []
+        content, response	= orgserver.refresh_request(
+            repository, [ "project" ], queries=queries, environ=environ, headers=headers )
+        assert content == "application/json"
+        return json.loads( response )
+    def blobs():
+        return [ b.hexsha for b in orgserver.project_data( repository, [ "project" ] )[1]["project"] ]
+
+    for environ in ( {}, { "REMOTE_ADDR": "10.0.0.1" },
+                     dict( local, HTTP_X_FORWARDED_FOR="10.0.0.1" )):
+        try:
+            refresh( environ=environ )
+            assert False, "Refresh should be refused for %r" % ( environ )
+        except Exception, e:
+            assert str( e ).startswith( "403 " )
+    assert refresh( environ={ "orgserver.control": True } )["projects"] == { "project": 3 }
+
+    # Pulling new commits walks only those
+    head			= orgserver.repository_head( repository )
+    for day in 4, 5:
+        git_commit( origin, "project.org", project_org( "2012-03-%02d" % day, day - 1 ),
+                    "2012-03-%02d" % day )
+    assert refresh()["pulled"] is False			# Not yet pulled
+    commits			= orgserver.metric_commits.value()
+    result			= refresh( pull="1" )
+    assert result["pulled"] is True and result["previous"] == head
+    assert result["hexsha"] == orgserver.repository_head( origin )
+    assert result["projects"] == { "project": 5 }
+    assert orgserver.metric_commits.value() == commits + 2
+
+    # ... and finds what walking all of the history would
+    incremental			= blobs()
+    with orgserver.project_data.lock:
+        orgserver.project_data.hexsha = orgserver.project_data.previous = None
+    assert blobs() == incremental and len( incremental ) == 5
+
+    # A "master" that can't be fast-forwarded fails, and is left alone
+    git_commit( origin, "project.org", project_org( "2012-03-06", 5 ), "2012-03-06" )
+    git_commit( repository, "project.org", project_org( "2012-03-06", 6 ), "2012-03-06" )
+    head			= orgserver.repository_head( repository )
+    try:
+        refresh( pull="1" )
+        assert False, "Pull should fail, when diverged"
+    except Exception, e:
+        assert str( e ).startswith( "503 " )
+    assert orgserver.repository_head( repository ) == head
+
+
+def test_control( tmpdir ):
+    import socket
+    import stat
+    repository			= make_repo( tmpdir.join( "repo" ), days=2 )
+    path			= str( tmpdir.join( "control" ))
+    refreshed			= threading.Event()
+    httpd			= orgserver.control_server( path, repository, [ "project" ],
+                                                    refreshed=refreshed.set )
+    def request( method, uri ):
+        sock			= socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        sock.settimeout( 10 )
+        sock.connect( path )
+        sock.sendall( "%s %s HTTP/1.0\r\n\r\n" % ( method, uri ))
+        response		= ""
+        while True:
+            data		= sock.recv( 4096 )
+            if not data:
+                break
+            response	       += data
+        sock.close()
+        head, _, body		= response.partition( "\r\n\r\n" )
+        return int( head.split()[1] ), body
+    try:
+        assert stat.S_IMODE( os.stat( path ).st_mode ) & 0077 == 0
+        status, body		= request( "POST", "/api/refresh" )
+        assert status == 200
+        assert json.loads( body )["projects"] == { "project": 2 }
+        assert refreshed.is_set()
+        assert request( "GET", "/api/refresh" )[0] == 405
+        assert request( "POST", "/api/data/project" )[0] == 404
+    finally:
+        httpd.close()
+
+
+def test_reload( tmpdir ):
+    repository			= make_repo( tmpdir.join( "repo" ), days=4 )
+    path			= str( tmpdir.join( "caches" ))
+    hexsha, data		= orgserver.project_data( repository, [ "project" ] )
+    parsed			= orgserver.project_data_parse( data, "project" )
+    summaries			= len( orgserver.project_data_parse.cache )
+    orgserver.reload_save( path )
+
+    # A successor starts with the caches empty; it walks, and parses, nothing
+    cache			= orgserver.project_data_parse.cache
+    original			= dict( cache )
+    with orgserver.project_data.lock:
+        saved			= ( orgserver.project_data.hexsha, orgserver.project_data.result,
+                                    orgserver.project_data.previous )
+        orgserver.project_data.hexsha = orgserver.project_data.result = None
+    cache.clear()
+    try:
+        assert orgserver.reload_restore( path, repository ) == summaries
+        assert not os.path.exists( path )
+        commits			= orgserver.metric_commits.value()
+        misses			= orgserver.metric_misses.value( layer="blobs" )
+        restored		= orgserver.project_data( repository, [ "project" ] )[1]
+        assert [ b.hexsha for b in restored["project"] ] == [ b.hexsha for b in data["project"] ]
+        assert orgserver.project_data_parse( restored, "project" ) == parsed
+        assert orgserver.metric_commits.value() == commits
+        assert orgserver.metric_misses.value( layer="blobs" ) == misses
+        assert restored["project"][-1].data_stream.read() == data["project"][-1].data_stream.read()
+
+        # Caches saved in another form are ignored
+        version			= orgserver.reload_save.version
+        orgserver.reload_save( path )
+        orgserver.reload_save.version = version + 1
+        try:
+            assert orgserver.reload_restore( path, repository ) == 0
+        finally:
+            orgserver.reload_save.version = version
+        assert not os.path.exists( path )
+    finally:
+        cache.clear()
+        cache.update( original )
+        with orgserver.project_data.lock:
+            ( orgserver.project_data.hexsha, orgserver.project_data.result,
+              orgserver.project_data.previous ) = saved